@@ -0,0 +1,70 @@
+# Compares the WebSocket params of a multi-turn session with a large
+# screenshot sent inline as a data URL on every turn, and uploaded once to the
+# blob store and sent as a sha256: reference: bytes sent, and the time the
+# backend spends parsing the params (and resolving the reference).
+#
+# Usage: poetry run python -m benchmarks.blob_references
+
+import asyncio
+import base64
+import json
+import tempfile
+import time
+from typing import Any, Dict
+from benchmarks.message_translation import screenshot_data_url
+import mock_llm
+from blobs.core import BLOB_REFERENCE_PREFIX, BlobStore
+
+NUM_TURNS = 10
+
+
+def turn_params(image: str, turn: int) -> Dict[str, Any]:
+    return {
+        "generatedCodeConfig": "html_tailwind",
+        "inputMode": "image",
+        "generationType": "create" if turn == 0 else "update",
+        "image": image,
+        "history": [mock_llm.APPLE_MOCK_CODE, "Make the header blue"] * turn,
+    }
+
+
+async def receive(store: BlobStore | None, payload: str) -> Dict[str, Any]:
+    params = json.loads(payload)
+    if store is not None:
+        params = await store.resolve_params(params)
+    return params
+
+
+async def run_session(store: BlobStore | None, image: str) -> tuple[int, float]:
+    sent_bytes = 0
+    start_time = time.perf_counter()
+    for turn in range(NUM_TURNS):
+        payload = json.dumps(turn_params(image, turn))
+        sent_bytes += len(payload)
+        await receive(store, payload)
+    return sent_bytes, (time.perf_counter() - start_time) / NUM_TURNS * 1000
+
+
+def main():
+    data_url = screenshot_data_url(1920, 6000)
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = BlobStore(directory)
+        data = base64.b64decode(data_url.split(",", 1)[1])
+        upload_bytes = len(data)
+        reference = BLOB_REFERENCE_PREFIX + store.put(data, "image/png")
+
+        inline_bytes, inline_time = asyncio.run(run_session(None, data_url))
+        reference_bytes, reference_time = asyncio.run(run_session(store, reference))
+
+    print(f"{NUM_TURNS} turns with a {upload_bytes / 1e6:.1f}MB screenshot")
+    print(f"{'':<10} {'sent':>10} {'per turn':>12}")
+    print(f"{'inline':<10} {inline_bytes / 1e6:>8.1f}MB {inline_time:>9.2f} ms")
+    print(
+        f"{'reference':<10} {(reference_bytes + upload_bytes) / 1e6:>8.1f}MB"
+        f" {reference_time:>9.2f} ms"
+    )
+
+
+if __name__ == "__main__":
+    main()
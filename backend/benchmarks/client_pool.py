@@ -0,0 +1,86 @@
+# Compares time-to-first-token of a fresh AsyncOpenAI client per call (the old
+# behaviour) against the pooled client registry, using a local stub server.
+#
+# Usage: poetry run python -m benchmarks.client_pool
+
+import asyncio
+import statistics
+import time
+from openai import AsyncOpenAI
+from clients.core import client_registry
+from llm import Llm, stream_openai_response
+from stub_llm_server import StubLlmServer
+
+NUM_REQUESTS = 30
+TOKENS = ["<html>", "<body>", "Hello", "</body>", "</html>"]
+MESSAGES = [{"role": "user", "content": "Hello"}]
+
+
+async def fresh_client_ttft(base_url: str) -> float:
+    start_time = time.perf_counter()
+    client = AsyncOpenAI(api_key="stub", base_url=base_url)
+    stream = await client.chat.completions.create(
+        model=Llm.GPT_4O_2024_11_20.value,
+        messages=MESSAGES,  # type: ignore
+        stream=True,
+    )
+    ttft = 0.0
+    async for _ in stream:
+        if not ttft:
+            ttft = time.perf_counter() - start_time
+    await client.close()
+    return ttft
+
+
+async def pooled_client_ttft(base_url: str) -> float:
+    start_time = time.perf_counter()
+    ttft = 0.0
+
+    async def callback(_: str):
+        nonlocal ttft
+        if not ttft:
+            ttft = time.perf_counter() - start_time
+
+    await stream_openai_response(
+        MESSAGES,  # type: ignore
+        api_key="stub",
+        base_url=base_url,
+        callback=callback,
+        model=Llm.GPT_4O_2024_11_20,
+    )
+    return ttft
+
+
+def report(name: str, samples: list[float], connections: int):
+    samples_ms = sorted(sample * 1000 for sample in samples)
+    p50 = statistics.median(samples_ms)
+    p90 = samples_ms[int(len(samples_ms) * 0.9) - 1]
+    print(
+        f"{name:<14} TTFT p50 = {p50:7.2f} ms, p90 = {p90:7.2f} ms, connections opened = {connections}"
+    )
+
+
+async def main():
+    server = StubLlmServer(TOKENS)
+    await server.start()
+
+    fresh_samples = [
+        await fresh_client_ttft(server.base_url) for _ in range(NUM_REQUESTS)
+    ]
+    report("fresh client", fresh_samples, server.connections_opened)
+
+    server.connections_opened = 0
+    pooled_samples = [
+        await pooled_client_ttft(server.base_url) for _ in range(NUM_REQUESTS)
+    ]
+    report("pooled client", pooled_samples, server.connections_opened)
+
+    saved = statistics.median(fresh_samples) - statistics.median(pooled_samples)
+    print(f"Median TTFT saved per request: {saved * 1000:.2f} ms")
+
+    await client_registry.close()
+    await server.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
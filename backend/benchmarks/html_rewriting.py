@@ -0,0 +1,126 @@
+# Compares the previous BeautifulSoup (html.parser + prettify) implementation of
+# the image generation HTML passes with the single-pass img tag tokenizer on the
+# mock pages in mock_llm.py (and a large page built by repeating them).
+#
+# Usage: poetry run python -m benchmarks.html_rewriting
+
+import time
+from typing import Callable, Dict, List
+from bs4 import BeautifulSoup
+import mock_llm
+from image_generation.core import (
+    create_alt_url_mapping,
+    extract_dimensions,
+    extract_image_prompts,
+    replace_image_urls,
+)
+
+PAGES = {
+    "apple": mock_llm.APPLE_MOCK_CODE,
+    "nytimes": mock_llm.NYTIMES_MOCK_CODE,
+    "google_form": mock_llm.GOOGLE_FORM_VIDEO_PROMPT_MOCK,
+    "tally_form": mock_llm.TALLY_FORM_VIDEO_PROMPT_MOCK,
+    "all_x20": "".join(
+        [
+            mock_llm.APPLE_MOCK_CODE,
+            mock_llm.NYTIMES_MOCK_CODE,
+            mock_llm.GOOGLE_FORM_VIDEO_PROMPT_MOCK,
+            mock_llm.TALLY_FORM_VIDEO_PROMPT_MOCK,
+        ]
+        * 20
+    ),
+}
+
+ITERATIONS = 20
+
+
+# The previous implementations (reproduced for comparison)
+def legacy_create_alt_url_mapping(code: str) -> Dict[str, str]:
+    soup = BeautifulSoup(code, "html.parser")
+    mapping: Dict[str, str] = {}
+    for image in soup.find_all("img"):
+        if not image["src"].startswith("https://placehold.co"):
+            mapping[image["alt"]] = image["src"]
+    return mapping
+
+
+def legacy_extract_image_prompts(code: str, image_cache: Dict[str, str]) -> List[str]:
+    soup = BeautifulSoup(code, "html.parser")
+    alts: List[str] = []
+    for img in soup.find_all("img"):
+        if (
+            img["src"].startswith("https://placehold.co")
+            and image_cache.get(img.get("alt")) is None
+            and img.get("alt") is not None
+        ):
+            alts.append(img.get("alt"))
+    return list(set(alts))
+
+
+def legacy_replace_image_urls(
+    code: str, mapped_image_urls: Dict[str, str | None]
+) -> str:
+    soup = BeautifulSoup(code, "html.parser")
+    for img in soup.find_all("img"):
+        if not img["src"].startswith("https://placehold.co"):
+            continue
+        new_url = mapped_image_urls[img.get("alt")]
+        if new_url:
+            width, height = extract_dimensions(img["src"])
+            img["width"] = width
+            img["height"] = height
+            img["src"] = new_url
+    return soup.prettify()
+
+
+# Every HTML pass image generation does on a page
+def run_passes(
+    code: str,
+    create_mapping: Callable[[str], Dict[str, str]],
+    extract_prompts: Callable[[str, Dict[str, str]], List[str]],
+    replace_urls: Callable[[str, Dict[str, str | None]], str],
+) -> str:
+    create_mapping(code)
+    prompts = extract_prompts(code, {})
+    mapped_image_urls: Dict[str, str | None] = {
+        prompt: f"https://example.com/{index}.png"
+        for index, prompt in enumerate(prompts)
+    }
+    return replace_urls(code, mapped_image_urls)
+
+
+def measure(func: Callable[[], str]) -> tuple[float, str]:
+    output = func()
+    start_time = time.perf_counter()
+    for _ in range(ITERATIONS):
+        func()
+    return ((time.perf_counter() - start_time) / ITERATIONS * 1000, output)
+
+
+def main():
+    print(f"{'page':<12} {'size':>8} {'beautifulsoup':>15} {'tokenizer':>11}")
+    for name, code in PAGES.items():
+        legacy_time, legacy_output = measure(
+            lambda: run_passes(
+                code,
+                legacy_create_alt_url_mapping,
+                legacy_extract_image_prompts,
+                legacy_replace_image_urls,
+            )
+        )
+        new_time, new_output = measure(
+            lambda: run_passes(
+                code, create_alt_url_mapping, extract_image_prompts, replace_image_urls
+            )
+        )
+
+        changed_bytes = abs(len(new_output) - len(code))
+        print(
+            f"{name:<12} {len(code):>8} {legacy_time:>12.2f} ms {new_time:>8.2f} ms"
+            f"   output size {len(legacy_output)} / {len(new_output)}"
+            f" (input {len(code)}, {changed_bytes} bytes changed by tokenizer)"
+        )
+
+
+if __name__ == "__main__":
+    main()
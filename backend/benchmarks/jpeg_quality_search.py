@@ -0,0 +1,86 @@
+# Compares the previous linear JPEG quality loop in process_image with the
+# bisection search in compress_jpeg on large synthetic screenshots.
+#
+# Usage: poetry run python -m benchmarks.jpeg_quality_search
+
+import io
+import time
+import numpy as np
+from PIL import Image, ImageDraw
+from image_processing.utils import (
+    CLAUDE_IMAGE_MAX_SIZE,
+    base64_size,
+    compress_jpeg,
+    encode_jpeg,
+)
+
+# (width, height, number of photo-like blocks)
+SCREENSHOTS = [
+    (1920, 7900, 10),
+    (2400, 7000, 30),
+    (3840, 7900, 60),
+    (7900, 7900, 120),
+]
+
+
+def synthetic_screenshot(width: int, height: int, num_photos: int) -> Image.Image:
+    rng = np.random.default_rng(0)
+    img = Image.new("RGB", (width, height), (245, 245, 245))
+    draw = ImageDraw.Draw(img)
+
+    # Text-like blocks
+    for _ in range(width * height // 4000):
+        x = int(rng.integers(0, width - 200))
+        y = int(rng.integers(0, height - 20))
+        color = tuple(int(c) for c in rng.integers(0, 255, 3))
+        draw.rectangle(
+            (x, y, x + int(rng.integers(20, 200)), y + int(rng.integers(5, 20))),
+            fill=color,
+        )
+
+    # Photo-like (hard to compress) blocks
+    for _ in range(num_photos):
+        x = int(rng.integers(0, width - 400))
+        y = int(rng.integers(0, height - 300))
+        noise = rng.integers(0, 255, (300, 400, 3), dtype=np.uint8)
+        img.paste(Image.fromarray(noise), (x, y))
+
+    return img
+
+
+# The loop process_image used before (reproduced for comparison)
+def linear_quality_search(img: Image.Image, max_size: int) -> tuple[bytes, int]:
+    quality = 95
+    output = encode_jpeg(img, quality)
+    num_encodes = 1
+    while base64_size(len(output)) > max_size and quality > 10:
+        output = encode_jpeg(img, quality)
+        num_encodes += 1
+        quality -= 5
+    return (output, num_encodes)
+
+
+def main():
+    print(
+        f"{'screenshot':<12} {'linear':>24} {'bisection':>24}   size (linear / bisection)"
+    )
+    for width, height, num_photos in SCREENSHOTS:
+        img = synthetic_screenshot(width, height, num_photos)
+        results: list[tuple[bytes, int, float]] = []
+        for search in (linear_quality_search, compress_jpeg):
+            start_time = time.perf_counter()
+            output, num_encodes = search(img, CLAUDE_IMAGE_MAX_SIZE)
+            results.append((output, num_encodes, time.perf_counter() - start_time))
+
+        linear, linear_encodes, linear_time = results[0]
+        bisect, bisect_encodes, bisect_time = results[1]
+        print(
+            f"{width}x{height:<7} "
+            f"{linear_encodes:>6} encodes {linear_time:>7.2f}s "
+            f"{bisect_encodes:>8} encodes {bisect_time:>7.2f}s   "
+            f"{base64_size(len(linear))} / {base64_size(len(bisect))}"
+        )
+
+
+if __name__ == "__main__":
+    main()
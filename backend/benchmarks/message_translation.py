@@ -0,0 +1,124 @@
+# Compares translating an update request's history (a large screenshot and ten
+# turns of generated code) for Claude with the previous approach (deep copy the
+# messages, then rewrite the image parts in place) and the current one (share
+# everything that doesn't need converting, memoize converted images). Each
+# request is translated once per variant, as the /generate-code route does.
+#
+# Usage: poetry run python -m benchmarks.message_translation
+
+import asyncio
+import base64
+import copy
+import io
+import os
+import time
+import tracemalloc
+from typing import Any, Callable, Coroutine, List, cast
+from PIL import Image
+import mock_llm
+from executors.core import cpu_executor
+from image_processing.cache import processed_image_cache
+from image_processing.utils import process_image
+from message_translation.core import image_conversion_cache, to_anthropic_messages
+
+# (width, height) of the screenshot
+SCREENSHOTS = [(1280, 2000), (1920, 6000)]
+NUM_TURNS = 10
+NUM_VARIANTS = 2
+ITERATIONS = 20
+
+
+def screenshot_data_url(width: int, height: int) -> str:
+    # Noise so that the PNG doesn't compress to nothing, like a real screenshot
+    image = Image.frombytes("RGB", (width, height), os.urandom(width * height * 3))
+    output = io.BytesIO()
+    image.save(output, format="PNG")
+    return "data:image/png;base64," + base64.b64encode(output.getvalue()).decode()
+
+
+def update_history(image_url: str) -> List[Any]:
+    messages: List[Any] = [
+        {"role": "system", "content": "You are an expert developer"},
+        {
+            "role": "user",
+            "content": [
+                {"type": "image_url", "image_url": {"url": image_url}},
+                {"type": "text", "text": "Generate code for this screenshot"},
+            ],
+        },
+    ]
+    for turn in range(NUM_TURNS):
+        messages.append({"role": "assistant", "content": mock_llm.APPLE_MOCK_CODE})
+        messages.append({"role": "user", "content": f"Change number {turn}"})
+    return messages
+
+
+# The previous implementation (reproduced for comparison)
+async def legacy_to_anthropic_messages(messages: List[Any]) -> tuple[str, List[Any]]:
+    cloned_messages = copy.deepcopy(messages)
+
+    system_prompt = cast(str, cloned_messages[0].get("content"))
+    claude_messages = [dict(message) for message in cloned_messages[1:]]
+    for message in claude_messages:
+        if not isinstance(message["content"], list):
+            continue
+
+        for content in message["content"]:
+            if content["type"] == "image_url":
+                content["type"] = "image"
+                image_data_url = cast(str, content["image_url"]["url"])
+                media_type, base64_data = await cpu_executor.run(
+                    process_image, image_data_url
+                )
+                del content["image_url"]
+                content["source"] = {
+                    "type": "base64",
+                    "media_type": media_type,
+                    "data": base64_data,
+                }
+    return (system_prompt, claude_messages)
+
+
+def measure(
+    translate: Callable[[List[Any]], Coroutine[Any, Any, Any]], messages: List[Any]
+) -> tuple[float, float]:
+    async def run_request():
+        for _ in range(NUM_VARIANTS):
+            await translate(messages)
+
+    # Warm up the image caches (both paths share the processed image cache)
+    asyncio.run(run_request())
+
+    start_time = time.perf_counter()
+    for _ in range(ITERATIONS):
+        asyncio.run(run_request())
+    elapsed_ms = (time.perf_counter() - start_time) / ITERATIONS * 1000
+
+    tracemalloc.start()
+    asyncio.run(run_request())
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return (elapsed_ms, peak / 1024)
+
+
+def main():
+    print(f"{'screenshot':<12} {'url size':>10} {'deepcopy':>22} {'shared':>22}")
+    for width, height in SCREENSHOTS:
+        image_url = screenshot_data_url(width, height)
+        messages = update_history(image_url)
+        processed_image_cache.clear()
+        image_conversion_cache.clear()
+
+        legacy_time, legacy_peak = measure(legacy_to_anthropic_messages, messages)
+        new_time, new_peak = measure(to_anthropic_messages, messages)
+
+        print(
+            f"{width}x{height:<7} {len(image_url) / 1e6:>8.1f}MB"
+            f" {legacy_time:>8.2f} ms {legacy_peak:>8.0f} KB"
+            f" {new_time:>8.2f} ms {new_peak:>8.0f} KB"
+        )
+    cpu_executor.shutdown()
+
+
+if __name__ == "__main__":
+    main()
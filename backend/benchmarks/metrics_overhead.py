@@ -0,0 +1,48 @@
+# Measures the cost of recording metrics on the hot path (a histogram
+# observation per WebSocket send and streamed token) compared to the time it
+# takes to stream a chunk, and the cost of rendering /metrics.
+#
+# Usage: poetry run python -m benchmarks.metrics_overhead
+
+import time
+from metrics.core import Histogram, MetricsRegistry
+
+ITERATIONS = 200_000
+NUM_MODELS = 4
+
+
+def nanoseconds_per_call(func: object, iterations: int = ITERATIONS) -> float:
+    assert callable(func)
+    start_time = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - start_time) / iterations * 1e9
+
+
+def time_block(histogram: Histogram):
+    with histogram.time(type="chunk"):
+        pass
+
+
+def main():
+    registry = MetricsRegistry()
+    histogram = registry.histogram("send_seconds", "Send time", ["type"])
+    counter = registry.counter("requests", "Requests", ["mode"])
+
+    baseline = nanoseconds_per_call(lambda: None)
+    observe = nanoseconds_per_call(lambda: histogram.observe(0.003, type="chunk"))
+    timed = nanoseconds_per_call(lambda: time_block(histogram))
+    increment = nanoseconds_per_call(lambda: counter.inc(mode="image"))
+
+    print(f"Histogram observe:  {observe - baseline:8.0f} ns")
+    print(f"Histogram time():   {timed - baseline:8.0f} ns")
+    print(f"Counter inc:        {increment - baseline:8.0f} ns")
+
+    for index in range(NUM_MODELS):
+        histogram.observe(0.5, type=f"model-{index}")
+    render = nanoseconds_per_call(registry.render, 1000)
+    print(f"Render /metrics:    {render / 1000:8.1f} µs")
+
+
+if __name__ == "__main__":
+    main()
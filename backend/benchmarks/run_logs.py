@@ -0,0 +1,72 @@
+# Compares the time the event loop spends writing run logs for update requests
+# with a large screenshot: the previous write_logs (serialize the whole prompt
+# and write a JSON file synchronously) and the background writer (queue the
+# record). Also reports the disk space used by each.
+#
+# Usage: poetry run python -m benchmarks.run_logs
+
+import json
+import os
+import tempfile
+import time
+from datetime import datetime
+from typing import Any, List
+from benchmarks.message_translation import screenshot_data_url, update_history
+import mock_llm
+from fs_logging.core import RunLogWriter
+
+NUM_RUNS = 20
+
+
+# The previous implementation (reproduced for comparison, with a unique
+# filename so that runs in the same second don't overwrite each other)
+def legacy_write_logs(directory: str, run: int, prompt_messages: List[Any]):
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    filename = datetime.now().strftime(f"{directory}/messages_%Y%m%d_%H%M%S_{run}.json")
+    with open(filename, "w") as f:
+        f.write(
+            json.dumps(
+                {"prompt": prompt_messages, "completion": mock_llm.APPLE_MOCK_CODE}
+            )
+        )
+
+
+def directory_size(directory: str) -> int:
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(directory)
+        for name in names
+    )
+
+
+def main():
+    messages = update_history(screenshot_data_url(1920, 6000))
+
+    with tempfile.TemporaryDirectory() as directory:
+        legacy_directory = os.path.join(directory, "legacy")
+        start_time = time.perf_counter()
+        for run in range(NUM_RUNS):
+            legacy_write_logs(legacy_directory, run, messages)
+        legacy_time = (time.perf_counter() - start_time) / NUM_RUNS * 1000
+
+        writer = RunLogWriter(os.path.join(directory, "background"))
+        start_time = time.perf_counter()
+        for _ in range(NUM_RUNS):
+            writer.write(messages, mock_llm.APPLE_MOCK_CODE)
+        queue_time = (time.perf_counter() - start_time) / NUM_RUNS * 1000
+        writer.close()
+
+        print(f"{'':<12} {'event loop':>12} {'disk':>10}")
+        print(
+            f"{'synchronous':<12} {legacy_time:>9.2f} ms"
+            f" {directory_size(legacy_directory) / 1e6:>7.1f}MB"
+        )
+        print(
+            f"{'background':<12} {queue_time:>9.2f} ms"
+            f" {directory_size(writer.directory) / 1e6:>7.1f}MB"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+# Compares frame extraction modes of split_video_into_screenshots on generated
+# test videos of different lengths, resolutions and keyframe intervals.
+#
+# Usage: poetry run python -m benchmarks.video_frame_extraction
+
+import base64
+import os
+import subprocess
+import tempfile
+import time
+from typing import get_args
+from moviepy.config import get_setting  # type: ignore
+from video.utils import FrameExtractionMode, split_video_into_screenshots
+
+# (duration in seconds, resolution, fps, keyframe interval in frames)
+VIDEOS = [
+    (10, "1280x720", 30, 30),
+    (60, "1280x720", 60, 60),
+    (60, "1280x720", 60, 250),
+    (30, "1920x1080", 30, 30),
+    (120, "1920x1080", 30, 30),
+]
+
+
+def generate_video(
+    path: str, duration: int, resolution: str, fps: int, keyframe_interval: int
+):
+    subprocess.run(
+        [
+            get_setting("FFMPEG_BINARY"),
+            "-loglevel",
+            "error",
+            "-y",
+            "-f",
+            "lavfi",
+            "-i",
+            f"testsrc=duration={duration}:size={resolution}:rate={fps}",
+            "-c:v",
+            "libx264",
+            "-preset",
+            "ultrafast",
+            "-g",
+            str(keyframe_interval),
+            "-pix_fmt",
+            "yuv420p",
+            path,
+        ],
+        check=True,
+    )
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for duration, resolution, fps, keyframe_interval in VIDEOS:
+            path = os.path.join(tmp_dir, "video.mp4")
+            generate_video(path, duration, resolution, fps, keyframe_interval)
+            with open(path, "rb") as f:
+                base64_data = base64.b64encode(f.read()).decode("utf-8")
+            data_url = "data:video/mp4;base64," + base64_data
+
+            results: list[str] = []
+            for mode in get_args(FrameExtractionMode):
+                start_time = time.perf_counter()
+                frames = split_video_into_screenshots(data_url, mode=mode)
+                duration_taken = time.perf_counter() - start_time
+                results.append(f"{mode} {duration_taken:6.2f}s ({len(frames)} frames)")
+
+            print(
+                f"{duration:>4}s {resolution:>9} @{fps}fps gop={keyframe_interval:<4} "
+                + " | ".join(results)
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+# Compares peak memory (max RSS) of preparing an uploaded video for Claude with
+# the previous approach (decode the whole video into one bytes object, keep every
+# frame as a PIL image and JPEG-encode them at the end) and the current one
+# (decode in chunks straight into the temp file, JPEG-encode frames as they're
+# decoded). Each variant runs in its own subprocess so peaks don't mix.
+#
+# Usage: poetry run python -m benchmarks.video_memory
+
+import asyncio
+import base64
+import io
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any
+from moviepy.editor import VideoFileClip  # type: ignore
+from PIL import Image
+from benchmarks.video_frame_extraction import generate_video
+from video.utils import (
+    TARGET_NUM_SCREENSHOTS,
+    assemble_claude_prompt_video,
+    extract_keyframes,
+    select_distinct_frames,
+)
+
+# (duration in seconds, resolution, fps, keyframe interval in frames)
+VIDEOS = [
+    (30, "1280x720", 30, 30),
+    (60, "1920x1080", 30, 30),
+    (120, "1920x1080", 30, 30),
+]
+
+VARIANTS = ["legacy", "current"]
+
+
+def max_rss_mb() -> float:
+    # ru_maxrss is in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+# The previous handling of the data URL and frames (reproduced for comparison)
+def legacy_prompt(video_data_url: str) -> list[Any]:
+    video_bytes = base64.b64decode(video_data_url.split(",")[1])
+    images: list[Image.Image] = []
+    with tempfile.NamedTemporaryFile(suffix=".mp4") as temp_video_file:
+        temp_video_file.write(video_bytes)
+        temp_video_file.flush()
+        # Decode the same frames as the current path so only memory handling differs
+        clip = VideoFileClip(temp_video_file.name, audio=False)
+        frames = extract_keyframes(clip, TARGET_NUM_SCREENSHOTS * 2)
+        clip.close()
+        for frame in select_distinct_frames(frames, TARGET_NUM_SCREENSHOTS):
+            images.append(Image.open(io.BytesIO(frame.jpeg)).convert("RGB"))
+    content: list[dict[str, Any]] = []
+    for image in images:
+        buffered = io.BytesIO()
+        image.save(buffered, format="JPEG")
+        content.append({"data": base64.b64encode(buffered.getvalue()).decode()})
+    return content
+
+
+def run_variant(variant: str, path: str):
+    with open(path, "rb") as f:
+        data_url = "data:video/mp4;base64," + base64.b64encode(f.read()).decode()
+    baseline = max_rss_mb()
+
+    start_time = time.perf_counter()
+    if variant == "legacy":
+        legacy_prompt(data_url)
+    else:
+        asyncio.run(assemble_claude_prompt_video(data_url))
+    duration = time.perf_counter() - start_time
+
+    print(f"{max_rss_mb() - baseline:.1f} {duration:.2f}")
+
+
+def main():
+    print(f"Target frames: {TARGET_NUM_SCREENSHOTS}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for duration, resolution, fps, keyframe_interval in VIDEOS:
+            path = os.path.join(tmp_dir, "video.mp4")
+            generate_video(path, duration, resolution, fps, keyframe_interval)
+            size_mb = os.path.getsize(path) / 1024 / 1024
+
+            results: list[str] = []
+            for variant in VARIANTS:
+                output = subprocess.run(
+                    [sys.executable, "-m", "benchmarks.video_memory", variant, path],
+                    capture_output=True,
+                    text=True,
+                    check=True,
+                ).stdout.split()
+                peak, taken = output[-2], output[-1]
+                results.append(f"{variant} +{peak:>6} MB peak RSS {taken:>5}s")
+
+            print(
+                f"{duration:>4}s {resolution:>9} ({size_mb:5.1f} MB) "
+                + " | ".join(results)
+            )
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3:
+        run_variant(sys.argv[1], sys.argv[2])
+    else:
+        main()
@@ -0,0 +1,108 @@
+# Load benchmark for the /generate-code chunk protocol: streams synthetic tokens
+# for two variants over a real WebSocket to many concurrent clients, with and
+# without chunk batching, and reports frames/sec and bytes/sec.
+#
+# Usage: poetry run python -m benchmarks.ws_chunk_batching
+
+import asyncio
+import time
+import uvicorn
+import websockets
+from fastapi import FastAPI, WebSocket
+from mock_llm import NYTIMES_MOCK_CODE
+from ws.chunk_batcher import ChunkBatcher
+
+NUM_CLIENTS = 20
+NUM_VARIANTS = 2
+TOKEN_SIZE = 4
+# Time between tokens from the (simulated) provider stream
+TOKEN_INTERVAL_SECONDS = 0.001
+PORT = 7099
+
+app = FastAPI()
+
+
+@app.websocket("/stream")
+async def stream(websocket: WebSocket):
+    await websocket.accept()
+    params = await websocket.receive_json()
+
+    chunk_batcher = (
+        ChunkBatcher(websocket.send_json)
+        if params.get("isChunkBatchingEnabled")
+        else None
+    )
+
+    async def process_chunk(content: str, variantIndex: int):
+        if chunk_batcher:
+            await chunk_batcher.add(content, variantIndex)
+        else:
+            await websocket.send_json(
+                {"type": "chunk", "value": content, "variantIndex": variantIndex}
+            )
+
+    async def stream_variant(variant_index: int):
+        for i in range(0, len(NYTIMES_MOCK_CODE), TOKEN_SIZE):
+            await process_chunk(NYTIMES_MOCK_CODE[i : i + TOKEN_SIZE], variant_index)
+            await asyncio.sleep(TOKEN_INTERVAL_SECONDS)
+
+    await asyncio.gather(*[stream_variant(i) for i in range(NUM_VARIANTS)])
+    if chunk_batcher:
+        await chunk_batcher.flush()
+    await websocket.close()
+
+
+async def run_client(is_batching_enabled: bool) -> tuple[int, int]:
+    frames = 0
+    num_bytes = 0
+    async with websockets.connect(f"ws://127.0.0.1:{PORT}/stream") as ws:
+        await ws.send(
+            '{"isChunkBatchingEnabled": true}'
+            if is_batching_enabled
+            else '{"isChunkBatchingEnabled": false}'
+        )
+        try:
+            async for message in ws:
+                frames += 1
+                num_bytes += len(message)
+        except websockets.ConnectionClosed:
+            pass
+    return frames, num_bytes
+
+
+async def run_load(is_batching_enabled: bool):
+    start_time = time.perf_counter()
+    cpu_start_time = time.process_time()
+    results = await asyncio.gather(
+        *[run_client(is_batching_enabled) for _ in range(NUM_CLIENTS)]
+    )
+    duration = time.perf_counter() - start_time
+    cpu_time = time.process_time() - cpu_start_time
+
+    frames = sum(result[0] for result in results)
+    num_bytes = sum(result[1] for result in results)
+    name = "batched" if is_batching_enabled else "per-chunk"
+    print(
+        f"{name:<10} frames = {frames:6d} ({frames / duration:8.0f}/s), "
+        f"bytes = {num_bytes:8d} ({num_bytes / duration / 1024:7.0f} KiB/s), "
+        f"wall = {duration:.2f}s, cpu = {cpu_time:.2f}s"
+    )
+
+
+async def main():
+    config = uvicorn.Config(app, port=PORT, log_level="warning")
+    server = uvicorn.Server(config)
+    server_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+
+    print(f"{NUM_CLIENTS} concurrent clients, {NUM_VARIANTS} variants each")
+    await run_load(is_batching_enabled=False)
+    await run_load(is_batching_enabled=True)
+
+    server.should_exit = True
+    await server_task
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,204 @@
+import asyncio
+import base64
+import hashlib
+import os
+import re
+import threading
+from dataclasses import dataclass
+from typing import Any
+from caching.lru import LruCache
+from config import BLOB_MAX_BYTES, BLOB_STORE_MAX_BYTES, BLOB_STORE_PATH
+from executors.core import run_blocking
+from metrics.core import Counters
+from utils import atomic_write
+
+# Clients refer to uploaded blobs as "sha256:<hex digest of the content>"
+BLOB_REFERENCE_PREFIX = "sha256:"
+DIGEST_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+# Request params that can be a blob reference instead of a data URL
+BLOB_PARAMS = ("image", "resultImage")
+
+# What clients can upload: screenshots and screen recordings (the media type
+# ends up in a data URL, so it can't be anything the client sends)
+ALLOWED_MEDIA_TYPES = frozenset(
+    [
+        "image/png",
+        "image/jpeg",
+        "image/webp",
+        "image/gif",
+        "video/mp4",
+        "video/webm",
+        "video/quicktime",
+    ]
+)
+
+# Upper bound on the total size of the data URLs kept in memory
+DATA_URL_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+
+class BlobNotFoundError(KeyError):
+    """A blob reference to a blob that isn't (or is no longer) stored."""
+
+
+def data_url_size(digest: str, data_url: str) -> int:
+    return len(digest) + len(data_url)
+
+
+def is_valid_digest(digest: str) -> bool:
+    return DIGEST_PATTERN.match(digest) is not None
+
+
+def is_blob_reference(value: Any) -> bool:
+    return isinstance(value, str) and value.startswith(BLOB_REFERENCE_PREFIX)
+
+
+@dataclass
+class BlobStoreCounters(Counters):
+    uploads: int = 0
+    # Uploads of blobs that were already stored
+    duplicate_uploads: int = 0
+    evictions: int = 0
+
+
+class BlobStore:
+    """
+    Content-addressed store for uploaded screenshots and videos, on local disk
+    and keyed by the SHA-256 of their content. Clients upload an image once
+    and then refer to it by hash, so multi-turn sessions don't resend it.
+
+    Each blob is a file with its media type on the first line. The least
+    recently used blobs are deleted once the store exceeds max_bytes. Recently
+    resolved data URLs are also kept in memory, so that every request for the
+    same blob gets the same string (and hits the image caches keyed by it).
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        max_bytes: int = BLOB_STORE_MAX_BYTES,
+        max_blob_bytes: int = BLOB_MAX_BYTES,
+        max_cached_bytes: int = DATA_URL_CACHE_MAX_BYTES,
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_blob_bytes = max_blob_bytes
+        self.max_cached_bytes = max_cached_bytes
+        self.lock = threading.Lock()
+        # Total size on disk (computed on first use)
+        self.total_bytes: int | None = None
+        self.data_urls: LruCache[str, str] = LruCache(max_cached_bytes, data_url_size)
+        self.counters = BlobStoreCounters()
+
+    def path(self, digest: str) -> str:
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def ensure_total_bytes(self) -> int:
+        if self.total_bytes is None:
+            self.total_bytes = sum(size for _, size, _ in self.scan())
+        return self.total_bytes
+
+    # (path, size, last used) of every stored blob
+    def scan(self) -> list[tuple[str, int, float]]:
+        blobs: list[tuple[str, int, float]] = []
+        if not os.path.isdir(self.directory):
+            return blobs
+        for prefix in os.scandir(self.directory):
+            if not prefix.is_dir():
+                continue
+            for entry in os.scandir(prefix.path):
+                if is_valid_digest(entry.name):
+                    stat = entry.stat()
+                    blobs.append((entry.path, stat.st_size, stat.st_mtime))
+        return blobs
+
+    def put(self, data: bytes, media_type: str) -> str:
+        if len(data) > self.max_blob_bytes:
+            raise ValueError(
+                f"Blob is too large ({len(data)} bytes, the maximum is {self.max_blob_bytes})"
+            )
+        if media_type not in ALLOWED_MEDIA_TYPES:
+            raise ValueError(f"Unsupported media type: {media_type!r}")
+
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path(digest)
+        with self.lock:
+            self.counters.uploads += 1
+            if os.path.exists(path):
+                self.counters.duplicate_uploads += 1
+                os.utime(path)
+                return digest
+
+            total_bytes = self.ensure_total_bytes()
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            atomic_write(path, media_type.encode("utf-8") + b"\n" + data)
+
+            self.total_bytes = total_bytes + os.path.getsize(path)
+            if self.total_bytes > self.max_bytes:
+                self.evict()
+        return digest
+
+    # Delete the least recently used blobs until the store fits in max_bytes
+    def evict(self):
+        assert self.total_bytes is not None
+        for path, size, _ in sorted(self.scan(), key=lambda blob: blob[2]):
+            if self.total_bytes <= self.max_bytes:
+                break
+            os.remove(path)
+            self.total_bytes -= size
+            self.counters.evictions += 1
+            self.data_urls.pop(os.path.basename(path))
+
+    def exists(self, digest: str) -> bool:
+        return is_valid_digest(digest) and os.path.exists(self.path(digest))
+
+    # Returns the (media type, data) of a blob
+    def get(self, digest: str) -> tuple[str, bytes]:
+        if not is_valid_digest(digest):
+            raise BlobNotFoundError(digest)
+        path = self.path(digest)
+        try:
+            with open(path, "rb") as f:
+                content = f.read()
+            # Mark as recently used (for eviction)
+            os.utime(path)
+        except FileNotFoundError:
+            raise BlobNotFoundError(digest)
+        media_type, _, data = content.partition(b"\n")
+        return (media_type.decode("utf-8"), data)
+
+    def get_data_url(self, digest: str) -> str:
+        data_url = self.data_urls.get(digest)
+        if data_url is None:
+            media_type, data = self.get(digest)
+            data_url = f"data:{media_type};base64,{base64.b64encode(data).decode()}"
+            self.data_urls.put(digest, data_url)
+        return data_url
+
+    # Replace blob references in the request params with their data URLs
+    async def resolve_params(self, params: dict[str, Any]) -> dict[str, Any]:
+        references = {
+            key: params[key][len(BLOB_REFERENCE_PREFIX) :]
+            for key in BLOB_PARAMS
+            if is_blob_reference(params.get(key))
+        }
+        if not references:
+            return params
+
+        data_urls = await asyncio.gather(
+            *[run_blocking(self.get_data_url, digest) for digest in references.values()]
+        )
+        return {**params, **dict(zip(references.keys(), data_urls))}
+
+    def stats(self) -> dict[str, float]:
+        with self.lock:
+            return {
+                "bytes": self.total_bytes or 0,
+                **self.counters.stats(),
+                "data_url_cache_hits": self.data_urls.counters.hits,
+                "data_url_cache_misses": self.data_urls.counters.misses,
+                "data_url_cache_bytes": self.data_urls.total_size,
+            }
+
+
+blob_store = BlobStore(BLOB_STORE_PATH)
@@ -0,0 +1,141 @@
+import asyncio
+import base64
+import hashlib
+import os
+import time
+from pathlib import Path
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from blobs.core import BlobNotFoundError, BlobStore
+import routes.blobs
+import routes.generate_code
+from ws.constants import BLOB_NOT_FOUND_WEB_SOCKET_CODE
+
+PNG_BYTES = b"\x89PNG\r\n\x1a\nfake screenshot"
+PNG_DIGEST = hashlib.sha256(PNG_BYTES).hexdigest()
+
+
+def test_blobs_are_stored_once_by_content_hash(tmp_path: Path):
+    store = BlobStore(str(tmp_path))
+
+    assert store.put(PNG_BYTES, "image/png") == PNG_DIGEST
+    assert store.put(PNG_BYTES, "image/png") == PNG_DIGEST
+    assert store.exists(PNG_DIGEST)
+    assert store.get(PNG_DIGEST) == ("image/png", PNG_BYTES)
+    assert store.stats()["duplicate_uploads"] == 1
+    assert os.listdir(tmp_path / PNG_DIGEST[:2]) == [PNG_DIGEST]
+
+
+def test_references_in_params_are_resolved_to_data_urls(tmp_path: Path):
+    store = BlobStore(str(tmp_path))
+    store.put(PNG_BYTES, "image/png")
+    params = {
+        "image": f"sha256:{PNG_DIGEST}",
+        "resultImage": "data:image/png;base64,AAAA",
+        "history": ["<html></html>"],
+    }
+
+    resolved = asyncio.run(store.resolve_params(params))
+    resolved_again = asyncio.run(store.resolve_params(params))
+
+    assert resolved["image"] == (
+        "data:image/png;base64," + base64.b64encode(PNG_BYTES).decode()
+    )
+    # The same string, so that caches keyed by the data URL hit
+    assert resolved_again["image"] is resolved["image"]
+    assert resolved["resultImage"] == params["resultImage"]
+    assert resolved["history"] == params["history"]
+    assert params["image"] == f"sha256:{PNG_DIGEST}"
+
+    with pytest.raises(BlobNotFoundError):
+        asyncio.run(store.resolve_params({"image": "sha256:" + "0" * 64}))
+    with pytest.raises(BlobNotFoundError):
+        asyncio.run(store.resolve_params({"image": "sha256:../../etc/passwd"}))
+
+
+def test_least_recently_used_blobs_are_evicted(tmp_path: Path):
+    store = BlobStore(str(tmp_path), max_bytes=250)
+    first = store.put(b"a" * 100, "image/png")
+    second = store.put(b"b" * 100, "image/png")
+    # Make sure the modification times differ
+    past = time.time() - 10
+    os.utime(store.path(first), (past, past))
+    os.utime(store.path(second), (past - 10, past - 10))
+    store.get(second)
+
+    third = store.put(b"c" * 100, "image/png")
+
+    assert not store.exists(first)
+    assert store.exists(second) and store.exists(third)
+    assert store.stats()["evictions"] == 1
+
+    with pytest.raises(ValueError, match="too large"):
+        BlobStore(str(tmp_path), max_blob_bytes=10).put(b"x" * 11, "image/png")
+
+
+def test_upload_and_check_routes(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(routes.blobs, "blob_store", BlobStore(str(tmp_path)))
+    app = FastAPI()
+    app.include_router(routes.blobs.router)
+    client = TestClient(app)
+
+    assert client.head(f"/blobs/{PNG_DIGEST}").status_code == 404
+    response = client.post(
+        "/blobs", content=PNG_BYTES, headers={"Content-Type": "image/png"}
+    )
+    assert response.json() == {"hash": PNG_DIGEST, "reference": f"sha256:{PNG_DIGEST}"}
+    assert client.head(f"/blobs/{PNG_DIGEST}").status_code == 200
+
+    response = client.post(
+        "/blobs", content=b"<html>", headers={"Content-Type": "text/html"}
+    )
+    assert response.status_code == 415
+    response = client.post(
+        "/blobs", content=PNG_BYTES, headers={"Content-Type": "image/png,x;y"}
+    )
+    assert response.status_code == 415
+
+
+def test_chunked_uploads_are_limited(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(
+        routes.blobs, "blob_store", BlobStore(str(tmp_path), max_blob_bytes=100)
+    )
+    app = FastAPI()
+    app.include_router(routes.blobs.router)
+    client = TestClient(app)
+
+    def chunks():
+        for _ in range(10):
+            yield b"x" * 20
+
+    # No Content-Length (Transfer-Encoding: chunked)
+    response = client.post(
+        "/blobs", content=chunks(), headers={"Content-Type": "image/png"}
+    )
+    assert response.status_code == 413
+    assert not os.listdir(tmp_path)
+
+
+def test_generation_with_a_stale_reference_is_closed_with_a_distinct_code(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.setattr(routes.generate_code, "blob_store", BlobStore(str(tmp_path)))
+
+    class WebSocket:
+        close_code: int | None = None
+
+        async def accept(self):
+            pass
+
+        async def receive_json(self) -> dict[str, str]:
+            return {"inputMode": "image", "image": f"sha256:{PNG_DIGEST}"}
+
+        async def close(self, code: int = 1000):
+            self.close_code = code
+
+    websocket = WebSocket()
+    asyncio.run(routes.generate_code.stream_code(websocket))  # type: ignore
+
+    # So that the client can send the image inline instead
+    assert websocket.close_code == BLOB_NOT_FOUND_WEB_SOCKET_CODE
@@ -0,0 +1,88 @@
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Generic, Hashable, TypeVar
+from metrics.core import Counters
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+def count_entries(key: object, value: object) -> int:
+    return 1
+
+
+@dataclass
+class CacheCounters(Counters):
+    hits: int = 0
+    misses: int = 0
+
+
+class LruCache(Generic[K, V]):
+    """
+    Thread-safe LRU cache bounded by the total size of its entries, as measured
+    by size(key, value) (by default, the number of entries). Sizes should count
+    everything an entry keeps alive, keys included (e.g. data URLs).
+    """
+
+    def __init__(self, max_size: int, size: Callable[[K, V], int] = count_entries):
+        self.max_size = max_size
+        self.size = size
+        # Values with their sizes, least recently used first
+        self.entries: OrderedDict[K, tuple[V, int]] = OrderedDict()
+        self.total_size = 0
+        self.counters = CacheCounters()
+        self.lock = threading.Lock()
+
+    def get(self, key: K) -> V | None:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.counters.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.counters.hits += 1
+            return entry[0]
+
+    def put(self, key: K, value: V):
+        size = self.size(key, value)
+        # Don't let a single huge entry flush everything else out
+        if size > self.max_size:
+            return
+
+        with self.lock:
+            self.remove(key)
+            self.entries[key] = (value, size)
+            self.total_size += size
+
+            while self.total_size > self.max_size:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.total_size -= evicted_size
+
+    def pop(self, key: K) -> V | None:
+        with self.lock:
+            return self.remove(key)
+
+    def remove(self, key: K) -> V | None:
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return None
+        self.total_size -= entry[1]
+        return entry[0]
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_size = 0
+            self.counters = CacheCounters()
+
+    def stats(self) -> dict[str, float]:
+        with self.lock:
+            return {
+                **self.counters.stats(),
+                "entries": len(self.entries),
+                "size": self.total_size,
+            }
@@ -0,0 +1,33 @@
+from caching.lru import LruCache
+
+
+def test_least_recently_used_entries_are_evicted_by_size():
+    cache: LruCache[str, str] = LruCache(10, lambda key, value: len(value))
+    cache.put("a", "aaaa")
+    cache.put("b", "bbbb")
+    cache.get("a")
+    cache.put("c", "cccc")
+
+    assert list(cache.entries) == ["a", "c"]
+    assert cache.total_size == 8
+
+    # Replacing an entry replaces its size
+    cache.put("a", "aa")
+    assert cache.total_size == 6
+
+    # Entries larger than the whole cache are never stored
+    cache.put("d", "d" * 11)
+    assert cache.get("d") is None
+    assert cache.stats() == {"hits": 1, "misses": 1, "entries": 2, "size": 6}
+
+    assert cache.pop("c") == "cccc"
+    assert cache.total_size == 2
+
+
+def test_entries_are_counted_by_default():
+    cache: LruCache[str, int] = LruCache(2)
+    for index, key in enumerate("abc"):
+        cache.put(key, index)
+
+    assert list(cache.entries) == ["b", "c"]
+    assert len(cache) == 2
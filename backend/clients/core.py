@@ -0,0 +1,170 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import AsyncIterator, Literal, Union, cast
+import anthropic
+import httpx
+import openai
+from anthropic import AsyncAnthropic
+from openai import AsyncOpenAI
+
+Provider = Literal["openai", "anthropic", "replicate"]
+PooledClient = Union[AsyncOpenAI, AsyncAnthropic, httpx.AsyncClient]
+
+# Connection pool bounds for every pooled client
+MAX_CONNECTIONS = 100
+MAX_KEEPALIVE_CONNECTIONS = 20
+KEEPALIVE_EXPIRY_SECONDS = 60
+
+# Clients that haven't been used for this long get closed
+CLIENT_IDLE_TIMEOUT_SECONDS = 10 * 60
+# Upper bound on distinct (provider, api_key, base_url) clients kept around
+# (users can bring their own keys, so this can grow without a bound otherwise)
+MAX_POOLED_CLIENTS = 64
+
+
+@dataclass
+class PooledClientEntry:
+    client: PooledClient
+    loop: asyncio.AbstractEventLoop
+    last_used: float
+    active_leases: int = 0
+
+
+def create_pool_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=MAX_CONNECTIONS,
+        max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=KEEPALIVE_EXPIRY_SECONDS,
+    )
+
+
+def create_client(provider: Provider, api_key: str, base_url: str | None):
+    if provider == "replicate":
+        # Plain HTTP client (the API token is sent per request)
+        return httpx.AsyncClient(limits=create_pool_limits())
+    elif provider == "openai":
+        return AsyncOpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            http_client=openai.DefaultAsyncHttpxClient(limits=create_pool_limits()),
+        )
+    else:
+        return AsyncAnthropic(
+            api_key=api_key,
+            base_url=base_url,
+            http_client=anthropic.DefaultAsyncHttpxClient(limits=create_pool_limits()),
+        )
+
+
+class ClientRegistry:
+    """
+    Process-wide registry of provider clients keyed by (provider, api_key, base_url)
+    so that TCP/TLS connections are kept alive and reused across generations.
+    """
+
+    def __init__(
+        self,
+        idle_timeout: float = CLIENT_IDLE_TIMEOUT_SECONDS,
+        max_clients: int = MAX_POOLED_CLIENTS,
+    ):
+        self.idle_timeout = idle_timeout
+        self.max_clients = max_clients
+        self.entries: dict[tuple[Provider, str, str | None], PooledClientEntry] = {}
+
+    @asynccontextmanager
+    async def lease_openai(
+        self, api_key: str, base_url: str | None = None
+    ) -> AsyncIterator[AsyncOpenAI]:
+        async with self.lease("openai", api_key, base_url) as client:
+            yield cast(AsyncOpenAI, client)
+
+    @asynccontextmanager
+    async def lease_anthropic(
+        self, api_key: str, base_url: str | None = None
+    ) -> AsyncIterator[AsyncAnthropic]:
+        async with self.lease("anthropic", api_key, base_url) as client:
+            yield cast(AsyncAnthropic, client)
+
+    # Shared by all API tokens since they're sent per request
+    @asynccontextmanager
+    async def lease_replicate(self) -> AsyncIterator[httpx.AsyncClient]:
+        async with self.lease("replicate", "", None) as client:
+            yield cast(httpx.AsyncClient, client)
+
+    @asynccontextmanager
+    async def lease(
+        self, provider: Provider, api_key: str, base_url: str | None
+    ) -> AsyncIterator[PooledClient]:
+        await self.evict_idle()
+
+        loop = asyncio.get_running_loop()
+        key = (provider, api_key, base_url)
+        entry = self.entries.get(key)
+
+        # httpx connections are bound to the event loop that opened them
+        # (matters for scripts that call asyncio.run() more than once)
+        if entry is not None and entry.loop is not loop:
+            entry = None
+
+        if entry is None:
+            entry = PooledClientEntry(
+                client=create_client(provider, api_key, base_url),
+                loop=loop,
+                last_used=time.monotonic(),
+            )
+            self.entries[key] = entry
+
+        entry.active_leases += 1
+        try:
+            yield entry.client
+        finally:
+            entry.active_leases -= 1
+            entry.last_used = time.monotonic()
+
+    async def evict_idle(self):
+        now = time.monotonic()
+        idle_keys = [
+            key
+            for key, entry in self.entries.items()
+            if entry.active_leases == 0 and now - entry.last_used > self.idle_timeout
+        ]
+
+        # Over capacity: also drop the least recently used clients that are idle
+        overflow = len(self.entries) - len(idle_keys) - self.max_clients
+        if overflow > 0:
+            lru_keys = sorted(
+                (
+                    key
+                    for key, entry in self.entries.items()
+                    if entry.active_leases == 0 and key not in idle_keys
+                ),
+                key=lambda key: self.entries[key].last_used,
+            )
+            idle_keys += lru_keys[:overflow]
+
+        entries = [self.entries.pop(key) for key in idle_keys]
+        await self.close_entries(entries)
+
+    async def close(self):
+        entries = list(self.entries.values())
+        self.entries.clear()
+        await self.close_entries(entries)
+
+    async def close_entries(self, entries: list[PooledClientEntry]):
+        loop = asyncio.get_running_loop()
+        for entry in entries:
+            # Clients from a loop that has since gone away can't be closed cleanly
+            if entry.loop is not loop:
+                continue
+            try:
+                if isinstance(entry.client, httpx.AsyncClient):
+                    await entry.client.aclose()
+                else:
+                    await entry.client.close()
+            except Exception as e:
+                print(f"[CLIENT REGISTRY] Failed to close client: {e}")
+
+
+client_registry = ClientRegistry()
@@ -0,0 +1,41 @@
+import asyncio
+from clients.core import ClientRegistry
+
+
+def test_clients_are_reused_per_key():
+    async def run():
+        registry = ClientRegistry()
+        async with registry.lease_openai("key-1", None) as first:
+            pass
+        async with registry.lease_openai("key-1", None) as second:
+            pass
+        async with registry.lease_openai("key-2", None) as other_key:
+            pass
+        async with registry.lease_anthropic("key-1") as other_provider:
+            pass
+
+        assert first is second
+        assert other_key is not first
+        assert other_provider is not first
+        assert len(registry.entries) == 3
+
+        await registry.close()
+        assert len(registry.entries) == 0
+
+    asyncio.run(run())
+
+
+def test_idle_and_overflow_eviction_skips_active_clients():
+    async def run():
+        registry = ClientRegistry(idle_timeout=0, max_clients=1)
+        async with registry.lease_openai("key-1", None):
+            # Creating another client evicts idle ones, but not the leased one
+            async with registry.lease_openai("key-2", None):
+                assert len(registry.entries) == 2
+            await registry.evict_idle()
+            assert list(registry.entries) == [("openai", "key-1", None)]
+
+        await registry.evict_idle()
+        assert len(registry.entries) == 0
+
+    asyncio.run(run())
@@ -0,0 +1,148 @@
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Coroutine, List
+from llm import Completion
+from metrics.core import Counters, ratio
+
+StreamCallback = Callable[[str], Awaitable[None]]
+
+
+@dataclass
+class CompletionAttempt:
+    # For logging (e.g. the model name)
+    name: str
+    start: Callable[[StreamCallback], Coroutine[Any, Any, Completion]]
+
+
+@dataclass
+class HedgingStats(Counters):
+    """Counts of hedged requests across all code generation variants."""
+
+    requests: int = 0
+    hedges: int = 0
+    hedge_wins: int = 0
+    timeouts: int = 0
+
+    def derived_stats(self) -> dict[str, float]:
+        return {"hedge_rate": ratio(self.hedges, self.requests)}
+
+
+hedging_stats = HedgingStats()
+
+
+async def hedged_completion(
+    attempts: List[CompletionAttempt],
+    callback: StreamCallback,
+    hedge_after_seconds: float | None,
+    timeout_seconds: float | None,
+) -> Completion:
+    """
+    Streams a completion from the first attempt, starting the next attempt if
+    the running ones haven't streamed their first token within
+    hedge_after_seconds (or have all failed). The first attempt to stream a
+    token wins: only its chunks are passed to callback and the others are
+    cancelled. Raises TimeoutError if it takes more than timeout_seconds.
+    """
+    tasks: List[asyncio.Task[Completion]] = []
+    winner: asyncio.Task[Completion] | None = None
+    last_start_time = 0.0
+    deadline = None
+    if timeout_seconds is not None:
+        deadline = time.monotonic() + timeout_seconds
+
+    def declare_winner(task: asyncio.Task[Completion]):
+        nonlocal winner
+        winner = task
+        for other in tasks:
+            if other is not task:
+                other.cancel()
+
+        index = tasks.index(task)
+        if index > 0:
+            hedging_stats.hedge_wins += 1
+            print(f"Hedged request to {attempts[index].name} won the race")
+
+    def start_next_attempt():
+        nonlocal last_start_time
+        index = len(tasks)
+
+        async def on_chunk(content: str):
+            task = tasks[index]
+            if winner is None:
+                declare_winner(task)
+            if winner is task:
+                await callback(content)
+
+        tasks.append(asyncio.create_task(attempts[index].start(on_chunk)))
+        last_start_time = time.monotonic()
+
+    async def race() -> Completion:
+        errors: List[BaseException] = []
+        start_next_attempt()
+        while True:
+            pending = [task for task in tasks if not task.done()]
+            can_hedge = winner is None and len(tasks) < len(attempts)
+
+            # Fall back right away if everything we started has failed
+            if not pending:
+                if not can_hedge:
+                    raise errors[0]
+                start_next_attempt()
+                continue
+
+            wait_seconds = None
+            if can_hedge and hedge_after_seconds is not None:
+                wait_seconds = max(
+                    0.0, last_start_time + hedge_after_seconds - time.monotonic()
+                )
+            if deadline is not None:
+                remaining_seconds = max(0.0, deadline - time.monotonic())
+                if wait_seconds is None or remaining_seconds < wait_seconds:
+                    wait_seconds = remaining_seconds
+            done, _ = await asyncio.wait(
+                pending, timeout=wait_seconds, return_when=asyncio.FIRST_COMPLETED
+            )
+
+            if not done:
+                if deadline is not None and time.monotonic() >= deadline:
+                    hedging_stats.timeouts += 1
+                    raise TimeoutError(
+                        f"Code generation timed out after {timeout_seconds}s"
+                    )
+                # Streaming has started in the meantime
+                if winner is not None:
+                    continue
+                hedging_stats.hedges += 1
+                print(
+                    f"No first token from {attempts[len(tasks) - 1].name} after "
+                    f"{hedge_after_seconds}s, hedging with {attempts[len(tasks)].name}"
+                )
+                start_next_attempt()
+                continue
+
+            for task in done:
+                # Cancelled because another attempt won
+                if task.cancelled():
+                    continue
+                error = task.exception()
+                if error is None and (winner is None or winner is task):
+                    # Attempts that don't stream win by finishing first
+                    if winner is None:
+                        declare_winner(task)
+                    return task.result()
+                elif error is not None:
+                    # Chunks were already sent, so there's no falling back
+                    if task is winner:
+                        raise error
+                    print(f"Request to {attempts[tasks.index(task)].name} failed")
+                    errors.append(error)
+
+    hedging_stats.requests += 1
+    try:
+        return await race()
+    finally:
+        for task in tasks:
+            task.cancel()
+        # Wait for the cancelled requests to close their connections
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,153 @@
+from dataclasses import dataclass
+from typing import Any, Dict, List, Literal, cast, get_args
+from config import VARIANT_ROUTES
+from custom_types import InputMode
+from llm import Llm
+from prompts.types import Stack
+
+Provider = Literal["openai", "anthropic", "gemini"]
+GenerationType = Literal["create", "update"]
+
+# Models each provider can serve
+PROVIDER_MODEL_PREFIXES: Dict[Provider, tuple[str, ...]] = {
+    "openai": ("gpt-", "o1-"),
+    "anthropic": ("claude-",),
+    "gemini": ("gemini-",),
+}
+
+# Matches any value in a route
+WILDCARD = "*"
+
+
+@dataclass(frozen=True)
+class VariantModel:
+    provider: Provider
+    model: Llm
+
+    def __str__(self) -> str:
+        return f"{self.provider}:{self.model.value}"
+
+
+@dataclass(frozen=True)
+class VariantRoute:
+    stack: Stack | Literal["*"]
+    input_mode: InputMode | Literal["*"]
+    generation_type: GenerationType | Literal["*"]
+    # The candidate models for each variant, in order of preference
+    variants: List[List[VariantModel]]
+
+    def matches(
+        self, stack: Stack, input_mode: InputMode, generation_type: GenerationType
+    ) -> bool:
+        return (
+            self.stack in (WILDCARD, stack)
+            and self.input_mode in (WILDCARD, input_mode)
+            and self.generation_type in (WILDCARD, generation_type)
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "stack": self.stack,
+            "input_mode": self.input_mode,
+            "generation_type": self.generation_type,
+            "variants": [[str(model) for model in models] for models in self.variants],
+        }
+
+
+def parse_variant_model(value: str) -> VariantModel:
+    provider, _, model_name = value.partition(":")
+    if provider not in get_args(Provider):
+        raise ValueError(f"Unknown provider in variant model {value!r}")
+    try:
+        model = Llm(model_name)
+    except ValueError:
+        raise ValueError(f"Unknown model in variant model {value!r}")
+    if not model.value.startswith(PROVIDER_MODEL_PREFIXES[cast(Provider, provider)]):
+        raise ValueError(f"{provider} doesn't serve {model.value}")
+    return VariantModel(provider=cast(Provider, provider), model=model)
+
+
+def parse_route_field(route: Dict[str, Any], field: str, allowed: tuple[str, ...]):
+    value = route.get(field, WILDCARD)
+    if value != WILDCARD and value not in allowed:
+        raise ValueError(f"Invalid {field} {value!r} in variant route {route}")
+    return value
+
+
+def parse_variant_routes(raw_routes: List[Dict[str, Any]]) -> List[VariantRoute]:
+    """
+    Parses and validates the variant routing table (see VARIANT_ROUTES in
+    config.py). Raises ValueError if it's invalid, or if some combination of
+    stack, input mode and generation type isn't routed anywhere.
+    """
+    routes: List[VariantRoute] = []
+    for raw_route in raw_routes:
+        raw_variants = raw_route.get("variants")
+        if not raw_variants or not all(raw_variants):
+            raise ValueError(f"Variant route {raw_route} needs at least one model")
+
+        routes.append(
+            VariantRoute(
+                stack=parse_route_field(raw_route, "stack", get_args(Stack)),
+                input_mode=parse_route_field(
+                    raw_route, "input_mode", get_args(InputMode)
+                ),
+                generation_type=parse_route_field(
+                    raw_route, "generation_type", get_args(GenerationType)
+                ),
+                variants=[
+                    [parse_variant_model(value) for value in candidates]
+                    for candidates in raw_variants
+                ],
+            )
+        )
+
+    for stack in get_args(Stack):
+        for input_mode in get_args(InputMode):
+            for generation_type in get_args(GenerationType):
+                if not any(
+                    route.matches(stack, input_mode, generation_type)
+                    for route in routes
+                ):
+                    raise ValueError(
+                        f"No variant route for {stack} {input_mode} {generation_type}"
+                    )
+
+    # Video generation only supports a single Claude variant
+    for route in routes:
+        if route.input_mode == "video" and (
+            len(route.variants) != 1
+            or any(model.provider != "anthropic" for model in route.variants[0])
+        ):
+            raise ValueError("Video routes must have a single Anthropic variant")
+
+    return routes
+
+
+# Parsed when the app starts, so that a bad routing table fails fast
+variant_routes = parse_variant_routes(VARIANT_ROUTES)
+
+
+def get_variant_route(
+    stack: Stack, input_mode: InputMode, generation_type: GenerationType
+) -> VariantRoute:
+    return next(
+        route
+        for route in variant_routes
+        if route.matches(stack, input_mode, generation_type)
+    )
+
+
+# Pick the model for each variant (the first candidate we have an API key for)
+# and its fallback for hedging (the next one, or None if there's no other
+# candidate: racing a stalled model against itself would just double its load).
+# Variants without any usable candidate are skipped.
+def select_variant_models(
+    route: VariantRoute, api_keys: Dict[Provider, str | None]
+) -> List[tuple[VariantModel, VariantModel | None]]:
+    selected: List[tuple[VariantModel, VariantModel | None]] = []
+    for candidates in route.variants:
+        available = [model for model in candidates if api_keys.get(model.provider)]
+        if available:
+            selected.append((available[0], available[1] if len(available) > 1 else None))
+    return selected
@@ -0,0 +1,175 @@
+import time
+from typing import Dict, TypedDict
+from metrics.core import metrics_registry, ratio
+
+llm_time_to_first_token = metrics_registry.histogram(
+    "llm_time_to_first_token_seconds",
+    "Time from starting a completion to its first streamed token",
+    ["model"],
+)
+llm_stream_duration = metrics_registry.histogram(
+    "llm_stream_duration_seconds",
+    "Duration of completions, from the request to the last token",
+    ["model"],
+)
+llm_output_tokens_per_second = metrics_registry.histogram(
+    "llm_output_tokens_per_second",
+    "Output tokens per second of completions, after their first token",
+    ["model"],
+    buckets=[5, 10, 25, 50, 75, 100, 150, 200, 300, 500, 1000],
+)
+llm_tokens = metrics_registry.counter(
+    "llm_tokens", "Tokens used by completions", ["model", "direction"]
+)
+
+
+class Completion(TypedDict):
+    duration: float
+    code: str
+    # Seconds until the first chunk was streamed (None if nothing was streamed)
+    time_to_first_chunk: float | None
+    chunks: int
+    output_chars: int
+    # As reported by the provider (None if it didn't report usage)
+    input_tokens: int | None
+    output_tokens: int | None
+
+
+def empty_completion() -> Completion:
+    return Completion(
+        duration=0,
+        code="",
+        time_to_first_chunk=None,
+        chunks=0,
+        output_chars=0,
+        input_tokens=None,
+        output_tokens=None,
+    )
+
+
+class CompletionRecorder:
+    """
+    Tracks a completion while it streams and builds its Completion result,
+    recording it in the process-wide per-model stats (stream_stats) and metrics.
+    """
+
+    def __init__(self, model: str):
+        self.model = model
+        self.start_time = time.time()
+        self.time_to_first_chunk: float | None = None
+        self.chunks = 0
+
+    # Call for every chunk of output that's streamed
+    def chunk(self):
+        if self.time_to_first_chunk is None:
+            self.time_to_first_chunk = time.time() - self.start_time
+            llm_time_to_first_token.observe(self.time_to_first_chunk, model=self.model)
+        self.chunks += 1
+
+    def finish(
+        self,
+        code: str,
+        input_tokens: int | None = None,
+        output_tokens: int | None = None,
+    ) -> Completion:
+        completion = Completion(
+            duration=time.time() - self.start_time,
+            code=code,
+            time_to_first_chunk=self.time_to_first_chunk,
+            chunks=self.chunks,
+            output_chars=len(code),
+            input_tokens=input_tokens,
+            output_tokens=output_tokens,
+        )
+
+        llm_stream_duration.observe(completion["duration"], model=self.model)
+        if input_tokens is not None:
+            llm_tokens.inc(input_tokens, model=self.model, direction="input")
+        if output_tokens is not None:
+            llm_tokens.inc(output_tokens, model=self.model, direction="output")
+            tokens_per_second = output_tokens_per_second(completion)
+            if tokens_per_second is not None:
+                llm_output_tokens_per_second.observe(
+                    tokens_per_second, model=self.model
+                )
+        stream_stats.record(self.model, completion)
+        return completion
+
+
+# Seconds spent streaming output, i.e. after the first chunk
+def streaming_time(completion: Completion) -> float:
+    return completion["duration"] - (
+        completion["time_to_first_chunk"] or completion["duration"]
+    )
+
+
+def output_tokens_per_second(completion: Completion) -> float | None:
+    seconds = streaming_time(completion)
+    if completion["output_tokens"] is None or seconds <= 0:
+        return None
+    return completion["output_tokens"] / seconds
+
+
+class ModelStreamStats:
+    """Totals of the completions of one model."""
+
+    def __init__(self):
+        self.completions = 0
+        self.total_duration = 0.0
+        self.first_chunks = 0
+        self.total_time_to_first_chunk = 0.0
+        self.chunks = 0
+        self.output_chars = 0
+        self.streaming_time = 0.0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        # Only completions that reported their output tokens
+        self.token_streaming_time = 0.0
+
+    def record(self, completion: Completion):
+        self.completions += 1
+        self.total_duration += completion["duration"]
+        if completion["time_to_first_chunk"] is not None:
+            self.first_chunks += 1
+            self.total_time_to_first_chunk += completion["time_to_first_chunk"]
+        self.chunks += completion["chunks"]
+        self.output_chars += completion["output_chars"]
+        self.streaming_time += streaming_time(completion)
+        self.input_tokens += completion["input_tokens"] or 0
+        if completion["output_tokens"] is not None:
+            self.output_tokens += completion["output_tokens"]
+            self.token_streaming_time += streaming_time(completion)
+
+    def stats(self) -> dict[str, float]:
+        return {
+            "completions": self.completions,
+            "average_duration_seconds": ratio(self.total_duration, self.completions),
+            "average_time_to_first_chunk_seconds": ratio(
+                self.total_time_to_first_chunk, self.first_chunks
+            ),
+            "chunks": self.chunks,
+            "output_chars": self.output_chars,
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "output_chars_per_second": ratio(self.output_chars, self.streaming_time),
+            "output_tokens_per_second": ratio(
+                self.output_tokens, self.token_streaming_time
+            ),
+        }
+
+
+class StreamStats:
+    """Streaming latency and throughput of completions, per model."""
+
+    def __init__(self):
+        self.models: Dict[str, ModelStreamStats] = {}
+
+    def record(self, model: str, completion: Completion):
+        self.models.setdefault(model, ModelStreamStats()).record(completion)
+
+    def stats(self) -> dict[str, dict[str, float]]:
+        return {model: stats.stats() for model, stats in self.models.items()}
+
+
+# Every completion streamed by this process
+stream_stats = StreamStats()
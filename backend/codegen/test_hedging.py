@@ -0,0 +1,171 @@
+import asyncio
+import time
+from typing import List
+import pytest
+from clients.core import client_registry
+from codegen.hedging import CompletionAttempt, StreamCallback, hedged_completion
+from codegen.stream_stats import empty_completion
+from llm import Completion, Llm, stream_openai_response
+from stub_llm_server import StubLlmServer
+
+
+class StubProvider:
+    """Streams tokens after a delay, recording whether it was cancelled."""
+
+    def __init__(
+        self,
+        name: str,
+        first_token_seconds: float,
+        tokens: List[str],
+        error: Exception | None = None,
+    ):
+        self.name = name
+        self.first_token_seconds = first_token_seconds
+        self.tokens = tokens
+        self.error = error
+        self.started = False
+        self.cancelled = False
+
+    async def stream(self, callback: StreamCallback) -> Completion:
+        self.started = True
+        try:
+            await asyncio.sleep(self.first_token_seconds)
+            if self.error:
+                raise self.error
+            for token in self.tokens:
+                await callback(token)
+                await asyncio.sleep(0.01)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        return {**empty_completion(), "code": "".join(self.tokens)}
+
+    def attempt(self) -> CompletionAttempt:
+        return CompletionAttempt(name=self.name, start=self.stream)
+
+
+def run_hedged(
+    providers: List[StubProvider],
+    hedge_after_seconds: float | None = 0.1,
+    timeout_seconds: float | None = 5,
+) -> tuple[Completion, List[str], float]:
+    chunks: List[str] = []
+
+    async def callback(content: str):
+        chunks.append(content)
+
+    async def run():
+        start_time = time.perf_counter()
+        completion = await hedged_completion(
+            [provider.attempt() for provider in providers],
+            callback,
+            hedge_after_seconds=hedge_after_seconds,
+            timeout_seconds=timeout_seconds,
+        )
+        return (completion, chunks, time.perf_counter() - start_time)
+
+    return asyncio.run(run())
+
+
+def test_stalled_request_is_hedged_and_cancelled():
+    slow = StubProvider("slow", first_token_seconds=10, tokens=["a", "b"])
+    fast = StubProvider("fast", first_token_seconds=0.01, tokens=["c", "d"])
+
+    completion, chunks, latency = run_hedged([slow, fast])
+
+    assert completion["code"] == "cd"
+    assert chunks == ["c", "d"]
+    assert slow.cancelled
+    assert latency < 0.5
+
+
+def test_no_hedge_once_the_first_token_arrives():
+    primary = StubProvider("primary", first_token_seconds=0.01, tokens=["a"] * 30)
+    fallback = StubProvider("fallback", first_token_seconds=0.01, tokens=["b"])
+
+    # Streaming takes longer than the hedge deadline, but started before it
+    completion, chunks, _ = run_hedged([primary, fallback], hedge_after_seconds=0.05)
+
+    assert completion["code"] == "a" * 30
+    assert chunks == ["a"] * 30
+    assert not fallback.started
+
+
+def test_failed_request_falls_back_without_waiting():
+    failing = StubProvider(
+        "failing", first_token_seconds=0, tokens=[], error=ValueError("overloaded")
+    )
+    fallback = StubProvider("fallback", first_token_seconds=0.01, tokens=["b"])
+
+    completion, _, latency = run_hedged([failing, fallback], hedge_after_seconds=10)
+
+    assert completion["code"] == "b"
+    assert latency < 0.5
+
+
+def test_all_failed_raises_the_first_error():
+    providers = [
+        StubProvider("a", first_token_seconds=0, tokens=[], error=ValueError("a")),
+        StubProvider("b", first_token_seconds=0, tokens=[], error=ValueError("b")),
+    ]
+
+    with pytest.raises(ValueError, match="a"):
+        run_hedged(providers)
+
+
+def test_variant_times_out_and_cancels_every_request():
+    providers = [
+        StubProvider("slow-1", first_token_seconds=10, tokens=["a"]),
+        StubProvider("slow-2", first_token_seconds=10, tokens=["b"]),
+    ]
+
+    start_time = time.perf_counter()
+    with pytest.raises(TimeoutError, match="timed out"):
+        run_hedged(providers, hedge_after_seconds=0.05, timeout_seconds=0.2)
+
+    assert time.perf_counter() - start_time < 0.5
+    assert all(provider.cancelled for provider in providers)
+
+
+def test_hedging_against_slow_stub_providers():
+    slow_server = StubLlmServer(["slow"], handshake_latency=0, first_token_latency=5)
+    fast_server = StubLlmServer(["fast", " code"], handshake_latency=0)
+    chunks: List[str] = []
+
+    async def callback(content: str):
+        chunks.append(content)
+
+    def attempt(server: StubLlmServer) -> CompletionAttempt:
+        return CompletionAttempt(
+            name=server.base_url,
+            start=lambda callback: stream_openai_response(
+                [{"role": "user", "content": "hello"}],
+                api_key="key",
+                base_url=server.base_url,
+                callback=callback,
+                model=Llm.GPT_4O_2024_11_20,
+            ),
+        )
+
+    async def run():
+        await slow_server.start()
+        await fast_server.start()
+        start_time = time.perf_counter()
+        try:
+            completion = await hedged_completion(
+                [attempt(slow_server), attempt(fast_server)],
+                callback,
+                hedge_after_seconds=0.2,
+                timeout_seconds=5,
+            )
+            return (completion, time.perf_counter() - start_time)
+        finally:
+            await client_registry.close()
+            await slow_server.stop()
+            await fast_server.stop()
+
+    completion, latency = asyncio.run(run())
+
+    assert completion["code"] == "fast code"
+    assert chunks == ["fast", " code"]
+    assert latency < 1.0
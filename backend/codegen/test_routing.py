@@ -0,0 +1,88 @@
+from typing import Any, Dict, List
+import pytest
+from codegen.routing import (
+    get_variant_route,
+    parse_variant_routes,
+    select_variant_models,
+)
+from config import DEFAULT_VARIANT_ROUTES
+from llm import Llm
+
+CATCH_ALL_ROUTE: Dict[str, Any] = {
+    "variants": [["openai:gpt-4o-2024-11-20"]],
+}
+
+
+def selected(route_index: int, **api_keys: str) -> List[tuple[str, str | None]]:
+    routes = parse_variant_routes(DEFAULT_VARIANT_ROUTES)
+    return [
+        (str(model), fallback and str(fallback))
+        for model, fallback in select_variant_models(
+            routes[route_index], api_keys  # type: ignore
+        )
+    ]
+
+
+def test_default_routes_match_the_previous_key_matrix():
+    claude = "anthropic:claude-3-5-sonnet-20241022"
+    gpt = "openai:gpt-4o-2024-11-20"
+
+    assert selected(1, openai="key", anthropic="key") == [
+        (claude, gpt),
+        (gpt, claude),
+    ]
+    # With a single usable model there's nothing to hedge with
+    assert selected(1, openai="key") == [(gpt, None), (gpt, None)]
+    assert selected(1, anthropic="key") == [(claude, None), (claude, None)]
+    assert selected(1) == []
+
+
+def test_first_matching_route_is_used():
+    route = get_variant_route("html_tailwind", "image", "update")
+    assert route.generation_type == "update"
+    assert route.variants[0][0].model == Llm.CLAUDE_3_5_SONNET_2024_06_20
+
+    video_route = get_variant_route("react_tailwind", "video", "create")
+    assert len(video_route.variants) == 1
+    assert video_route.variants[0][0].model == Llm.CLAUDE_3_OPUS
+
+
+def test_number_of_variants_is_configurable():
+    routes = parse_variant_routes(
+        [
+            {"stack": "svg", "variants": [["openai:gpt-4o-2024-11-20"]]},
+            {
+                "variants": [["anthropic:claude-3-5-sonnet-20241022"]] * 4,
+            },
+        ]
+    )
+
+    assert len(routes[0].variants) == 1
+    assert len(select_variant_models(routes[1], {"anthropic": "key"})) == 4
+    assert routes[0].to_dict() == {
+        "stack": "svg",
+        "input_mode": "*",
+        "generation_type": "*",
+        "variants": [["openai:gpt-4o-2024-11-20"]],
+    }
+
+
+@pytest.mark.parametrize(
+    "routes, message",
+    [
+        ([{"variants": [["mistral:gpt-4o-2024-11-20"]]}], "Unknown provider"),
+        ([{"variants": [["openai:gpt-5"]]}], "Unknown model"),
+        ([{"variants": [["openai:claude-3-5-sonnet-20241022"]]}], "doesn't serve"),
+        ([{"variants": []}], "at least one model"),
+        ([{"variants": [[]]}], "at least one model"),
+        ([{"stack": "flash", **CATCH_ALL_ROUTE}], "Invalid stack"),
+        ([{"input_mode": "image", **CATCH_ALL_ROUTE}], "No variant route"),
+        (
+            [{"input_mode": "video", **CATCH_ALL_ROUTE}, CATCH_ALL_ROUTE],
+            "single Anthropic variant",
+        ),
+    ],
+)
+def test_invalid_routes_are_rejected(routes: List[Dict[str, Any]], message: str):
+    with pytest.raises(ValueError, match=message):
+        parse_variant_routes(routes)
@@ -0,0 +1,136 @@
+import asyncio
+from typing import List
+import pytest
+from clients.core import client_registry
+from codegen.stream_stats import (
+    Completion,
+    StreamStats,
+    output_tokens_per_second,
+    stream_stats,
+)
+from llm import Llm, stream_openai_response
+from stub_llm_server import StubLlmServer
+
+
+def completion(
+    duration: float,
+    time_to_first_chunk: float | None,
+    output_tokens: int | None,
+    code: str = "<html></html>",
+) -> Completion:
+    return Completion(
+        duration=duration,
+        code=code,
+        time_to_first_chunk=time_to_first_chunk,
+        chunks=3,
+        output_chars=len(code),
+        input_tokens=100,
+        output_tokens=output_tokens,
+    )
+
+
+def test_throughput_excludes_time_to_first_chunk():
+    assert output_tokens_per_second(completion(3.0, 1.0, 100)) == 50
+    # Unknown when the provider didn't report usage or nothing was streamed
+    assert output_tokens_per_second(completion(3.0, 1.0, None)) is None
+    assert output_tokens_per_second(completion(3.0, None, 100)) is None
+
+
+def test_stats_are_aggregated_per_model():
+    stats = StreamStats()
+    stats.record("gpt", completion(3.0, 1.0, 100))
+    stats.record("gpt", completion(5.0, 3.0, 300))
+    # Usage isn't included in the token throughput when it's unknown
+    stats.record("gpt", completion(2.0, 1.0, None))
+    stats.record("claude", completion(1.0, 0.5, 10))
+
+    gpt = stats.stats()["gpt"]
+    assert gpt["completions"] == 3
+    assert gpt["average_duration_seconds"] == pytest.approx(10 / 3)
+    assert gpt["average_time_to_first_chunk_seconds"] == pytest.approx(5 / 3)
+    assert gpt["chunks"] == 9
+    assert gpt["input_tokens"] == 300
+    assert gpt["output_tokens"] == 400
+    assert gpt["output_tokens_per_second"] == pytest.approx(100)
+    assert gpt["output_chars_per_second"] == pytest.approx(13 * 3 / 5)
+    assert stats.stats()["claude"]["completions"] == 1
+
+
+def test_openai_stream_reports_first_chunk_and_usage():
+    server = StubLlmServer(
+        ["<html>", "<p>hi</p>", "</html>"],
+        handshake_latency=0,
+        first_token_latency=0.1,
+        prompt_tokens=42,
+    )
+    chunks: List[str] = []
+
+    async def callback(content: str):
+        chunks.append(content)
+
+    async def run() -> Completion:
+        await server.start()
+        try:
+            return await stream_openai_response(
+                [{"role": "user", "content": "Build a page"}],
+                api_key="key",
+                base_url=server.base_url,
+                callback=callback,
+                model=Llm.GPT_4O_2024_11_20,
+            )
+        finally:
+            await client_registry.close()
+            await server.stop()
+
+    completions_before = (
+        stream_stats.stats().get(Llm.GPT_4O_2024_11_20.value, {}).get("completions", 0)
+    )
+    result = asyncio.run(run())
+
+    assert result["code"] == "<html><p>hi</p></html>"
+    assert result["chunks"] == len(chunks) == 3
+    assert result["output_chars"] == len(result["code"])
+    assert result["time_to_first_chunk"] is not None
+    assert 0.1 <= result["time_to_first_chunk"] <= result["duration"]
+    assert result["input_tokens"] == 42
+    assert result["output_tokens"] == 3
+    assert (
+        stream_stats.stats()[Llm.GPT_4O_2024_11_20.value]["completions"]
+        == completions_before + 1
+    )
+
+
+def test_proxies_that_reject_stream_options_are_retried_without_it():
+    server = StubLlmServer(
+        ["<html>", "</html>"], handshake_latency=0, reject_stream_options=True
+    )
+
+    async def callback(content: str):
+        pass
+
+    async def run() -> List[Completion]:
+        await server.start()
+        try:
+            return [
+                await stream_openai_response(
+                    [{"role": "user", "content": "Build a page"}],
+                    api_key="key",
+                    base_url=server.base_url,
+                    callback=callback,
+                    model=Llm.GPT_4O_2024_11_20,
+                )
+                for _ in range(2)
+            ]
+        finally:
+            await client_registry.close()
+            await server.stop()
+
+    results = asyncio.run(run())
+
+    assert [result["code"] for result in results] == ["<html></html>"] * 2
+    # The usage is unknown without stream_options
+    assert results[0]["input_tokens"] is None
+    assert results[0]["output_tokens"] is None
+    # Only the first request tried it
+    assert server.rejected_requests == 1
+    assert server.requests_served == 2
@@ -1,5 +1,48 @@
+import random
+import re
 import unittest
-from codegen.utils import extract_html_content
+from codegen.utils import StreamingHtmlExtractor, extract_html_content
+
+# Cases from TestUtils below
+EXTRACTION_CASES = [
+    "<html><body><p>Hello, World!</p></body></html>",
+    "No HTML content here.",
+    "<html><body><p>Hello, World!</p></body>",
+    "<html><body><p>First</p></body></html> Some text <html><body><p>Second</p></body></html>",
+    """Got it! You want the song list to be displayed horizontally. I'll update the code to ensure that the song list is displayed in a horizontal layout.
+
+        Here's the updated code:
+
+        <html lang="en"><head></head><body class="bg-black text-white"></body></html>""",
+    "```html<head></head>```",
+    '<!DOCTYPE html><html lang="en"><head></head><body></body></html>',
+    '<svg width="100" height="50"><rect width="100" height="50"/></svg>',
+]
+
+# Fragments to build random completions from (mostly around the boundaries)
+FRAGMENTS = [
+    "<html",
+    ">",
+    "</html>",
+    "</html",
+    "<",
+    "html",
+    "/",
+    " lang='en'",
+    "x",
+    "svg",
+    "\n",
+    "```",
+]
+
+
+def stream(text: str, split_points: list[int]) -> tuple[str, str]:
+    extractor = StreamingHtmlExtractor()
+    bounds = [0, *sorted(split_points), len(text)]
+    streamed = "".join(
+        extractor.feed(text[start:end]) for start, end in zip(bounds, bounds[1:])
+    )
+    return (streamed, extractor.extract(text))
 
 
 class TestUtils(unittest.TestCase):
@@ -53,5 +96,61 @@ class TestUtils(unittest.TestCase):
         self.assertEqual(result, expected)
 
 
+class TestStreamingHtmlExtractor(unittest.TestCase):
+
+    def assert_matches_regex(self, text: str, split_points: list[int]):
+        streamed, extracted = stream(text, split_points)
+        self.assertEqual(extracted, extract_html_content(text))
+
+        # Completions whose first tag isn't <html are streamed as is
+        first_tag = re.search(r"<[a-zA-Z]", text)
+        if first_tag and not "<html".startswith(text[first_tag.start() :][:5]):
+            self.assertEqual(streamed, text)
+            return
+
+        # Otherwise only the HTML block is streamed (from <html onwards if it's
+        # never closed)
+        match = re.search(r"(<html.*?>.*?</html>)", text, re.DOTALL)
+        start = text.find("<html")
+        if match:
+            self.assertEqual(streamed, match.group(1))
+        else:
+            self.assertEqual(streamed, text[start:] if start != -1 else "")
+
+    def test_matches_regex_on_cases_for_every_split(self):
+        for text in EXTRACTION_CASES:
+            for split_point in range(len(text) + 1):
+                self.assert_matches_regex(text, [split_point])
+            # One character at a time
+            self.assert_matches_regex(text, list(range(len(text))))
+
+    def test_matches_regex_on_random_completions(self):
+        rng = random.Random(0)
+        for _ in range(2000):
+            text = "".join(rng.choices(FRAGMENTS, k=rng.randint(0, 12)))
+            split_points = [rng.randint(0, len(text)) for _ in range(rng.randint(0, 5))]
+            self.assert_matches_regex(text, split_points)
+
+    def test_preamble_and_fences_are_not_streamed(self):
+        text = "Here's the code:\n```html\n<html><body></body></html>\n```\nDone."
+        streamed, extracted = stream(text, list(range(0, len(text), 3)))
+        self.assertEqual(streamed, "<html><body></body></html>")
+        self.assertEqual(extracted, "<html><body></body></html>")
+
+    def test_svg_is_streamed(self):
+        text = '<svg width="100" height="50">\n<rect width="100" height="50"/>\n</svg>'
+        extractor = StreamingHtmlExtractor()
+        chunks = [extractor.feed(text[i : i + 4]) for i in range(0, len(text), 4)]
+        self.assertTrue(all(chunks))
+        self.assertEqual("".join(chunks), text)
+        self.assertEqual(extractor.extract(text), text)
+
+    def test_preamble_is_streamed_once_the_first_tag_is_not_html(self):
+        extractor = StreamingHtmlExtractor()
+        self.assertEqual(extractor.feed("Here's the SVG: <"), "")
+        self.assertEqual(extractor.feed("sv"), "Here's the SVG: <sv")
+        self.assertEqual(extractor.feed("g>"), "g>")
+
+
 if __name__ == "__main__":
     unittest.main()
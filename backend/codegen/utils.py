@@ -1,4 +1,5 @@
 import re
+from typing import Literal
 
 
 def extract_html_content(text: str):
@@ -12,3 +13,103 @@ def extract_html_content(text: str):
             "[HTML Extraction] No <html> tags found in the generated content: " + text
         )
         return text
+
+
+HTML_START = "<html"
+HTML_END = "</html>"
+# The start of any opening tag (not "</", "<!DOCTYPE" or "<!--")
+TAG_START = re.compile(r"<[a-zA-Z]")
+
+
+class StreamingHtmlExtractor:
+    """
+    Incremental version of extract_html_content for streamed completions.
+
+    feed() returns the part of each chunk that's inside the first
+    <html ...>...</html> block (dropping any preamble, markdown fences and
+    trailing explanations), doing work proportional to the chunk only.
+    extract() then returns the same result as extract_html_content without
+    scanning the completion again.
+
+    Completions whose first tag isn't <html (e.g. the SVG stack's bare <svg>)
+    have no block to extract, so they're streamed as is from that tag on
+    (including what was held back before it).
+    """
+
+    def __init__(self):
+        self.state: Literal["start", "open_tag", "body", "done", "passthrough"] = (
+            "start"
+        )
+        # Text held back until the first tag shows whether it's <html
+        self.preamble = ""
+        # Where to resume looking for the first tag in the preamble
+        self.scan_offset = 0
+        # Characters kept from earlier chunks so that the closing tag is still
+        # found when it's split across chunks (never more than its length)
+        self.carry = ""
+        self.parts: list[str] = []
+        self.length = 0
+
+    def feed(self, content: str) -> str:
+        self.length += len(content)
+        emitted: list[str] = []
+
+        if self.state == "passthrough":
+            return content
+
+        if self.state == "start":
+            self.preamble += content
+            match = TAG_START.search(self.preamble, self.scan_offset)
+            if match is None:
+                # A trailing "<" could start a tag in the next chunk
+                self.scan_offset = max(len(self.preamble) - 1, 0)
+                return ""
+            start = match.start()
+            tag = self.preamble[start : start + len(HTML_START)]
+            if len(tag) < len(HTML_START) and HTML_START.startswith(tag):
+                # Could still be <html
+                self.scan_offset = start
+                return ""
+            if tag != HTML_START:
+                self.state = "passthrough"
+                content, self.preamble = self.preamble, ""
+                return content
+            self.state = "open_tag"
+            emitted.append(HTML_START)
+            content = self.preamble[start + len(HTML_START) :]
+            self.preamble = ""
+
+        if self.state == "open_tag":
+            end = content.find(">")
+            if end == -1:
+                emitted.append(content)
+                return self.emit(emitted)
+            self.state = "body"
+            emitted.append(content[: end + 1])
+            content = content[end + 1 :]
+
+        if self.state == "body":
+            # Only the body is searched (the closing tag has to come after the ">")
+            text = self.carry + content
+            end = text.find(HTML_END)
+            if end == -1:
+                self.carry = text[-(len(HTML_END) - 1) :]
+                emitted.append(content)
+                return self.emit(emitted)
+            self.state = "done"
+            self.carry = ""
+            emitted.append(content[: end + len(HTML_END) - (len(text) - len(content))])
+
+        return self.emit(emitted)
+
+    def emit(self, emitted: list[str]) -> str:
+        content = "".join(emitted)
+        self.parts.append(content)
+        return content
+
+    # The HTML content of the completion (the full completion should have been fed)
+    def extract(self, text: str) -> str:
+        if self.state == "done" and self.length == len(text):
+            return "".join(self.parts)
+        # Not streamed (or no complete <html> block): fall back to the regex
+        return extract_html_content(text)
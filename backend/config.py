@@ -1,9 +1,41 @@
 # Useful for debugging purposes when you don't want to waste GPT4-Vision credits
 # Setting to True will stream a mock response instead of calling the OpenAI API
 # TODO: Should only be set to true when value is 'True', not any abitrary truthy value
+import json
 import os
 
-NUM_VARIANTS = 2
+# Which models generate the variants of a request. The first route matching the
+# request's stack, input mode and generation type is used (missing fields match
+# anything). Each variant lists "provider:model" candidates in order of
+# preference: the first one with an API key generates the variant and the next
+# one is used to hedge it. Override with a JSON list in VARIANT_ROUTES.
+DEFAULT_VARIANT_ROUTES = [
+    {
+        "input_mode": "video",
+        "variants": [["anthropic:claude-3-opus-20240229"]],
+    },
+    # For creation, use Claude Sonnet 3.6 but it can be lazy
+    # so for updates, we use Claude Sonnet 3.5
+    {
+        "generation_type": "create",
+        "variants": [
+            ["anthropic:claude-3-5-sonnet-20241022", "openai:gpt-4o-2024-11-20"],
+            ["openai:gpt-4o-2024-11-20", "anthropic:claude-3-5-sonnet-20241022"],
+        ],
+    },
+    {
+        "generation_type": "update",
+        "variants": [
+            ["anthropic:claude-3-5-sonnet-20240620", "openai:gpt-4o-2024-11-20"],
+            ["openai:gpt-4o-2024-11-20", "anthropic:claude-3-5-sonnet-20240620"],
+        ],
+    },
+]
+VARIANT_ROUTES = (
+    json.loads(os.environ["VARIANT_ROUTES"])
+    if os.environ.get("VARIANT_ROUTES")
+    else DEFAULT_VARIANT_ROUTES
+)
 
 # LLM-related
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY", None)
@@ -11,9 +43,75 @@ ANTHROPIC_API_KEY = os.environ.get("ANTHROPIC_API_KEY", None)
 GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY", None)
 OPENAI_BASE_URL = os.environ.get("OPENAI_BASE_URL", None)
 
+# Code generation variants: if a variant hasn't streamed its first token after
+# this many seconds, a duplicate request is sent to an alternate model (or key)
+# and whichever streams first is kept (0 to disable). Variants that take longer
+# than the timeout in total fail.
+CODE_GENERATION_HEDGE_AFTER_SECONDS = float(
+    os.environ.get("CODE_GENERATION_HEDGE_AFTER_SECONDS", 20)
+)
+CODE_GENERATION_VARIANT_TIMEOUT_SECONDS = float(
+    os.environ.get("CODE_GENERATION_VARIANT_TIMEOUT_SECONDS", 600)
+)
+
 # Image generation (optional)
 REPLICATE_API_KEY = os.environ.get("REPLICATE_API_KEY", None)
 
+# Replicate predictions: how long to wait in total for an image, and how long to
+# let Replicate hold the create request open (Prefer: wait, at most 60 seconds)
+REPLICATE_PREDICTION_TIMEOUT_SECONDS = float(
+    os.environ.get("REPLICATE_PREDICTION_TIMEOUT_SECONDS", 60)
+)
+REPLICATE_PREFER_WAIT_SECONDS = int(os.environ.get("REPLICATE_PREFER_WAIT_SECONDS", 10))
+
+# Process-wide limits for image generation requests (per model and API key)
+IMAGE_GENERATION_MAX_CONCURRENCY = int(
+    os.environ.get("IMAGE_GENERATION_MAX_CONCURRENCY", 8)
+)
+DALLE3_REQUESTS_PER_MINUTE = float(os.environ.get("DALLE3_REQUESTS_PER_MINUTE", 50))
+REPLICATE_REQUESTS_PER_MINUTE = float(
+    os.environ.get("REPLICATE_REQUESTS_PER_MINUTE", 600)
+)
+# Retries for rate limited (429) and server (5xx) errors
+IMAGE_GENERATION_MAX_RETRIES = int(os.environ.get("IMAGE_GENERATION_MAX_RETRIES", 3))
+
+# Generated images are cached across sessions by (model, alt text, size).
+# Set the path to an empty string to only cache in memory.
+GENERATED_IMAGE_CACHE_PATH = os.environ.get(
+    "GENERATED_IMAGE_CACHE_PATH", "generated_image_cache.db"
+)
+# DALL-E and Replicate image URLs expire after about an hour
+GENERATED_IMAGE_CACHE_TTL_SECONDS = int(
+    os.environ.get("GENERATED_IMAGE_CACHE_TTL_SECONDS", 45 * 60)
+)
+GENERATED_IMAGE_CACHE_MAX_ENTRIES = int(
+    os.environ.get("GENERATED_IMAGE_CACHE_MAX_ENTRIES", 10000)
+)
+
+# Screenshots and videos that clients upload once and then refer to by hash
+# (least recently used blobs are deleted once the store reaches its maximum size)
+BLOB_STORE_PATH = os.environ.get("BLOB_STORE_PATH", "blob_store")
+BLOB_STORE_MAX_BYTES = int(os.environ.get("BLOB_STORE_MAX_BYTES", 2 * 1024**3))
+BLOB_MAX_BYTES = int(os.environ.get("BLOB_MAX_BYTES", 50 * 1024 * 1024))
+
+# CPU-bound work (image processing, video frame extraction, HTML parsing) runs
+# off the event loop in a shared executor: "thread" or "process"
+CPU_EXECUTOR_KIND = os.environ.get("CPU_EXECUTOR_KIND", "thread")
+CPU_EXECUTOR_MAX_WORKERS = int(os.environ.get("CPU_EXECUTOR_MAX_WORKERS", 4))
+
+# Run logs (the prompt and completion of every generation) are written in the
+# background: queued records beyond the queue size are dropped, and the gzipped
+# JSONL segments are rotated once they reach the maximum size
+RUN_LOG_QUEUE_SIZE = int(os.environ.get("RUN_LOG_QUEUE_SIZE", 1000))
+RUN_LOG_BATCH_SIZE = int(os.environ.get("RUN_LOG_BATCH_SIZE", 50))
+RUN_LOG_SEGMENT_MAX_BYTES = int(
+    os.environ.get("RUN_LOG_SEGMENT_MAX_BYTES", 64 * 1024 * 1024)
+)
+
+# Evals: generations in flight per model, and retries of a failed generation
+EVAL_MAX_CONCURRENCY = int(os.environ.get("EVAL_MAX_CONCURRENCY", 4))
+EVAL_MAX_RETRIES = int(os.environ.get("EVAL_MAX_RETRIES", 2))
+
 # Debugging-related
 
 SHOULD_MOCK_AI_RESPONSE = bool(os.environ.get("MOCK", False))
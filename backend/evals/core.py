@@ -1,5 +1,6 @@
 from config import ANTHROPIC_API_KEY, GEMINI_API_KEY, OPENAI_API_KEY
 from llm import (
+    Completion,
     Llm,
     stream_claude_response,
     stream_gemini_response,
@@ -10,14 +11,16 @@ from prompts.types import Stack
 from openai.types.chat import ChatCompletionMessageParam
 
 
-async def generate_code_for_image(image_url: str, stack: Stack, model: Llm) -> str:
+async def generate_code_for_image(
+    image_url: str, stack: Stack, model: Llm
+) -> Completion:
     prompt_messages = assemble_prompt(image_url, stack)
     return await generate_code_core(prompt_messages, model)
 
 
 async def generate_code_core(
     prompt_messages: list[ChatCompletionMessageParam], model: Llm
-) -> str:
+) -> Completion:
 
     async def process_chunk(_: str):
         pass
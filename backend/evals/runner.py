@@ -1,16 +1,116 @@
-from typing import Any, Coroutine, List, Optional
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
 import asyncio
+import json
 import os
+import random
 from datetime import datetime
-from llm import Llm
+from codegen.stream_stats import StreamStats
+from config import EVAL_MAX_CONCURRENCY, EVAL_MAX_RETRIES
+from executors.core import run_blocking
+from image_generation.scheduler import get_retry_info
+from llm import Completion, Llm
 from prompts.types import Stack
+from utils import atomic_write
 from .core import generate_code_for_image
 from .utils import image_to_data_url
 from .config import EVALS_DIR
 
+# Records the outputs written so far, so that a rerun can skip them
+MANIFEST_FILENAME = "manifest.json"
+
+INITIAL_RETRY_DELAY_SECONDS = 2.0
+MAX_RETRY_DELAY_SECONDS = 30.0
+
+
+@dataclass
+class EvalTask:
+    input_filename: str
+    output_filename: str
+    model: Llm
+
+
+class EvalManifest:
+    """
+    The outputs of an eval run (with their completion stats) and the ones that
+    failed, saved to the run's output folder after every task.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.outputs: Dict[str, Dict[str, Any]] = {}
+        self.failures: Dict[str, str] = {}
+        self.lock = asyncio.Lock()
+        if os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+            self.outputs = data.get("outputs", {})
+
+    def is_done(self, output_filename: str, output_folder: str) -> bool:
+        return output_filename in self.outputs and os.path.exists(
+            os.path.join(output_folder, output_filename)
+        )
+
+    async def record_output(self, task: EvalTask, completion: Completion):
+        stats = {key: value for key, value in completion.items() if key != "code"}
+        async with self.lock:
+            self.outputs[task.output_filename] = {
+                "input": task.input_filename,
+                "model": task.model.value,
+                "completion": stats,
+            }
+            self.failures.pop(task.output_filename, None)
+            await run_blocking(self.save)
+
+    async def record_failure(self, task: EvalTask, error: BaseException):
+        async with self.lock:
+            self.failures[task.output_filename] = repr(error)
+            await run_blocking(self.save)
+
+    def save(self):
+        atomic_write(
+            self.path,
+            json.dumps({"outputs": self.outputs, "failures": self.failures}, indent=2),
+        )
+
+    # Latency and streaming throughput of every output, per model
+    def stream_stats(self) -> StreamStats:
+        stream_stats = StreamStats()
+        for output in self.outputs.values():
+            completion: Completion = {**output["completion"], "code": ""}
+            stream_stats.record(output["model"], completion)
+        return stream_stats
+
+
+async def generate_with_retries(
+    image_url: str, stack: Stack, model: Llm, max_retries: int
+) -> Completion:
+    for attempt in range(max_retries + 1):
+        try:
+            return await generate_code_for_image(
+                image_url=image_url, stack=stack, model=model
+            )
+        except Exception as e:
+            if attempt == max_retries:
+                raise
+            # Retry any error (losing an output is worse than a wasted retry),
+            # waiting as long as the provider asked if it did
+            _, retry_after = get_retry_info(e)
+            delay = retry_after or min(
+                INITIAL_RETRY_DELAY_SECONDS * 2**attempt, MAX_RETRY_DELAY_SECONDS
+            ) * random.uniform(0.5, 1.0)
+            print(f"Eval generation failed ({e!r}), retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+    raise AssertionError("unreachable")
+
 
 async def run_image_evals(
-    stack: Optional[Stack] = None, model: Optional[str] = None, n: int = 1
+    stack: Optional[Stack] = None,
+    model: Optional[str] = None,
+    n: int = 1,
+    max_concurrency: int = EVAL_MAX_CONCURRENCY,
+    max_retries: int = EVAL_MAX_RETRIES,
 ) -> List[str]:
     INPUT_DIR = EVALS_DIR + "/inputs"
     OUTPUT_DIR = EVALS_DIR + "/outputs"
@@ -38,38 +138,78 @@ async def run_image_evals(
     )
     os.makedirs(output_subfolder, exist_ok=True)
 
-    tasks: list[Coroutine[Any, Any, str]] = []
+    # Outputs written by a previous (interrupted) run into the same folder are
+    # kept and not generated again
+    manifest = EvalManifest(os.path.join(output_subfolder, MANIFEST_FILENAME))
+
+    tasks: List[EvalTask] = []
     for filename in evals:
-        filepath = os.path.join(INPUT_DIR, filename)
-        data_url = await image_to_data_url(filepath)
         for n_idx in range(n):  # Generate N tasks for each input
-            if n_idx == 0:
-                task = generate_code_for_image(
-                    image_url=data_url,
-                    stack=stack,
-                    model=selected_model,
+            tasks.append(
+                EvalTask(
+                    input_filename=filename,
+                    # File name is derived from the original filename in evals
+                    # with an added output number
+                    output_filename=f"{os.path.splitext(filename)[0]}_{n_idx}.html",
+                    model=selected_model if n_idx == 0 else Llm.GPT_4O_2024_05_13,
                 )
-            else:
-                task = generate_code_for_image(
-                    image_url=data_url, stack=stack, model=Llm.GPT_4O_2024_05_13
+            )
+    pending_tasks = [
+        task
+        for task in tasks
+        if not manifest.is_done(task.output_filename, output_subfolder)
+    ]
+
+    print(
+        f"Generating {len(pending_tasks)} codes "
+        f"({len(tasks) - len(pending_tasks)} already generated)"
+    )
+
+    # Bounds the generations in flight (and the screenshots in memory)
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def run_task(task: EvalTask):
+        async with semaphore:
+            try:
+                data_url = await image_to_data_url(
+                    os.path.join(INPUT_DIR, task.input_filename)
                 )
-            tasks.append(task)
-
-    print(f"Generating {len(tasks)} codes")
-
-    results = await asyncio.gather(*tasks)
-
-    output_files: List[str] = []
-    for i, content in enumerate(results):
-        # Calculate index for filename and output number
-        eval_index = i // n
-        output_number = i % n
-        filename = evals[eval_index]
-        # File name is derived from the original filename in evals with an added output number
-        output_filename = f"{os.path.splitext(filename)[0]}_{output_number}.html"
-        output_filepath = os.path.join(output_subfolder, output_filename)
-        with open(output_filepath, "w") as file:
-            file.write(content)
-        output_files.append(output_filename)
-
-    return output_files
+                completion = await generate_with_retries(
+                    data_url, stack, task.model, max_retries
+                )
+            except Exception as e:
+                print(f"Eval {task.output_filename} failed: {e!r}")
+                await manifest.record_failure(task, e)
+                return
+
+        # Write each output as soon as it's generated
+        await run_blocking(
+            atomic_write,
+            os.path.join(output_subfolder, task.output_filename),
+            completion["code"],
+        )
+        await manifest.record_output(task, completion)
+
+    await asyncio.gather(*[run_task(task) for task in pending_tasks])
+
+    if manifest.failures:
+        print(
+            f"{len(manifest.failures)} evals failed (rerun to retry them): "
+            + ", ".join(sorted(manifest.failures))
+        )
+
+    report = manifest.stream_stats().stats()
+    with open(os.path.join(output_subfolder, "stream_stats.json"), "w") as file:
+        json.dump(report, file, indent=2)
+    for model_name, stats in report.items():
+        print(
+            f"{model_name}: {stats['completions']} completions, "
+            f"time to first chunk {stats['average_time_to_first_chunk_seconds']:.2f}s, "
+            f"{stats['output_tokens_per_second']:.1f} output tokens/s"
+        )
+
+    return [
+        task.output_filename
+        for task in tasks
+        if manifest.is_done(task.output_filename, output_subfolder)
+    ]
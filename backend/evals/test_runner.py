@@ -0,0 +1,90 @@
+import asyncio
+import json
+import os
+from typing import Any, Dict
+import pytest
+from codegen.stream_stats import empty_completion
+from evals import runner
+from llm import Completion, Llm
+
+MODEL = Llm.GPT_4O_2024_11_20.value
+
+
+@pytest.fixture
+def evals_dir(tmp_path: Any, monkeypatch: pytest.MonkeyPatch) -> str:
+    os.makedirs(tmp_path / "inputs")
+    for name in ["a", "b", "c", "d", "e"]:
+        (tmp_path / "inputs" / f"{name}.png").write_bytes(name.encode())
+    monkeypatch.setattr(runner, "EVALS_DIR", str(tmp_path))
+    monkeypatch.setattr(runner, "INITIAL_RETRY_DELAY_SECONDS", 0)
+    return str(tmp_path)
+
+
+def output_folder(evals_dir: str) -> str:
+    outputs = os.path.join(evals_dir, "outputs")
+    (folder,) = os.listdir(outputs)
+    return os.path.join(outputs, folder)
+
+
+def test_bounded_concurrency_retries_and_incremental_writes(
+    evals_dir: str, monkeypatch: pytest.MonkeyPatch
+):
+    in_flight = 0
+    max_in_flight = 0
+    attempts: Dict[str, int] = {}
+
+    async def generate_code_for_image(image_url: str, stack: str, model: Llm):
+        nonlocal in_flight, max_in_flight
+        attempts[image_url] = attempts.get(image_url, 0) + 1
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        # "b" fails once, "c" always fails
+        if image_url.endswith(",Yw==") or (
+            image_url.endswith(",Yg==") and attempts[image_url] == 1
+        ):
+            raise ConnectionError("Provider unavailable")
+        return Completion({**empty_completion(), "code": f"<html>{image_url}</html>"})
+
+    monkeypatch.setattr(runner, "generate_code_for_image", generate_code_for_image)
+
+    output_files = asyncio.run(
+        runner.run_image_evals(
+            stack="html_tailwind", model=MODEL, max_concurrency=2, max_retries=1
+        )
+    )
+
+    assert max_in_flight == 2
+    assert sorted(output_files) == ["a_0.html", "b_0.html", "d_0.html", "e_0.html"]
+    folder = output_folder(evals_dir)
+    with open(os.path.join(folder, "b_0.html")) as f:
+        assert f.read() == "<html>data:image/png;base64,Yg==</html>"
+    with open(os.path.join(folder, runner.MANIFEST_FILENAME)) as f:
+        manifest = json.load(f)
+    assert sorted(manifest["outputs"]) == sorted(output_files)
+    assert list(manifest["failures"]) == ["c_0.html"]
+    with open(os.path.join(folder, "stream_stats.json")) as f:
+        assert json.load(f)[MODEL]["completions"] == 4
+
+
+def test_rerun_skips_generated_outputs(evals_dir: str, monkeypatch: pytest.MonkeyPatch):
+    generated: list[str] = []
+
+    async def generate_code_for_image(image_url: str, stack: str, model: Llm):
+        generated.append(image_url)
+        return Completion({**empty_completion(), "code": "<html></html>"})
+
+    monkeypatch.setattr(runner, "generate_code_for_image", generate_code_for_image)
+
+    asyncio.run(runner.run_image_evals(stack="html_tailwind", model=MODEL))
+    assert len(generated) == 5
+
+    # An output deleted since (or never written) is generated again
+    os.remove(os.path.join(output_folder(evals_dir), "a_0.html"))
+    generated.clear()
+    output_files = asyncio.run(
+        runner.run_image_evals(stack="html_tailwind", model=MODEL)
+    )
+    assert generated == ["data:image/png;base64,YQ=="]
+    assert len(output_files) == 5
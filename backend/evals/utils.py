@@ -1,7 +1,12 @@
 import base64
+from executors.core import run_blocking
 
 
-async def image_to_data_url(filepath: str):
+def read_data_url(filepath: str) -> str:
     with open(filepath, "rb") as image_file:
         encoded_string = base64.b64encode(image_file.read()).decode()
     return f"data:image/png;base64,{encoded_string}"
+
+
+async def image_to_data_url(filepath: str):
+    return await run_blocking(read_data_url, filepath)
@@ -0,0 +1,117 @@
+import asyncio
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import partial
+from typing import Any, Callable, Literal, TypeVar, cast, get_args
+from config import CPU_EXECUTOR_KIND, CPU_EXECUTOR_MAX_WORKERS
+from metrics.core import Counters
+
+T = TypeVar("T")
+
+ExecutorKind = Literal["thread", "process"]
+
+
+@dataclass
+class CpuExecutorCounters(Counters):
+    max_queue_depth: int = 0
+    # Jobs that returned (failed ones are only counted in failed)
+    completed: int = 0
+    failed: int = 0
+    total_queue_wait_seconds: float = 0.0
+    total_run_time_seconds: float = 0.0
+
+
+class CpuExecutor:
+    """
+    Shared, bounded pool for CPU-bound work so that it doesn't block the event
+    loop (and every other WebSocket stream in the worker) while it runs.
+
+    With the "process" kind, functions and their arguments need to be picklable,
+    and in-process caches (e.g. the processed image cache) are per worker.
+    """
+
+    def __init__(self, kind: ExecutorKind, max_workers: int):
+        self.kind = kind
+        self.max_workers = max_workers
+        self.executor: Executor | None = None
+        self.in_flight = 0
+        self.counters = CpuExecutorCounters()
+
+    @property
+    def queue_depth(self) -> int:
+        return max(0, self.in_flight - self.max_workers)
+
+    def get_executor(self) -> Executor:
+        if self.executor is None:
+            if self.kind == "process":
+                self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            else:
+                self.executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix="cpu-executor"
+                )
+        return self.executor
+
+    async def run(self, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        loop = asyncio.get_running_loop()
+
+        self.in_flight += 1
+        self.counters.max_queue_depth = max(
+            self.counters.max_queue_depth, self.queue_depth
+        )
+        submit_time = time.perf_counter()
+        try:
+            result, start_time = await loop.run_in_executor(
+                self.get_executor(), partial(timed_call, func, *args, **kwargs)
+            )
+        except Exception:
+            self.counters.failed += 1
+            raise
+        finally:
+            self.in_flight -= 1
+        end_time = time.perf_counter()
+        self.counters.total_queue_wait_seconds += max(0.0, start_time - submit_time)
+        self.counters.total_run_time_seconds += end_time - start_time
+        self.counters.completed += 1
+        return cast(T, result)
+
+    def stats(self) -> dict[str, float]:
+        return {
+            "in_flight": self.in_flight,
+            "queue_depth": self.queue_depth,
+            **self.counters.stats(),
+        }
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+
+# Records when the work actually started so we can tell queue wait from run time
+# (module-level so that it can be pickled for the process pool)
+def timed_call(func: Callable[..., T], *args: Any, **kwargs: Any) -> tuple[T, float]:
+    start_time = time.perf_counter()
+    return (func(*args, **kwargs), start_time)
+
+
+def parse_executor_kind(value: str) -> ExecutorKind:
+    if value not in get_args(ExecutorKind):
+        raise ValueError(
+            f"Invalid CPU_EXECUTOR_KIND {value!r} "
+            f"(expected one of {', '.join(get_args(ExecutorKind))})"
+        )
+    return cast(ExecutorKind, value)
+
+
+# Blocking I/O (reading and writing files, SQLite) runs in the default thread
+# pool rather than in cpu_executor, so that it doesn't queue behind CPU-bound
+# work, and never on the event loop
+async def run_blocking(func: Callable[..., T], *args: Any) -> T:
+    return await asyncio.to_thread(func, *args)
+
+
+# Parsed when the app starts, so that a bad setting fails fast
+cpu_executor = CpuExecutor(
+    kind=parse_executor_kind(CPU_EXECUTOR_KIND), max_workers=CPU_EXECUTOR_MAX_WORKERS
+)
@@ -0,0 +1,98 @@
+import asyncio
+import base64
+import io
+import time
+import numpy as np
+import pytest
+from PIL import Image
+from executors.core import CpuExecutor, parse_executor_kind
+from image_processing.cache import processed_image_cache
+from image_processing.utils import process_image
+
+MAX_EVENT_LOOP_LAG_SECONDS = 0.1
+
+
+def heavy_image_data_url() -> str:
+    # Long screenshot over the dimension limit, with a noisy (hard to compress) area
+    rng = np.random.default_rng(0)
+    pixels = np.full((8100, 1600, 3), 245, dtype=np.uint8)
+    pixels[:1500] = rng.integers(0, 255, (1500, 1600, 3), dtype=np.uint8)
+    output = io.BytesIO()
+    Image.fromarray(pixels).save(output, format="PNG", compress_level=1)
+    return "data:image/png;base64," + base64.b64encode(output.getvalue()).decode()
+
+
+def test_event_loop_stays_responsive_while_processing_heavy_image():
+    data_url = heavy_image_data_url()
+    processed_image_cache.clear()
+
+    async def run():
+        executor = CpuExecutor(kind="thread", max_workers=2)
+        max_lag = 0.0
+        done = False
+
+        async def measure_lag():
+            nonlocal max_lag
+            while not done:
+                start_time = time.perf_counter()
+                await asyncio.sleep(0.01)
+                max_lag = max(max_lag, time.perf_counter() - start_time - 0.01)
+
+        lag_task = asyncio.create_task(measure_lag())
+        start_time = time.perf_counter()
+        media_type, _ = await executor.run(process_image, data_url)
+        processing_time = time.perf_counter() - start_time
+        done = True
+        await lag_task
+        executor.shutdown()
+
+        assert media_type == "image/jpeg"
+        assert processing_time > MAX_EVENT_LOOP_LAG_SECONDS
+        assert max_lag < MAX_EVENT_LOOP_LAG_SECONDS
+        assert executor.counters.completed == 1
+        assert executor.in_flight == 0
+
+    asyncio.run(run())
+
+
+def test_queue_depth_is_tracked_beyond_max_workers():
+    async def run():
+        executor = CpuExecutor(kind="thread", max_workers=1)
+        depths: list[int] = []
+
+        async def observe():
+            await asyncio.sleep(0.02)
+            depths.append(executor.queue_depth)
+
+        await asyncio.gather(
+            *[executor.run(time.sleep, 0.05) for _ in range(3)], observe()
+        )
+        executor.shutdown()
+
+        assert depths == [2]
+        assert executor.counters.max_queue_depth == 2
+        assert executor.stats()["total_queue_wait_seconds"] > 0
+
+    asyncio.run(run())
+
+
+def test_failures_are_counted_separately():
+    async def run():
+        executor = CpuExecutor(kind="thread", max_workers=1)
+        await executor.run(time.sleep, 0)
+        with pytest.raises(ZeroDivisionError):
+            await executor.run(divmod, 1, 0)
+        executor.shutdown()
+        return executor.stats()
+
+    stats = asyncio.run(run())
+
+    assert stats["completed"] == 1
+    assert stats["failed"] == 1
+    assert stats["in_flight"] == 0
+
+
+def test_invalid_executor_kind_is_rejected():
+    assert parse_executor_kind("process") == "process"
+    with pytest.raises(ValueError, match="CPU_EXECUTOR_KIND"):
+        parse_executor_kind("processes")
@@ -1,23 +1,207 @@
-from datetime import datetime
+from dataclasses import dataclass
+from datetime import datetime, timezone
+import base64
+import gzip
+import hashlib
 import json
+import mimetypes
 import os
+import queue
+import threading
+import uuid
+from typing import Any, List
 from openai.types.chat import ChatCompletionMessageParam
+from config import (
+    RUN_LOG_BATCH_SIZE,
+    RUN_LOG_QUEUE_SIZE,
+    RUN_LOG_SEGMENT_MAX_BYTES,
+)
+from metrics.core import Counters
+from utils import atomic_write
 
+# Tells the writer thread to stop
+STOP = object()
 
-def write_logs(prompt_messages: list[ChatCompletionMessageParam], completion: str):
-    # Get the logs path from environment, default to the current working directory
-    logs_path = os.environ.get("LOGS_PATH", os.getcwd())
+# Upper bound on the image hashes remembered to skip checking if they're written
+MAX_KNOWN_IMAGE_HASHES = 100_000
 
-    # Create run_logs directory if it doesn't exist within the specified logs path
-    logs_directory = os.path.join(logs_path, "run_logs")
-    if not os.path.exists(logs_directory):
-        os.makedirs(logs_directory)
 
-    print("Writing to logs directory:", logs_directory)
+@dataclass
+class RunLogCounters(Counters):
+    records_written: int = 0
+    # Records that didn't fit in the queue
+    records_dropped: int = 0
+    batches_written: int = 0
+    images_written: int = 0
+    write_errors: int = 0
 
-    # Generate a unique filename using the current timestamp within the logs directory
-    filename = datetime.now().strftime(f"{logs_directory}/messages_%Y%m%d_%H%M%S.json")
 
-    # Write the messages dict into a new file for each run
-    with open(filename, "w") as f:
-        f.write(json.dumps({"prompt": prompt_messages, "completion": completion}))
+class RunLogWriter:
+    """
+    Appends run logs (the prompt and completion of each generation) to gzipped
+    JSONL segments in a background thread, so that serializing multi-MB
+    prompts and writing them never blocks the event loop.
+
+    Records are queued (dropped if the queue is full, rather than slowing
+    requests down) and written in batches, one gzip member per batch. Segments
+    are rotated once they reach max_segment_bytes. Images in the prompt (data
+    URLs) are written once to images/<sha256>.<ext> and referenced by that path.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        max_queue_size: int = RUN_LOG_QUEUE_SIZE,
+        max_batch_size: int = RUN_LOG_BATCH_SIZE,
+        max_segment_bytes: int = RUN_LOG_SEGMENT_MAX_BYTES,
+    ):
+        self.directory = directory
+        self.images_directory = os.path.join(directory, "images")
+        self.max_batch_size = max_batch_size
+        self.max_segment_bytes = max_segment_bytes
+        self.queue: queue.Queue[Any] = queue.Queue(max_queue_size)
+        self.thread: threading.Thread | None = None
+        self.lock = threading.Lock()
+
+        self.segment_path: str | None = None
+        self.segment_number = 0
+        # Content hashes of the images already written
+        self.image_hashes: set[str] = set()
+        self.counters = RunLogCounters()
+
+    # Queue a run log and return its ID (without waiting for it to be written)
+    def write(
+        self, prompt_messages: List[ChatCompletionMessageParam], completion: str
+    ) -> str:
+        record_id = uuid.uuid4().hex
+        record = {
+            "id": record_id,
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "prompt": prompt_messages,
+            "completion": completion,
+        }
+
+        self.start()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.counters.records_dropped += 1
+            print("Run log queue is full, dropping run log", record_id)
+        return record_id
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self.run, name="run-log-writer", daemon=True
+                )
+                self.thread.start()
+
+    # Wait until everything queued so far is written
+    def flush(self):
+        if self.thread is not None:
+            self.queue.join()
+
+    def close(self):
+        with self.lock:
+            thread = self.thread
+            self.thread = None
+        if thread is not None:
+            self.queue.put(STOP)
+            thread.join()
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.max_batch_size and batch[-1] is not STOP:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            records = [record for record in batch if record is not STOP]
+            try:
+                if records:
+                    self.write_batch(records)
+            except Exception as e:
+                self.counters.write_errors += 1
+                print("Failed to write run logs:", e)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+            if batch[-1] is STOP:
+                return
+
+    def write_batch(self, records: List[dict[str, Any]]):
+        os.makedirs(self.images_directory, exist_ok=True)
+        lines = [
+            json.dumps({**record, "prompt": self.store_images(record["prompt"])}) + "\n"
+            for record in records
+        ]
+
+        path = self.get_segment_path()
+        with gzip.open(path, "at", encoding="utf-8") as f:
+            f.writelines(lines)
+
+        self.counters.records_written += len(records)
+        self.counters.batches_written += 1
+        if os.path.getsize(path) >= self.max_segment_bytes:
+            self.segment_path = None
+
+    def get_segment_path(self) -> str:
+        if self.segment_path is None:
+            # Unique across processes writing to the same directory
+            self.segment_number += 1
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            self.segment_path = os.path.join(
+                self.directory,
+                f"runs_{timestamp}_{os.getpid()}_{self.segment_number}.jsonl.gz",
+            )
+        return self.segment_path
+
+    # Replaces data URLs with the path of the stored image (relative to the log
+    # directory), without modifying the messages
+    def store_images(self, value: Any) -> Any:
+        if isinstance(value, str):
+            if value.startswith("data:") and ";base64," in value:
+                return self.store_image(value)
+            return value
+        if isinstance(value, list):
+            return [self.store_images(item) for item in value]  # type: ignore
+        if isinstance(value, dict):
+            return {key: self.store_images(item) for key, item in value.items()}  # type: ignore
+        return value
+
+    def store_image(self, data_url: str) -> str:
+        header, encoded = data_url.split(",", 1)
+        media_type = header[len("data:") :].split(";")[0]
+        data = base64.b64decode(encoded)
+        digest = hashlib.sha256(data).hexdigest()
+        extension = mimetypes.guess_extension(media_type) or ".bin"
+        path = os.path.join("images", digest + extension)
+
+        if digest not in self.image_hashes:
+            full_path = os.path.join(self.directory, path)
+            if not os.path.exists(full_path):
+                atomic_write(full_path, data)
+                self.counters.images_written += 1
+            if len(self.image_hashes) >= MAX_KNOWN_IMAGE_HASHES:
+                self.image_hashes.clear()
+            self.image_hashes.add(digest)
+        return path
+
+    def stats(self) -> dict[str, float]:
+        return {"queued": self.queue.qsize(), **self.counters.stats()}
+
+
+# Logs go to run_logs in LOGS_PATH (by default, the current working directory)
+run_log_writer = RunLogWriter(
+    os.path.join(os.environ.get("LOGS_PATH", os.getcwd()), "run_logs")
+)
+
+
+def write_logs(
+    prompt_messages: list[ChatCompletionMessageParam], completion: str
+) -> str:
+    return run_log_writer.write(prompt_messages, completion)
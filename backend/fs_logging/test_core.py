@@ -0,0 +1,98 @@
+import base64
+import glob
+import gzip
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Any, List
+from fs_logging.core import RunLogWriter
+
+PNG_DATA_URL = "data:image/png;base64," + base64.b64encode(b"fake png").decode()
+
+
+def prompt(image_url: str) -> List[Any]:
+    return [
+        {"role": "system", "content": "You are an expert developer"},
+        {
+            "role": "user",
+            "content": [
+                {"type": "image_url", "image_url": {"url": image_url}},
+                {"type": "text", "text": "Generate code for this screenshot"},
+            ],
+        },
+    ]
+
+
+def read_records(directory: Path) -> List[dict[str, Any]]:
+    records: List[dict[str, Any]] = []
+    for path in sorted(glob.glob(str(directory / "runs_*.jsonl.gz"))):
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            records.extend(json.loads(line) for line in f)
+    return records
+
+
+def test_records_are_written_in_the_background_with_unique_ids(tmp_path: Path):
+    writer = RunLogWriter(str(tmp_path), max_batch_size=10)
+    messages = prompt(PNG_DATA_URL)
+
+    ids = [writer.write(messages, f"<html>{i}</html>") for i in range(25)]
+    writer.close()
+
+    records = read_records(tmp_path)
+    assert [record["id"] for record in records] == ids
+    assert len(set(ids)) == 25
+    assert records[3]["completion"] == "<html>3</html>"
+    assert writer.stats()["records_written"] == 25
+    # The caller's messages aren't modified
+    assert messages[1]["content"][0]["image_url"]["url"] == PNG_DATA_URL
+
+
+def test_images_are_stored_once_by_content_hash(tmp_path: Path):
+    writer = RunLogWriter(str(tmp_path))
+    other_data_url = "data:image/jpeg;base64," + base64.b64encode(b"jpeg").decode()
+
+    writer.write(prompt(PNG_DATA_URL), "a")
+    writer.write(prompt(PNG_DATA_URL), "b")
+    writer.write(prompt(other_data_url), "c")
+    writer.close()
+
+    records = read_records(tmp_path)
+    image_paths = [
+        record["prompt"][1]["content"][0]["image_url"]["url"] for record in records
+    ]
+    assert image_paths[0] == image_paths[1] != image_paths[2]
+    assert image_paths[0].startswith("images/") and image_paths[0].endswith(".png")
+    assert (tmp_path / image_paths[0]).read_bytes() == b"fake png"
+    assert sorted(os.listdir(tmp_path / "images")) == sorted(
+        os.path.basename(path) for path in set(image_paths)
+    )
+    assert writer.stats()["images_written"] == 2
+
+
+def test_segments_are_rotated(tmp_path: Path):
+    writer = RunLogWriter(str(tmp_path), max_batch_size=1, max_segment_bytes=1)
+
+    for i in range(3):
+        writer.write(prompt("https://example.com/screenshot.png"), str(i))
+        writer.flush()
+    writer.close()
+
+    assert len(glob.glob(str(tmp_path / "runs_*.jsonl.gz"))) == 3
+    assert [record["completion"] for record in read_records(tmp_path)] == [
+        "0",
+        "1",
+        "2",
+    ]
+
+
+def test_records_are_dropped_when_the_queue_is_full(tmp_path: Path):
+    writer = RunLogWriter(str(tmp_path), max_queue_size=2)
+    # A writer thread that never runs, so that the queue fills
+    writer.thread = threading.Thread(target=lambda: None)
+
+    for i in range(5):
+        writer.write(prompt(PNG_DATA_URL), str(i))
+
+    assert writer.stats()["records_dropped"] == 3
+    assert writer.stats()["queued"] == 2
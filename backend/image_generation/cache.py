@@ -0,0 +1,269 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Protocol
+from caching.lru import LruCache
+from config import (
+    GENERATED_IMAGE_CACHE_MAX_ENTRIES,
+    GENERATED_IMAGE_CACHE_PATH,
+    GENERATED_IMAGE_CACHE_TTL_SECONDS,
+)
+from metrics.core import Counters, ratio
+
+# Number of entries kept in the in-memory LRU in front of the persistent backend
+GENERATED_IMAGE_MEMORY_CACHE_MAX_ENTRIES = 1024
+
+# (image URL, time it was generated)
+CachedImage = tuple[str, float]
+
+
+class ImageCacheBackend(Protocol):
+    def get_many(self, keys: list[str]) -> dict[str, CachedImage]: ...
+
+    def put_many(self, entries: dict[str, CachedImage]): ...
+
+    def delete_many(self, keys: list[str]): ...
+
+    # Remove entries created before expired_before, then the least recently
+    # used ones until there are at most max_entries left
+    def evict(self, max_entries: int, expired_before: float): ...
+
+    def close(self): ...
+
+
+class SqliteImageCacheBackend:
+    def __init__(self, path: str, clock: Callable[[], float] = time.time):
+        self.path = path
+        self.clock = clock
+        self.connection: sqlite3.Connection | None = None
+        self.lock = threading.Lock()
+
+    # Connect lazily so that importing the module doesn't create the database file
+    def get_connection(self) -> sqlite3.Connection:
+        if self.connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            # Lookups happen on the request path, so avoid an fsync per write
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS generated_images (
+                    key TEXT PRIMARY KEY,
+                    url TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_used REAL NOT NULL
+                )
+                """)
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS generated_images_last_used "
+                "ON generated_images (last_used)"
+            )
+            connection.commit()
+            self.connection = connection
+        return self.connection
+
+    def get_many(self, keys: list[str]) -> dict[str, CachedImage]:
+        if not keys:
+            return {}
+        placeholders = ",".join("?" * len(keys))
+        with self.lock:
+            connection = self.get_connection()
+            rows = connection.execute(
+                f"SELECT key, url, created_at FROM generated_images WHERE key IN ({placeholders})",
+                keys,
+            ).fetchall()
+            if rows:
+                connection.execute(
+                    f"UPDATE generated_images SET last_used = ? WHERE key IN ({placeholders})",
+                    [self.clock(), *keys],
+                )
+                connection.commit()
+        return {key: (url, created_at) for key, url, created_at in rows}
+
+    def put_many(self, entries: dict[str, CachedImage]):
+        if not entries:
+            return
+        now = self.clock()
+        with self.lock:
+            connection = self.get_connection()
+            connection.executemany(
+                "INSERT OR REPLACE INTO generated_images (key, url, created_at, last_used) "
+                "VALUES (?, ?, ?, ?)",
+                [
+                    (key, url, created_at, now)
+                    for key, (url, created_at) in entries.items()
+                ],
+            )
+            connection.commit()
+
+    def delete_many(self, keys: list[str]):
+        if not keys:
+            return
+        with self.lock:
+            connection = self.get_connection()
+            connection.executemany(
+                "DELETE FROM generated_images WHERE key = ?", [(key,) for key in keys]
+            )
+            connection.commit()
+
+    def evict(self, max_entries: int, expired_before: float):
+        with self.lock:
+            connection = self.get_connection()
+            connection.execute(
+                "DELETE FROM generated_images WHERE created_at < ?", (expired_before,)
+            )
+            (count,) = connection.execute(
+                "SELECT COUNT(*) FROM generated_images"
+            ).fetchone()
+            if count > max_entries:
+                connection.execute(
+                    "DELETE FROM generated_images WHERE key IN ("
+                    "SELECT key FROM generated_images ORDER BY last_used ASC LIMIT ?)",
+                    (count - max_entries,),
+                )
+            connection.commit()
+
+    def count(self) -> int:
+        with self.lock:
+            (count,) = (
+                self.get_connection()
+                .execute("SELECT COUNT(*) FROM generated_images")
+                .fetchone()
+            )
+        return count
+
+    def close(self):
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+
+def normalize_alt(alt: str) -> str:
+    return re.sub(r"\s+", " ", alt).strip().lower()
+
+
+@dataclass
+class GeneratedImageCacheCounters(Counters):
+    memory_hits: int = 0
+    backend_hits: int = 0
+    misses: int = 0
+
+    def derived_stats(self) -> dict[str, float]:
+        hits = self.memory_hits + self.backend_hits
+        return {"hits": hits, "hit_rate": ratio(hits, hits + self.misses)}
+
+
+class GeneratedImageCache:
+    """
+    Cross-session cache of generated image URLs keyed by (model, normalized alt
+    text, size), with an in-memory LRU in front of an optional persistent backend.
+
+    Entries expire after ttl_seconds (provider image URLs stop working after a
+    while) and the backend is bounded to max_entries (least recently used go first).
+    """
+
+    def __init__(
+        self,
+        backend: ImageCacheBackend | None,
+        ttl_seconds: float = GENERATED_IMAGE_CACHE_TTL_SECONDS,
+        max_entries: int = GENERATED_IMAGE_CACHE_MAX_ENTRIES,
+        max_memory_entries: int = GENERATED_IMAGE_MEMORY_CACHE_MAX_ENTRIES,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.clock = clock
+        self.memory: LruCache[str, CachedImage] = LruCache(max_memory_entries)
+        self.lock = threading.Lock()
+        self.counters = GeneratedImageCacheCounters()
+
+    @staticmethod
+    def key(model: str, alt: str, size: str) -> str:
+        return f"{model}|{size}|{normalize_alt(alt)}"
+
+    def is_expired(self, created_at: float) -> bool:
+        return self.clock() - created_at > self.ttl_seconds
+
+    # Returns the cached URLs (by alt text) for the alts that have one
+    def get_many(self, model: str, size: str, alts: list[str]) -> dict[str, str]:
+        keys = {alt: self.key(model, alt, size) for alt in alts}
+        found: dict[str, str] = {}
+        expired: list[str] = []
+
+        with self.lock:
+            for alt, key in keys.items():
+                value = self.memory.get(key)
+                if value is None:
+                    continue
+                if self.is_expired(value[1]):
+                    self.memory.pop(key)
+                    expired.append(key)
+                    continue
+                found[alt] = value[0]
+            self.counters.memory_hits += len(found)
+
+        missing = {alt: key for alt, key in keys.items() if alt not in found}
+        if self.backend is not None and missing:
+            stored = self.backend.get_many(list(set(missing.values())))
+            with self.lock:
+                for alt, key in missing.items():
+                    value = stored.get(key)
+                    if value is None:
+                        continue
+                    if self.is_expired(value[1]):
+                        expired.append(key)
+                        continue
+                    self.memory.put(key, value)
+                    found[alt] = value[0]
+                    self.counters.backend_hits += 1
+
+        with self.lock:
+            self.counters.misses += len(alts) - len(found)
+
+        if self.backend is not None and expired:
+            self.backend.delete_many(expired)
+
+        return found
+
+    def put_many(self, model: str, size: str, urls: dict[str, str]):
+        now = self.clock()
+        entries = {self.key(model, alt, size): (url, now) for alt, url in urls.items()}
+        if not entries:
+            return
+
+        with self.lock:
+            for key, value in entries.items():
+                self.memory.put(key, value)
+
+        if self.backend is not None:
+            self.backend.put_many(entries)
+            self.backend.evict(self.max_entries, now - self.ttl_seconds)
+
+    def clear(self):
+        with self.lock:
+            self.memory.clear()
+            self.counters = GeneratedImageCacheCounters()
+
+    def close(self):
+        if self.backend is not None:
+            self.backend.close()
+
+    def stats(self) -> dict[str, float]:
+        with self.lock:
+            return {**self.counters.stats(), "memory_entries": len(self.memory)}
+
+
+generated_image_cache = GeneratedImageCache(
+    backend=(
+        SqliteImageCacheBackend(GENERATED_IMAGE_CACHE_PATH)
+        if GENERATED_IMAGE_CACHE_PATH
+        else None
+    )
+)
@@ -1,10 +1,23 @@
 import asyncio
 import re
-from typing import Dict, List, Literal, Union
-from openai import AsyncOpenAI
-from bs4 import BeautifulSoup
+from typing import Awaitable, Dict, List, Literal, Union
 
+from clients.core import client_registry
+from executors.core import cpu_executor, run_blocking
+from image_generation.cache import generated_image_cache
+from image_generation.img_tags import find_img_tags, set_tag_attributes
 from image_generation.replicate import call_replicate
+from image_generation.scheduler import get_scheduler
+from metrics.core import metrics_registry
+
+# Size of the generated images for each model (part of the image cache key)
+IMAGE_SIZES = {"dalle3": "1024x1024", "flux": "1:1"}
+
+image_generation_duration = metrics_registry.histogram(
+    "image_generation_seconds",
+    "Duration of image generation requests to the provider (excluding queueing)",
+    ["model"],
+)
 
 
 async def process_tasks(
@@ -16,10 +29,27 @@ async def process_tasks(
     import time
 
     start_time = time.time()
+    # Requests are queued, rate limited and retried per model and API key
+    # (process-wide, so that concurrent users don't flood the provider)
+    scheduler = get_scheduler(model, api_key)
     if model == "dalle3":
-        tasks = [generate_image_dalle(prompt, api_key, base_url) for prompt in prompts]
+        tasks = [
+            scheduler.run(
+                lambda p=prompt: time_image_generation(
+                    model, generate_image_dalle(p, api_key, base_url)
+                )
+            )
+            for prompt in prompts
+        ]
     else:
-        tasks = [generate_image_replicate(prompt, api_key) for prompt in prompts]
+        tasks = [
+            scheduler.run(
+                lambda p=prompt: time_image_generation(
+                    model, generate_image_replicate(p, api_key)
+                )
+            )
+            for prompt in prompts
+        ]
     results = await asyncio.gather(*tasks, return_exceptions=True)
     end_time = time.time()
     generation_time = end_time - start_time
@@ -36,19 +66,24 @@ async def process_tasks(
     return processed_results
 
 
+async def time_image_generation(model: str, generation: Awaitable[Union[str, None]]):
+    with image_generation_duration.time(model=model):
+        return await generation
+
+
 async def generate_image_dalle(
     prompt: str, api_key: str, base_url: str | None
 ) -> Union[str, None]:
-    client = AsyncOpenAI(api_key=api_key, base_url=base_url)
-    res = await client.images.generate(
-        model="dall-e-3",
-        quality="standard",
-        style="natural",
-        n=1,
-        size="1024x1024",
-        prompt=prompt,
-    )
-    await client.close()
+    async with client_registry.lease_openai(api_key, base_url) as client:
+        # Retries are handled by the scheduler (process_tasks)
+        res = await client.with_options(max_retries=0).images.generate(
+            model="dall-e-3",
+            quality="standard",
+            style="natural",
+            n=1,
+            size=IMAGE_SIZES["dalle3"],
+            prompt=prompt,
+        )
     return res.data[0].url
 
 
@@ -59,7 +94,7 @@ async def generate_image_replicate(prompt: str, api_key: str) -> str:
         {
             "prompt": prompt,
             "num_outputs": 1,
-            "aspect_ratio": "1:1",
+            "aspect_ratio": IMAGE_SIZES["flux"],
             "output_format": "png",
             "output_quality": 100,
         },
@@ -81,77 +116,142 @@ def extract_dimensions(url: str):
 
 
 def create_alt_url_mapping(code: str) -> Dict[str, str]:
-    soup = BeautifulSoup(code, "html.parser")
-    images = soup.find_all("img")
-
     mapping: Dict[str, str] = {}
 
-    for image in images:
-        if not image["src"].startswith("https://placehold.co"):
-            mapping[image["alt"]] = image["src"]
+    for tag in find_img_tags(code):
+        src, alt = tag.get("src"), tag.get("alt")
+        if src is not None and alt is not None and not tag.is_placeholder:
+            mapping[alt] = src
 
     return mapping
 
 
-async def generate_images(
-    code: str,
-    api_key: str,
-    base_url: Union[str, None],
-    image_cache: Dict[str, str],
-    model: Literal["dalle3", "flux"] = "dalle3",
-) -> str:
-    # Find all images
-    soup = BeautifulSoup(code, "html.parser")
-    images = soup.find_all("img")
-
+# Extract alt texts of placeholder images as prompts for images that need generating
+def extract_image_prompts(code: str, image_cache: Dict[str, str]) -> List[str]:
     # Extract alt texts as image prompts
     alts: List[str | None] = []
-    for img in images:
+    for tag in find_img_tags(code):
         # Only include URL if the image starts with https://placehold.co
         # and it's not already in the image_cache
-        if (
-            img["src"].startswith("https://placehold.co")
-            and image_cache.get(img.get("alt")) is None
-        ):
-            alts.append(img.get("alt", None))
+        if tag.is_placeholder and image_cache.get(tag.get("alt")) is None:  # type: ignore
+            alts.append(tag.get("alt"))
 
     # Exclude images with no alt text
     filtered_alts: List[str] = [alt for alt in alts if alt is not None]
 
     # Remove duplicates
-    prompts = list(set(filtered_alts))
+    return list(set(filtered_alts))
 
-    # Return early if there are no images to replace
+
+# Replace placeholder image URLs with the generated URLs (mapped by alt text)
+# Only the src, width and height attributes of those images are rewritten,
+# the rest of the code is kept byte-for-byte intact
+def replace_image_urls(code: str, mapped_image_urls: Dict[str, str | None]) -> str:
+    pieces: List[str] = []
+    position = 0
+
+    for tag in find_img_tags(code):
+        # Skip images that don't start with https://placehold.co (leave them alone)
+        if not tag.is_placeholder:
+            continue
+
+        alt = tag.get("alt")
+        new_url = mapped_image_urls.get(alt) if alt is not None else None
+
+        if new_url:
+            width, height = extract_dimensions(tag.get("src") or "")
+            pieces.append(code[position : tag.start])
+            pieces.append(
+                set_tag_attributes(
+                    code, tag, {"src": new_url, "width": width, "height": height}
+                )
+            )
+            position = tag.end
+        else:
+            print(f"Image generation failed for alt text: {alt}")
+
+    pieces.append(code[position:])
+    return "".join(pieces)
+
+
+# Generate images for the given prompts, reusing images generated for the same
+# prompts in earlier sessions. Returns the image URL (or None if generation failed)
+# for each prompt.
+async def generate_images_for_prompts(
+    prompts: List[str],
+    api_key: str,
+    base_url: Union[str, None],
+    model: Literal["dalle3", "flux"],
+) -> Dict[str, str | None]:
     if len(prompts) == 0:
-        return code
+        return {}
+
+    size = IMAGE_SIZES[model]
+    cached_image_urls = await run_blocking(
+        generated_image_cache.get_many, model, size, prompts
+    )
+    prompts_to_generate = [
+        prompt for prompt in prompts if prompt not in cached_image_urls
+    ]
+    print(
+        f"Image cache: {len(cached_image_urls)} hits, "
+        f"{len(prompts_to_generate)} misses"
+    )
 
     # Generate images
-    results = await process_tasks(prompts, api_key, base_url, model)
+    results = await process_tasks(prompts_to_generate, api_key, base_url, model)
 
     # Create a dict mapping alt text to image URL
-    mapped_image_urls = dict(zip(prompts, results))
+    generated_image_urls = dict(zip(prompts_to_generate, results))
+    await run_blocking(
+        generated_image_cache.put_many,
+        model,
+        size,
+        {alt: url for alt, url in generated_image_urls.items() if url},
+    )
 
-    # Merge with image_cache
-    mapped_image_urls = {**mapped_image_urls, **image_cache}
+    return {**generated_image_urls, **cached_image_urls}
 
-    # Replace old image URLs with the generated URLs
-    for img in images:
-        # Skip images that don't start with https://placehold.co (leave them alone)
-        if not img["src"].startswith("https://placehold.co"):
-            continue
 
-        new_url = mapped_image_urls[img.get("alt")]
+async def generate_images(
+    code: str,
+    api_key: str,
+    base_url: Union[str, None],
+    image_cache: Dict[str, str],
+    model: Literal["dalle3", "flux"] = "dalle3",
+    started_images: Dict[str, Awaitable[str | None]] | None = None,
+    # The code's image prompts, if the caller already extracted them
+    prompts: List[str] | None = None,
+) -> str:
+    if prompts is None:
+        prompts = await cpu_executor.run(extract_image_prompts, code, image_cache)
 
-        if new_url:
-            # Set width and height attributes
-            width, height = extract_dimensions(img["src"])
-            img["width"] = width
-            img["height"] = height
-            # Replace img['src'] with the mapped image URL
-            img["src"] = new_url
+    # Return early if there are no images to replace
+    if len(prompts) == 0:
+        return code
+
+    # Images that were already started (e.g. while the code was streaming)
+    # only need to be awaited
+    started_images = started_images or {}
+    started_prompts = [prompt for prompt in prompts if prompt in started_images]
+    new_prompts = [prompt for prompt in prompts if prompt not in started_images]
+
+    mapped_image_urls, started_results = await asyncio.gather(
+        generate_images_for_prompts(new_prompts, api_key, base_url, model),
+        asyncio.gather(
+            *[started_images[prompt] for prompt in started_prompts],
+            return_exceptions=True,
+        ),
+    )
+    for prompt, result in zip(started_prompts, started_results):
+        if isinstance(result, BaseException):
+            print(f"An exception occurred: {result}")
+            mapped_image_urls[prompt] = None
         else:
-            print("Image generation failed for alt text:" + img.get("alt"))
+            mapped_image_urls[prompt] = result
 
-    # Return the modified HTML
-    # (need to prettify it because BeautifulSoup messes up the formatting)
-    return soup.prettify()
+    # Merge with image_cache
+    mapped_image_urls = {**mapped_image_urls, **image_cache}
+
+    # Replace old image URLs with the generated URLs
+    return await cpu_executor.run(replace_image_urls, code, mapped_image_urls)
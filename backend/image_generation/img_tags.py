@@ -0,0 +1,206 @@
+import html
+import re
+from dataclasses import dataclass
+from typing import Dict, List
+
+PLACEHOLDER_IMAGE_URL_PREFIX = "https://placehold.co"
+
+# Comments and raw text elements (their content is never parsed as tags)
+# and the start of <img> tags
+TOKEN_PATTERN = re.compile(
+    r"<!--.*?(?:-->|\Z)"
+    r"|<(script|style|textarea|title)\b.*?(?:</\1\s*>|\Z)"
+    r"|<img(?=[\s/>]|\Z)",
+    re.IGNORECASE | re.DOTALL,
+)
+ATTRIBUTE_PATTERN = re.compile(
+    r"""\s*([^\s"'>/=]+)(?:\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+)))?"""
+)
+TAG_END_PATTERN = re.compile(r"\s*/?>")
+
+
+@dataclass
+class TagAttribute:
+    # Unescaped value (None for attributes without a value)
+    value: str | None
+    # Offsets of the whole attribute (name and value) in the document
+    start: int
+    end: int
+
+
+@dataclass
+class ImgTag:
+    start: int
+    end: int
+    # Keyed by lowercase name (the first one wins if an attribute is repeated)
+    attributes: Dict[str, TagAttribute]
+    # Offset right after the last attribute (where new attributes can be inserted)
+    attributes_end: int
+
+    def get(self, name: str) -> str | None:
+        attribute = self.attributes.get(name)
+        return attribute.value if attribute else None
+
+    @property
+    def is_placeholder(self) -> bool:
+        src = self.get("src")
+        return src is not None and src.startswith(PLACEHOLDER_IMAGE_URL_PREFIX)
+
+
+# Parse the attributes of the <img> tag starting at start (the offset of "<img")
+# Returns None if the tag isn't complete (no closing ">" yet)
+def parse_img_tag(code: str, start: int) -> ImgTag | None:
+    attributes: Dict[str, TagAttribute] = {}
+    position = start + len("<img")
+    attributes_end = position
+
+    while position < len(code):
+        tag_end = TAG_END_PATTERN.match(code, position)
+        if tag_end:
+            return ImgTag(start, tag_end.end(), attributes, attributes_end)
+
+        attribute = ATTRIBUTE_PATTERN.match(code, position)
+        if attribute is None:
+            # Stray characters (e.g. "/" or quotes) between attributes
+            position += 1
+            continue
+
+        # Quoted values that aren't closed yet are still being streamed in
+        if attribute.end() == len(code):
+            return None
+
+        name = attribute.group(1).lower()
+        raw_value = next(
+            (group for group in attribute.groups()[1:] if group is not None), None
+        )
+        if name not in attributes:
+            attributes[name] = TagAttribute(
+                value=html.unescape(raw_value) if raw_value is not None else None,
+                start=attribute.start(1),
+                end=attribute.end(),
+            )
+        position = attributes_end = attribute.end()
+
+    return None
+
+
+# Whether a comment or raw text element token includes its end (and isn't just
+# cut off at the end of the document)
+def is_closed(token: re.Match[str]) -> bool:
+    name = token.group(1)
+    if name is None:
+        return len(token.group(0)) > len("<!--") and token.group(0).endswith("-->")
+    return re.search(rf"</{name}\s*>\Z", token.group(0), re.IGNORECASE) is not None
+
+
+# Find all complete <img> tags from position onwards in a single pass over the
+# document (skipping comments, scripts and styles)
+# Also returns the offset scanning should resume from once more code is appended
+# (the start of the first incomplete tag or comment, or of a trailing "<...")
+def scan_img_tags(code: str, position: int = 0) -> tuple[List[ImgTag], int]:
+    tags: List[ImgTag] = []
+    while True:
+        token = TOKEN_PATTERN.search(code, position)
+        if token is None:
+            last_tag_start = code.rfind("<", position)
+            return (tags, last_tag_start if last_tag_start != -1 else len(code))
+
+        if token.group(0).lower() != "<img":
+            # Comments and raw text elements that aren't closed yet
+            if token.end() == len(code) and not is_closed(token):
+                return (tags, token.start())
+            position = token.end()
+            continue
+
+        tag = parse_img_tag(code, token.start())
+        if tag is None:
+            return (tags, token.start())
+        tags.append(tag)
+        position = tag.end
+
+
+def find_img_tags(code: str) -> List[ImgTag]:
+    return scan_img_tags(code)[0]
+
+
+# The start of a comment or raw text element (with its whole opening tag)
+RAW_TEXT_START_PATTERN = re.compile(
+    r"<!--|<(script|style|textarea|title)\b[^>]*>", re.IGNORECASE
+)
+# Longest tail kept while looking for the end of a comment or raw text element
+# (enough for a closing tag split across chunks)
+RAW_TEXT_END_MAX_LENGTH = 64
+
+
+class ImgTagDetector:
+    """
+    Incrementally finds complete <img> tags in streamed code. Only the
+    unfinished tail of the stream is kept and rescanned for each chunk
+    (so offsets of the returned tags are relative to that tail).
+
+    Inside a comment or raw text element (e.g. the <script> that React and Vue
+    pages are written in), only new chunks are searched for its end, so long
+    scripts aren't rescanned for every chunk.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        # End of the comment or raw text element the stream is in, if any
+        self.raw_text_end: re.Pattern[str] | None = None
+
+    def feed(self, content: str) -> List[ImgTag]:
+        self.buffer += content
+        tags: List[ImgTag] = []
+        while True:
+            if self.raw_text_end is not None:
+                end = self.raw_text_end.search(self.buffer)
+                if end is None:
+                    self.buffer = self.buffer[-RAW_TEXT_END_MAX_LENGTH:]
+                    return tags
+                self.buffer = self.buffer[end.end() :]
+                self.raw_text_end = None
+
+            found, resume_position = scan_img_tags(self.buffer)
+            tags.extend(found)
+            self.buffer = self.buffer[resume_position:]
+
+            start = RAW_TEXT_START_PATTERN.match(self.buffer)
+            if start is None:
+                return tags
+            self.raw_text_end = re.compile(
+                rf"</{start.group(1)}\s*>" if start.group(1) else "-->",
+                re.IGNORECASE,
+            )
+            self.buffer = self.buffer[start.end() :]
+
+
+def format_attribute(name: str, value: str | int) -> str:
+    return f'{name}="{html.escape(str(value), quote=True)}"'
+
+
+# Rewrite the given attributes of a tag, keeping the rest of it byte-for-byte intact.
+# Existing attributes are replaced in place, new ones are appended.
+def set_tag_attributes(
+    code: str, tag: ImgTag, new_attributes: Dict[str, str | int]
+) -> str:
+    replacements = sorted(
+        (
+            (tag.attributes[name].start, tag.attributes[name].end, name)
+            for name in new_attributes
+            if name in tag.attributes
+        )
+    )
+
+    pieces: List[str] = []
+    position = tag.start
+    for start, end, name in replacements:
+        pieces.append(code[position:start])
+        pieces.append(format_attribute(name, new_attributes[name]))
+        position = end
+    pieces.append(code[position : tag.attributes_end])
+    for name, value in new_attributes.items():
+        if name not in tag.attributes:
+            pieces.append(" " + format_attribute(name, value))
+    pieces.append(code[tag.attributes_end : tag.end])
+
+    return "".join(pieces)
@@ -1,8 +1,55 @@
 import asyncio
+import random
+import time
 import httpx
+from clients.core import client_registry
+from config import REPLICATE_PREDICTION_TIMEOUT_SECONDS, REPLICATE_PREFER_WAIT_SECONDS
+from image_generation.scheduler import ProviderHTTPError, parse_retry_after
 
+REPLICATE_API_BASE_URL = "https://api.replicate.com/v1"
+FLUX_SCHNELL_MODEL = "black-forest-labs/flux-schnell"
 
-async def call_replicate(input: dict[str, str | int], api_token: str) -> str:
+# Polling backoff (only needed if the prediction didn't finish while Replicate
+# held the create request open)
+INITIAL_POLL_INTERVAL_SECONDS = 0.25
+MAX_POLL_INTERVAL_SECONDS = 2.0
+POLL_BACKOFF_FACTOR = 1.5
+
+
+# Exponential backoff with jitter (so that concurrent predictions don't poll in lockstep)
+def poll_intervals():
+    interval = INITIAL_POLL_INTERVAL_SECONDS
+    while True:
+        yield interval * random.uniform(0.5, 1.0)
+        interval = min(interval * POLL_BACKOFF_FACTOR, MAX_POLL_INTERVAL_SECONDS)
+
+
+# Returns the output if the prediction is done (raises if it failed)
+def get_prediction_output(prediction: dict[str, object]) -> str | None:
+    status = prediction.get("status")
+    if status == "succeeded":
+        output = prediction["output"]
+        return output[0] if isinstance(output, list) else str(output)  # type: ignore
+    elif status == "error":
+        raise ValueError(
+            f"Inference errored out: {prediction.get('error', 'Unknown error')}"
+        )
+    elif status == "failed":
+        raise ValueError(
+            f"Inference failed: {prediction.get('error') or 'Unknown error'}"
+        )
+    elif status == "canceled":
+        raise ValueError("Inference was canceled")
+    return None
+
+
+async def call_replicate(
+    input: dict[str, str | int],
+    api_token: str,
+    base_url: str = REPLICATE_API_BASE_URL,
+    timeout: float = REPLICATE_PREDICTION_TIMEOUT_SECONDS,
+    prefer_wait: int = REPLICATE_PREFER_WAIT_SECONDS,
+) -> str:
     headers = {
         "Authorization": f"Bearer {api_token}",
         "Content-Type": "application/json",
@@ -10,56 +57,69 @@ async def call_replicate(input: dict[str, str | int], api_token: str) -> str:
 
     data = {"input": input}
 
-    async with httpx.AsyncClient() as client:
+    deadline = time.monotonic() + timeout
+
+    async with client_registry.lease_replicate() as client:
         try:
+            # Ask Replicate to hold the request open until the prediction is done
+            # (Flux Schnell usually finishes within a couple of seconds)
+            wait_seconds = min(prefer_wait, int(timeout))
             response = await client.post(
-                "https://api.replicate.com/v1/models/black-forest-labs/flux-schnell/predictions",
-                headers=headers,
+                f"{base_url}/models/{FLUX_SCHNELL_MODEL}/predictions",
+                headers=(
+                    {**headers, "Prefer": f"wait={wait_seconds}"}
+                    if wait_seconds > 0
+                    else headers
+                ),
                 json=data,
+                timeout=wait_seconds + 5,
             )
             response.raise_for_status()
-            response_json = response.json()
+            prediction = response.json()
+
+            output = get_prediction_output(prediction)
+            if output is not None:
+                return output
 
             # Extract the id from the response
-            prediction_id = response_json.get("id")
+            prediction_id = prediction.get("id")
             if not prediction_id:
                 raise ValueError("Prediction ID not found in initial response.")
+            status_check_url = prediction.get("urls", {}).get(
+                "get", f"{base_url}/predictions/{prediction_id}"
+            )
 
-            # Polling every 0.1 seconds until the status is succeeded or error (upto 10s)
-            num_polls = 0
-            max_polls = 100
-            while num_polls < max_polls:
-                num_polls += 1
-
-                await asyncio.sleep(0.1)
+            # Otherwise, poll with backoff until it's done or we run out of time
+            for interval in poll_intervals():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                await asyncio.sleep(min(interval, remaining))
 
-                # Check the status
-                status_check_url = (
-                    f"https://api.replicate.com/v1/predictions/{prediction_id}"
-                )
                 status_response = await client.get(status_check_url, headers=headers)
                 status_response.raise_for_status()
-                status_response_json = status_response.json()
-                status = status_response_json.get("status")
-
-                # If status is succeeded or if there's an error, break out of the loop
-                if status == "succeeded":
-                    return status_response_json["output"][0]
-                elif status == "error":
-                    raise ValueError(
-                        f"Inference errored out: {status_response_json.get('error', 'Unknown error')}"
-                    )
-                elif status == "failed":
-                    raise ValueError("Inference failed")
-
-            # If we've reached here, it means we've exceeded the max number of polls
-            raise TimeoutError("Inference timed out")
+                output = get_prediction_output(status_response.json())
+                if output is not None:
+                    return output
+
+            # If we've reached here, it means we've run out of time
+            raise TimeoutError(f"Inference timed out after {timeout} seconds")
 
         except httpx.HTTPStatusError as e:
-            raise ValueError(f"HTTP error occurred: {e}")
-        except httpx.RequestError as e:
-            raise ValueError(f"An error occurred while requesting: {e}")
-        except asyncio.TimeoutError:
-            raise TimeoutError("Request timed out")
+            # Keep the status code so that rate limited requests can be retried
+            raise ProviderHTTPError(
+                f"HTTP error occurred: {e}",
+                status_code=e.response.status_code,
+                retry_after=parse_retry_after(e.response.headers),
+            )
+        except httpx.RequestError:
+            # Kept as is so that the scheduler retries connection errors
+            raise
+        except TimeoutError:
+            # Our own deadline (on 3.10 it isn't an asyncio.TimeoutError, and it
+            # mustn't be wrapped below)
+            raise
+        except asyncio.TimeoutError as e:
+            raise TimeoutError(str(e) or "Request timed out")
         except Exception as e:
             raise ValueError(f"An unexpected error occurred: {e}")
@@ -0,0 +1,286 @@
+import asyncio
+import random
+import time
+from collections import OrderedDict, deque
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any, Callable, Coroutine, Deque, Dict, Literal, TypeVar
+import httpx
+import openai
+from config import (
+    DALLE3_REQUESTS_PER_MINUTE,
+    IMAGE_GENERATION_MAX_CONCURRENCY,
+    IMAGE_GENERATION_MAX_RETRIES,
+    REPLICATE_REQUESTS_PER_MINUTE,
+)
+from metrics.core import Counters, metrics_registry, ratio
+
+T = TypeVar("T")
+
+# Requests share a scheduler fairly: set this per request (e.g. per WebSocket
+# connection) and tasks created from it will inherit it
+scheduling_group: ContextVar[str] = ContextVar("scheduling_group", default="default")
+
+INITIAL_RETRY_DELAY_SECONDS = 1.0
+MAX_RETRY_DELAY_SECONDS = 20.0
+
+# Upper bound on distinct (model, api_key) schedulers kept around
+MAX_SCHEDULERS = 64
+
+image_generation_queue_wait = metrics_registry.histogram(
+    "image_generation_queue_wait_seconds",
+    "Time image generation requests wait for the provider's rate limits",
+)
+# Labelled by model rather than kept per scheduler: schedulers are per API key
+# and idle ones are dropped
+image_generation_retries = metrics_registry.counter(
+    "image_generation_retries",
+    "Image generation requests retried after a retryable error",
+    ["model"],
+)
+image_generation_failures = metrics_registry.counter(
+    "image_generation_failures",
+    "Image generation requests that failed for good",
+    ["model"],
+)
+
+
+class ProviderHTTPError(ValueError):
+    """An HTTP error from an image generation provider, with its status code."""
+
+    def __init__(
+        self, message: str, status_code: int, retry_after: float | None = None
+    ):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+def parse_retry_after(headers: httpx.Headers) -> float | None:
+    try:
+        return float(headers["retry-after"])
+    except (KeyError, ValueError):
+        return None
+
+
+# Returns whether the error is worth retrying (rate limited or a server error)
+# and how long the provider asked us to wait, if it did
+def get_retry_info(error: BaseException) -> tuple[bool, float | None]:
+    if isinstance(error, ProviderHTTPError):
+        return (
+            error.status_code == 429 or error.status_code >= 500,
+            error.retry_after,
+        )
+    if isinstance(error, openai.APIStatusError):
+        return (
+            error.status_code == 429 or error.status_code >= 500,
+            parse_retry_after(error.response.headers),
+        )
+    if isinstance(error, (openai.APIConnectionError, httpx.RequestError)):
+        return (True, None)
+    return (False, None)
+
+
+@dataclass
+class ProviderSchedulerCounters(Counters):
+    # Attempts that got through the queue (retries included)
+    started: int = 0
+    total_queue_wait_seconds: float = 0.0
+    max_queue_wait_seconds: float = 0.0
+    retries: int = 0
+    failures: int = 0
+
+    def derived_stats(self) -> dict[str, float]:
+        return {
+            "average_queue_wait_seconds": ratio(
+                self.total_queue_wait_seconds, self.started
+            ),
+            "retry_rate": ratio(self.retries, self.started),
+        }
+
+
+class ProviderScheduler:
+    """
+    Bounds the requests made to a provider with one API key: at most
+    max_concurrency in flight, started at no more than requests_per_second
+    (token bucket, allowing bursts of up to burst requests).
+
+    Waiting requests are queued per scheduling group and the groups are served
+    round-robin, so one page with lots of images can't starve everyone else.
+    Rate limited (429), server (5xx) and connection errors are retried with
+    backoff.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int,
+        requests_per_second: float | None,
+        burst: int | None = None,
+        max_retries: int = IMAGE_GENERATION_MAX_RETRIES,
+        clock: Callable[[], float] = time.monotonic,
+        # For metrics
+        model: str = "unknown",
+    ):
+        self.max_concurrency = max_concurrency
+        self.requests_per_second = requests_per_second
+        self.burst = burst or max_concurrency
+        self.max_retries = max_retries
+        self.clock = clock
+        self.model = model
+
+        self.tokens = float(self.burst)
+        self.last_refill = clock()
+        self.refill_timer: asyncio.TimerHandle | None = None
+        self.in_flight = 0
+        # Queued requests per scheduling group (in round-robin order)
+        self.waiters: OrderedDict[str, Deque[asyncio.Future[None]]] = OrderedDict()
+        self.counters = ProviderSchedulerCounters()
+
+    @property
+    def queued(self) -> int:
+        return sum(len(waiters) for waiters in self.waiters.values())
+
+    def refill(self):
+        if self.requests_per_second is None:
+            self.tokens = float(self.burst)
+            return
+        now = self.clock()
+        self.tokens = min(
+            float(self.burst),
+            self.tokens + (now - self.last_refill) * self.requests_per_second,
+        )
+        self.last_refill = now
+
+    # Start as many queued requests as the limits allow
+    def dispatch(self):
+        while self.waiters and self.in_flight < self.max_concurrency:
+            self.refill()
+            if self.tokens < 1:
+                if self.refill_timer is None:
+                    assert self.requests_per_second
+                    delay = (1 - self.tokens) / self.requests_per_second
+                    self.refill_timer = asyncio.get_running_loop().call_later(
+                        delay, self.on_refill_timer
+                    )
+                return
+
+            group, waiters = self.waiters.popitem(last=False)
+            future = waiters.popleft()
+            if waiters:
+                # Back of the line for this group
+                self.waiters[group] = waiters
+
+            self.tokens -= 1
+            self.in_flight += 1
+            future.set_result(None)
+
+    def on_refill_timer(self):
+        self.refill_timer = None
+        self.dispatch()
+
+    def release(self):
+        self.in_flight -= 1
+        self.dispatch()
+
+    async def acquire(self, group: str):
+        future: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+        self.waiters.setdefault(group, deque()).append(future)
+        queued_at = self.clock()
+        self.dispatch()
+
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Cancelled right after being let through
+                self.release()
+            else:
+                waiters = self.waiters.get(group)
+                if waiters is not None and future in waiters:
+                    waiters.remove(future)
+                    if not waiters:
+                        del self.waiters[group]
+            raise
+
+        queue_wait = self.clock() - queued_at
+        self.counters.started += 1
+        self.counters.total_queue_wait_seconds += queue_wait
+        self.counters.max_queue_wait_seconds = max(
+            self.counters.max_queue_wait_seconds, queue_wait
+        )
+        image_generation_queue_wait.observe(queue_wait)
+
+    async def run(self, func: Callable[[], Coroutine[Any, Any, T]]) -> T:
+        group = scheduling_group.get()
+        for attempt in range(self.max_retries + 1):
+            await self.acquire(group)
+            try:
+                return await func()
+            except Exception as e:
+                should_retry, retry_after = get_retry_info(e)
+                if not should_retry or attempt == self.max_retries:
+                    self.counters.failures += 1
+                    image_generation_failures.inc(model=self.model)
+                    raise
+            finally:
+                self.release()
+
+            # Exponential backoff with jitter, unless the provider told us how long to wait
+            delay = retry_after or min(
+                INITIAL_RETRY_DELAY_SECONDS * 2**attempt, MAX_RETRY_DELAY_SECONDS
+            ) * random.uniform(0.5, 1.0)
+            self.counters.retries += 1
+            image_generation_retries.inc(model=self.model)
+            print(f"Image generation request failed, retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+        raise AssertionError("unreachable")
+
+    def is_idle(self) -> bool:
+        return self.in_flight == 0 and not self.waiters
+
+    def stats(self) -> dict[str, float]:
+        return {
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            **self.counters.stats(),
+        }
+
+
+# Process-wide schedulers, keyed by (model, api_key)
+schedulers: Dict[tuple[str, str], ProviderScheduler] = {}
+
+
+def get_scheduler(model: Literal["dalle3", "flux"], api_key: str) -> ProviderScheduler:
+    key = (model, api_key)
+    scheduler = schedulers.get(key)
+    if scheduler is None:
+        # Users can bring their own keys, so drop idle schedulers when there are many
+        if len(schedulers) >= MAX_SCHEDULERS:
+            for idle_key in [k for k, s in schedulers.items() if s.is_idle()]:
+                del schedulers[idle_key]
+
+        requests_per_minute = (
+            DALLE3_REQUESTS_PER_MINUTE
+            if model == "dalle3"
+            else REPLICATE_REQUESTS_PER_MINUTE
+        )
+        scheduler = ProviderScheduler(
+            max_concurrency=IMAGE_GENERATION_MAX_CONCURRENCY,
+            requests_per_second=(
+                requests_per_minute / 60 if requests_per_minute > 0 else None
+            ),
+            model=model,
+        )
+        schedulers[key] = scheduler
+    return scheduler
+
+
+# Requests in flight and queued across every scheduler (retries and failures
+# are counted per model by the counters above)
+def scheduler_stats() -> dict[str, float]:
+    return {
+        "schedulers": len(schedulers),
+        "in_flight": sum(scheduler.in_flight for scheduler in schedulers.values()),
+        "queued": sum(scheduler.queued for scheduler in schedulers.values()),
+    }
@@ -0,0 +1,67 @@
+import asyncio
+from typing import Any, Callable, Coroutine, Dict, Generic, TypeVar
+from metrics.core import metrics_registry
+
+T = TypeVar("T")
+
+image_generation_saved_calls = metrics_registry.counter(
+    "image_generation_saved_calls",
+    "Image generation calls shared with another variant instead of made",
+)
+
+
+def retrieve_exception(task: asyncio.Task[Any]):
+    # So that asyncio doesn't warn about exceptions of tasks nobody awaited
+    if not task.cancelled():
+        task.exception()
+
+
+class SingleFlight(Generic[T]):
+    """
+    Request-scoped deduplication of concurrent identical calls: callers asking
+    for a key that's already in flight (or done) share the same task instead
+    of making another call.
+
+    Callers release the keys they asked for once they no longer need them: a
+    task is only cancelled when its last waiter releases it, so one caller
+    giving up doesn't cancel work that others are still waiting for.
+    """
+
+    def __init__(self):
+        self.tasks: Dict[str, asyncio.Task[T]] = {}
+        # Number of callers waiting for each key's task
+        self.waiters: Dict[str, int] = {}
+        # Number of calls that were shared instead of made
+        self.saved_calls = 0
+
+    def run(
+        self, key: str, func: Callable[[], Coroutine[Any, Any, T]]
+    ) -> asyncio.Task[T]:
+        self.waiters[key] = self.waiters.get(key, 0) + 1
+        task = self.tasks.get(key)
+        if task is not None:
+            self.saved_calls += 1
+            image_generation_saved_calls.inc()
+            return task
+
+        task = asyncio.create_task(func())
+        task.add_done_callback(retrieve_exception)
+        self.tasks[key] = task
+        return task
+
+    def release(self, key: str):
+        waiters = self.waiters.get(key, 0) - 1
+        if waiters > 0:
+            self.waiters[key] = waiters
+            return
+        self.waiters.pop(key, None)
+        task = self.tasks.get(key)
+        if task is not None and not task.done():
+            task.cancel()
+            del self.tasks[key]
+
+    # Cancel everything still in flight, for every caller (e.g. when the whole
+    # request is cancelled)
+    def cancel(self):
+        for task in self.tasks.values():
+            task.cancel()
@@ -0,0 +1,149 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Coroutine, Dict, List, Literal, Union
+from executors.core import cpu_executor
+from image_generation.core import (
+    extract_image_prompts,
+    generate_images,
+    generate_images_for_prompts,
+)
+from image_generation.img_tags import ImgTagDetector
+from image_generation.single_flight import SingleFlight, retrieve_exception
+
+# Prompts found within this long of each other are generated together (one
+# cache lookup and one call to the provider's scheduler)
+IMAGE_BATCH_WINDOW_SECONDS = 0.1
+
+
+class ImageBatch:
+    """
+    Prompts whose images are generated with one generate_images_for_prompts
+    call, which starts once the batch window has passed (or when started
+    explicitly). The call is cancelled if every prompt's waiter gives up.
+    """
+
+    def __init__(
+        self,
+        generate: Callable[[List[str]], Coroutine[Any, Any, Dict[str, str | None]]],
+    ):
+        self.generate = generate
+        self.prompts: List[str] = []
+        self.waiters = 0
+        self.ready = asyncio.Event()
+        self.task = asyncio.create_task(self.run())
+        self.task.add_done_callback(retrieve_exception)
+
+    # Whether prompts can still be added
+    @property
+    def is_open(self) -> bool:
+        return not self.ready.is_set()
+
+    def add(self, prompt: str):
+        self.prompts.append(prompt)
+        self.waiters += 1
+
+    def start(self):
+        self.ready.set()
+
+    async def run(self) -> Dict[str, str | None]:
+        try:
+            await asyncio.wait_for(self.ready.wait(), IMAGE_BATCH_WINDOW_SECONDS)
+        except asyncio.TimeoutError:
+            self.ready.set()
+        return await self.generate(self.prompts)
+
+    async def result(self, prompt: str) -> str | None:
+        try:
+            # Shielded so that one prompt's waiter giving up doesn't cancel the
+            # images of the others
+            return (await asyncio.shield(self.task)).get(prompt)
+        finally:
+            self.waiters -= 1
+            if self.waiters == 0:
+                self.task.cancel()
+
+
+class StreamingImageGenerator:
+    """
+    Starts generating images for a variant as soon as complete placeholder
+    <img> tags show up in its stream, so that image generation overlaps with
+    code generation. The results are merged into the final code by
+    generate_images.
+
+    Generators for the variants of a request share a SingleFlight so that
+    prompts the variants have in common are only generated once.
+    """
+
+    def __init__(
+        self,
+        api_key: str,
+        base_url: Union[str, None],
+        image_cache: Dict[str, str],
+        model: Literal["dalle3", "flux"],
+        single_flight: SingleFlight[str | None] | None = None,
+    ):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.image_cache = image_cache
+        self.model = model
+        self.single_flight: SingleFlight[str | None] = single_flight or SingleFlight()
+        self.detector = ImgTagDetector()
+        # Keyed by alt text (the image prompt)
+        self.started_images: Dict[str, asyncio.Task[str | None]] = {}
+        self.batch: ImageBatch | None = None
+
+    def feed(self, content: str):
+        for tag in self.detector.feed(content):
+            alt = tag.get("alt")
+            if tag.is_placeholder and alt:
+                self.start(alt)
+
+    def start(self, prompt: str):
+        if prompt in self.image_cache or prompt in self.started_images:
+            return
+        self.started_images[prompt] = self.single_flight.run(
+            prompt, lambda: self.generate_image(prompt)
+        )
+
+    # Called (through the single flight) only for prompts that no other variant
+    # has started
+    def generate_image(self, prompt: str) -> Coroutine[Any, Any, str | None]:
+        if self.batch is None or not self.batch.is_open:
+            self.batch = ImageBatch(
+                lambda prompts: generate_images_for_prompts(
+                    prompts, self.api_key, self.base_url, self.model
+                )
+            )
+        self.batch.add(prompt)
+        return self.batch.result(prompt)
+
+    async def generate_images(self, code: str) -> str:
+        print(f"{len(self.started_images)} images were started while streaming")
+
+        # Start the rest through the single flight as well (another variant
+        # may have already started them), without waiting for the batch window
+        prompts = await cpu_executor.run(extract_image_prompts, code, self.image_cache)
+        for prompt in prompts:
+            self.start(prompt)
+        if self.batch is not None:
+            self.batch.start()
+
+        started_images: Dict[str, Awaitable[str | None]] = dict(self.started_images)
+        try:
+            return await generate_images(
+                code,
+                api_key=self.api_key,
+                base_url=self.base_url,
+                image_cache=self.image_cache,
+                model=self.model,
+                started_images=started_images,
+                prompts=prompts,
+            )
+        finally:
+            self.release()
+
+    # Give up on this variant's images (e.g. if its code generation failed):
+    # images that no other variant is waiting for are cancelled
+    def release(self):
+        for prompt in self.started_images:
+            self.single_flight.release(prompt)
+        self.started_images = {}
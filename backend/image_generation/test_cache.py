@@ -0,0 +1,100 @@
+import asyncio
+import os
+from typing import Any
+import pytest
+import image_generation.core
+from image_generation.cache import GeneratedImageCache, SqliteImageCacheBackend
+from image_generation.core import generate_images
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def create_cache(path: str, clock: FakeClock, **kwargs: Any) -> GeneratedImageCache:
+    return GeneratedImageCache(
+        backend=SqliteImageCacheBackend(path, clock=clock), clock=clock, **kwargs
+    )
+
+
+def test_cache_persists_across_instances_with_normalized_alt(tmp_path: Any):
+    path = os.path.join(tmp_path, "cache.db")
+    clock = FakeClock()
+    cache = create_cache(path, clock, ttl_seconds=60)
+    cache.put_many("dalle3", "1024x1024", {"A  red Car": "https://img/1"})
+    cache.close()
+
+    cache = create_cache(path, clock, ttl_seconds=60)
+    found = cache.get_many(
+        "dalle3", "1024x1024", ["a red car ", "a blue car", "A red car"]
+    )
+
+    assert found == {"a red car ": "https://img/1", "A red car": "https://img/1"}
+    # Different model or size is a different image
+    assert cache.get_many("flux", "1:1", ["a red car"]) == {}
+    assert cache.stats()["backend_hits"] == 2
+    assert cache.stats()["memory_hits"] == 0
+    assert cache.stats()["misses"] == 2
+    assert cache.stats()["hit_rate"] == 0.5
+
+
+def test_cache_expires_and_evicts_least_recently_used(tmp_path: Any):
+    clock = FakeClock()
+    backend = SqliteImageCacheBackend(os.path.join(tmp_path, "cache.db"), clock=clock)
+    cache = GeneratedImageCache(
+        backend=backend, clock=clock, ttl_seconds=60, max_entries=2
+    )
+
+    cache.put_many("dalle3", "1024x1024", {"a": "https://img/a"})
+    clock.now += 61
+    assert cache.get_many("dalle3", "1024x1024", ["a"]) == {}
+    assert backend.count() == 0
+
+    cache.put_many("dalle3", "1024x1024", {"b": "https://img/b"})
+    clock.now += 1
+    cache.put_many("dalle3", "1024x1024", {"c": "https://img/c"})
+    clock.now += 1
+    cache.clear()
+    cache.get_many("dalle3", "1024x1024", ["b"])
+    clock.now += 1
+    cache.put_many("dalle3", "1024x1024", {"d": "https://img/d"})
+
+    assert backend.count() == 2
+    cache.clear()
+    assert cache.get_many("dalle3", "1024x1024", ["b", "c", "d"]) == {
+        "b": "https://img/b",
+        "d": "https://img/d",
+    }
+
+
+def test_generate_images_only_generates_uncached_prompts(
+    tmp_path: Any, monkeypatch: pytest.MonkeyPatch
+):
+    cache = create_cache(os.path.join(tmp_path, "cache.db"), FakeClock())
+    cache.put_many("dalle3", "1024x1024", {"a cat": "https://img/cat"})
+    monkeypatch.setattr(image_generation.core, "generated_image_cache", cache)
+
+    generated: list[str] = []
+
+    async def fake_process_tasks(prompts: list[str], *args: Any):
+        generated.extend(prompts)
+        return [f"https://img/{prompt.replace(' ', '-')}" for prompt in prompts]
+
+    monkeypatch.setattr(image_generation.core, "process_tasks", fake_process_tasks)
+
+    code = (
+        '<img src="https://placehold.co/300x200" alt="a cat">'
+        '<img src="https://placehold.co/300x200" alt="a dog">'
+    )
+    result = asyncio.run(generate_images(code, "key", None, {}))
+
+    assert generated == ["a dog"]
+    assert "https://img/cat" in result
+    assert "https://img/a-dog" in result
+    assert cache.get_many("dalle3", "1024x1024", ["a dog"]) == {
+        "a dog": "https://img/a-dog"
+    }
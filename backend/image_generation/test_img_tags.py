@@ -0,0 +1,112 @@
+from mock_llm import APPLE_MOCK_CODE
+from image_generation.core import (
+    create_alt_url_mapping,
+    extract_image_prompts,
+    replace_image_urls,
+)
+from image_generation.img_tags import ImgTagDetector, find_img_tags
+
+
+def test_img_tags_in_comments_and_scripts_are_ignored():
+    code = """<!-- <img src="https://placehold.co/1x1" alt="commented"> -->
+<script>const html = '<img src="https://placehold.co/1x1" alt="script">';</script>
+<IMG SRC='https://placehold.co/300x200' alt="A &amp; B" /><img
+  alt=unquoted
+  src="https://placehold.co/50x50">
+<img src="https://placehold.co/10x10" alt="incomplete"""
+
+    tags = find_img_tags(code)
+
+    assert [tag.get("alt") for tag in tags] == ["A & B", "unquoted"]
+    assert [tag.is_placeholder for tag in tags] == [True, True]
+
+
+def test_replace_image_urls_only_touches_placeholder_img_attributes():
+    code = (
+        '<div>\n  <img class="a"  src="https://placehold.co/300x200" alt="cat" '
+        'width="1"/>\n<img src="https://placehold.co/20x10" alt="dog">'
+        '<img src="https://example.com/x.png" alt="keep"></div>'
+    )
+
+    result = replace_image_urls(
+        code, {"cat": "https://img/cat?a=1&b=2", "dog": "https://img/dog"}
+    )
+
+    assert result == (
+        '<div>\n  <img class="a"  src="https://img/cat?a=1&amp;b=2" alt="cat" '
+        'width="300" height="200"/>\n'
+        '<img src="https://img/dog" alt="dog" width="20" height="10">'
+        '<img src="https://example.com/x.png" alt="keep"></div>'
+    )
+
+
+def test_mock_page_is_kept_intact_outside_rewritten_tags():
+    prompts = extract_image_prompts(APPLE_MOCK_CODE, {})
+    assert len(prompts) == 4
+
+    mapping = {prompt: f"https://img/{index}" for index, prompt in enumerate(prompts)}
+    result = replace_image_urls(APPLE_MOCK_CODE, mapping)
+
+    # Only the img tags change
+    tags = find_img_tags(APPLE_MOCK_CODE)
+    new_tags = find_img_tags(result)
+    assert APPLE_MOCK_CODE[: tags[0].start] == result[: new_tags[0].start]
+    assert APPLE_MOCK_CODE[tags[-1].end :] == result[new_tags[-1].end :]
+    for tag, next_tag, new_tag, next_new_tag in zip(
+        tags, tags[1:], new_tags, new_tags[1:]
+    ):
+        assert (
+            APPLE_MOCK_CODE[tag.end : next_tag.start]
+            == result[new_tag.end : next_new_tag.start]
+        )
+
+    assert create_alt_url_mapping(result) == mapping
+
+
+def test_detector_finds_the_same_tags_for_any_chunking():
+    code = APPLE_MOCK_CODE + "<!-- <img src='x' alt='no'> --><script>'<img>'</script>"
+    expected = [tag.get("alt") for tag in find_img_tags(code)]
+
+    for chunk_size in [1, 2, 3, 7, 20, 64, len(code)]:
+        detector = ImgTagDetector()
+        found: list[str | None] = []
+        for i in range(0, len(code), chunk_size):
+            found.extend(
+                tag.get("alt") for tag in detector.feed(code[i : i + chunk_size])
+            )
+        assert found == expected
+        # Only the unfinished tail is kept around
+        assert len(detector.buffer) < 100
+
+
+def test_detector_doesnt_keep_long_scripts_around():
+    code = (
+        '<script type="text/babel">\n'
+        + "const App = () => <div className='p-4'>Hello</div>;\n" * 2000
+        + "</SCRIPT ><!-- "
+        + "x" * 5000
+        + ' --><img src="https://placehold.co/1x1" alt="after">'
+    )
+
+    detector = ImgTagDetector()
+    found: list[str | None] = []
+    max_buffer_length = 0
+    for i in range(0, len(code), 16):
+        found.extend(tag.get("alt") for tag in detector.feed(code[i : i + 16]))
+        max_buffer_length = max(max_buffer_length, len(detector.buffer))
+
+    assert found == ["after"]
+    assert max_buffer_length < 100
+
+
+def test_detector_stays_in_scripts_when_chunks_end_with_other_closing_tags():
+    chunks = [
+        "<script>const App = () => <div>x</div>",
+        ";\nconst html = '<img src=\"https://placehold.co/1x1\" alt=\"in\">';",
+        '</script><img src="https://placehold.co/1x1" alt="out">',
+    ]
+
+    detector = ImgTagDetector()
+    found = [tag.get("alt") for chunk in chunks for tag in detector.feed(chunk)]
+
+    assert found == ["out"]
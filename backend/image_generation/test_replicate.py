@@ -0,0 +1,179 @@
+import asyncio
+import json
+import time
+import httpx
+import pytest
+from clients.core import client_registry
+from image_generation.replicate import call_replicate
+from image_generation.scheduler import get_retry_info
+
+
+class FakeReplicateServer:
+    """
+    Minimal HTTP/1.1 server that mimics Replicate's predictions API: predictions
+    succeed prediction_seconds after they're created, and the create request is
+    held open for up to Prefer: wait seconds if supports_prefer_wait is set.
+    """
+
+    def __init__(self, prediction_seconds: float, supports_prefer_wait: bool):
+        self.prediction_seconds = prediction_seconds
+        self.supports_prefer_wait = supports_prefer_wait
+        self.predictions: dict[str, float] = {}
+        self.requests: list[str] = []
+        self.connections_opened = 0
+        self.server: asyncio.Server | None = None
+
+    @property
+    def base_url(self) -> str:
+        assert self.server
+        port = self.server.sockets[0].getsockname()[1]
+        return f"http://127.0.0.1:{port}/v1"
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle_connection, "127.0.0.1", 0)
+
+    async def stop(self):
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+
+    def prediction(self, prediction_id: str) -> dict[str, object]:
+        done = time.monotonic() >= self.predictions[prediction_id]
+        return {
+            "id": prediction_id,
+            "status": "succeeded" if done else "processing",
+            "output": (
+                [f"https://replicate.delivery/{prediction_id}.png"] if done else None
+            ),
+            "urls": {"get": f"{self.base_url}/predictions/{prediction_id}"},
+        }
+
+    async def handle_request(self, method: str, path: str, headers: dict[str, str]):
+        self.requests.append(f"{method} {path}")
+        if method == "POST":
+            prediction_id = f"p{len(self.predictions)}"
+            self.predictions[prediction_id] = time.monotonic() + self.prediction_seconds
+            prefer = headers.get("prefer", "")
+            if self.supports_prefer_wait and prefer.startswith("wait="):
+                wait_until = time.monotonic() + int(prefer.removeprefix("wait="))
+                await asyncio.sleep(
+                    max(
+                        0.0,
+                        min(wait_until, self.predictions[prediction_id])
+                        - time.monotonic(),
+                    )
+                )
+            return self.prediction(prediction_id)
+        return self.prediction(path.rsplit("/", 1)[1])
+
+    async def handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        self.connections_opened += 1
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                lines = head.decode().split("\r\n")
+                method, path, _ = lines[0].split(" ")
+                headers: dict[str, str] = {}
+                for line in lines[1:]:
+                    if ":" in line:
+                        name, value = line.split(":", 1)
+                        headers[name.strip().lower()] = value.strip()
+                content_length = int(headers.get("content-length", 0))
+                if content_length:
+                    await reader.readexactly(content_length)
+
+                body = json.dumps(await self.handle_request(method, path, headers))
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\n"
+                    b"Content-Type: application/json\r\n"
+                    + f"Content-Length: {len(body)}\r\n\r\n".encode()
+                    + body.encode()
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+        finally:
+            writer.close()
+
+
+def run_predictions(
+    server: FakeReplicateServer, num_predictions: int, timeout: float = 10
+) -> tuple[list[str], float]:
+    async def run():
+        await server.start()
+        start_time = time.perf_counter()
+        try:
+            outputs = await asyncio.gather(
+                *[
+                    call_replicate(
+                        {"prompt": f"image {i}"},
+                        "token",
+                        base_url=server.base_url,
+                        timeout=timeout,
+                    )
+                    for i in range(num_predictions)
+                ]
+            )
+            return (outputs, time.perf_counter() - start_time)
+        finally:
+            await client_registry.close()
+            await server.stop()
+
+    return asyncio.run(run())
+
+
+def test_prefer_wait_returns_output_from_create_request():
+    server = FakeReplicateServer(prediction_seconds=0.3, supports_prefer_wait=True)
+
+    outputs, latency = run_predictions(server, num_predictions=4)
+
+    assert sorted(outputs) == [f"https://replicate.delivery/p{i}.png" for i in range(4)]
+    # No polling at all
+    assert len(server.requests) == 4
+    assert latency < 0.3 + 0.2
+
+
+def test_polling_backs_off_without_prefer_wait():
+    server = FakeReplicateServer(prediction_seconds=1.0, supports_prefer_wait=False)
+
+    outputs, latency = run_predictions(server, num_predictions=1)
+
+    assert outputs == ["https://replicate.delivery/p0.png"]
+    # Polling every 100ms would take 10 polls
+    assert len(server.requests) <= 7
+    assert latency < 1.0 + 1.0
+    assert server.connections_opened == 1
+
+
+def test_predictions_time_out_after_the_budget(monkeypatch: pytest.MonkeyPatch):
+    # As on Python 3.10, where asyncio.TimeoutError isn't the builtin one
+    monkeypatch.setattr(asyncio, "TimeoutError", type("TimeoutError", (Exception,), {}))
+    server = FakeReplicateServer(prediction_seconds=5.0, supports_prefer_wait=False)
+
+    start_time = time.perf_counter()
+    # Raised as a timeout, not wrapped as an unexpected error
+    with pytest.raises(TimeoutError, match="Inference timed out"):
+        run_predictions(server, num_predictions=1, timeout=0.5)
+
+    assert time.perf_counter() - start_time < 1.0
+
+
+def test_connection_errors_are_retryable():
+    server = FakeReplicateServer(prediction_seconds=0, supports_prefer_wait=True)
+
+    async def run():
+        # Nothing listens on the port once the server has stopped
+        await server.start()
+        base_url = server.base_url
+        await server.stop()
+        try:
+            await call_replicate({"prompt": "image"}, "token", base_url=base_url)
+        finally:
+            await client_registry.close()
+
+    with pytest.raises(httpx.ConnectError) as error:
+        asyncio.run(run())
+
+    assert get_retry_info(error.value) == (True, None)
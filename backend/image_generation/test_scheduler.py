@@ -0,0 +1,118 @@
+import asyncio
+import time
+from typing import List
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+import image_generation.scheduler
+import routes.metrics
+from image_generation.scheduler import (
+    ProviderHTTPError,
+    ProviderScheduler,
+    get_scheduler,
+    image_generation_retries,
+    scheduling_group,
+)
+
+
+def test_concurrency_is_bounded_and_groups_are_served_round_robin():
+    async def run():
+        scheduler = ProviderScheduler(max_concurrency=1, requests_per_second=None)
+        order: List[str] = []
+
+        async def request(name: str):
+            order.append(name)
+            await asyncio.sleep(0.01)
+
+        async def submit(group: str, names: List[str]):
+            scheduling_group.set(group)
+            await asyncio.gather(
+                *[scheduler.run(lambda name=name: request(name)) for name in names]
+            )
+
+        # The big page queues everything first, the small one still gets a fair share
+        await asyncio.gather(
+            submit("big", ["big-1", "big-2", "big-3", "big-4"]),
+            submit("small", ["small-1", "small-2"]),
+        )
+        return (order, scheduler)
+
+    order, scheduler = asyncio.run(run())
+
+    # (big-2 was queued before small-1, after that they take turns)
+    assert order == ["big-1", "big-2", "small-1", "big-3", "small-2", "big-4"]
+    assert scheduler.stats()["started"] == 6
+    assert scheduler.stats()["max_queue_wait_seconds"] > 0.04
+    assert scheduler.is_idle()
+
+
+def test_requests_are_rate_limited():
+    async def run():
+        scheduler = ProviderScheduler(
+            max_concurrency=10, requests_per_second=20, burst=1
+        )
+
+        async def request():
+            return time.perf_counter()
+
+        return await asyncio.gather(*[scheduler.run(request) for _ in range(5)])
+
+    start_times = asyncio.run(run())
+
+    # One request every 50ms after the first
+    assert start_times[-1] - start_times[0] >= 0.18
+
+
+def test_rate_limited_requests_are_retried(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(image_generation.scheduler, "INITIAL_RETRY_DELAY_SECONDS", 0.01)
+    attempts: List[int] = []
+
+    async def flaky_request():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise ProviderHTTPError("Too many requests", status_code=429)
+        if len(attempts) == 2:
+            raise ProviderHTTPError("Bad gateway", status_code=502, retry_after=0.01)
+        return "https://img/1"
+
+    async def bad_request():
+        raise ProviderHTTPError("Bad request", status_code=400)
+
+    async def run():
+        scheduler = ProviderScheduler(max_concurrency=2, requests_per_second=None)
+        result = await scheduler.run(flaky_request)
+        with pytest.raises(ProviderHTTPError):
+            await scheduler.run(bad_request)
+        return (result, scheduler.stats())
+
+    result, stats = asyncio.run(run())
+
+    assert result == "https://img/1"
+    assert stats["retries"] == 2
+    assert stats["failures"] == 1
+    assert stats["retry_rate"] == 0.5
+
+
+def test_retries_are_exported_on_metrics(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(image_generation.scheduler, "INITIAL_RETRY_DELAY_SECONDS", 0.01)
+    monkeypatch.setattr(image_generation.scheduler, "schedulers", {})
+    retries_before = image_generation_retries.get(model="flux")
+    attempts: List[int] = []
+
+    async def rate_limited_once():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise ProviderHTTPError("Too many requests", status_code=429)
+        return "https://img/1"
+
+    async def run():
+        return await get_scheduler("flux", "key").run(rate_limited_once)
+
+    assert asyncio.run(run()) == "https://img/1"
+
+    app = FastAPI()
+    app.include_router(routes.metrics.router)
+    lines = TestClient(app).get("/metrics").text.splitlines()
+    retries = retries_before + 1
+    assert f'image_generation_retries_total{{model="flux"}} {retries:g}' in lines
+    assert "image_generation_scheduler_schedulers 1" in lines
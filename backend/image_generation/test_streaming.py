@@ -0,0 +1,195 @@
+import asyncio
+import time
+from typing import Any, List
+import pytest
+import image_generation.core
+import mock_llm
+from image_generation.cache import GeneratedImageCache
+from image_generation.img_tags import find_img_tags
+from image_generation.single_flight import SingleFlight, image_generation_saved_calls
+from image_generation.streaming import StreamingImageGenerator
+from mock_llm import mock_completion
+
+IMAGE_GENERATION_SECONDS = 0.2
+
+
+def test_images_are_generated_while_code_streams(monkeypatch: pytest.MonkeyPatch):
+    # Stream the mock video completion (which has placeholder images) in fewer chunks
+    monkeypatch.setattr(mock_llm, "STREAM_CHUNK_SIZE", 500)
+    monkeypatch.setattr(
+        image_generation.core, "generated_image_cache", GeneratedImageCache(None)
+    )
+
+    requested_prompts: List[str] = []
+    request_times: List[float] = []
+
+    async def fake_process_tasks(prompts: List[str], *args: Any):
+        requested_prompts.extend(prompts)
+        request_times.extend(time.perf_counter() for _ in prompts)
+        await asyncio.sleep(IMAGE_GENERATION_SECONDS)
+        return [f"https://img/{len(prompt)}" for prompt in prompts]
+
+    monkeypatch.setattr(image_generation.core, "process_tasks", fake_process_tasks)
+
+    async def run():
+        image_generator = StreamingImageGenerator(
+            api_key="key", base_url=None, image_cache={}, model="dalle3"
+        )
+
+        async def process_chunk(content: str, variant_index: int):
+            assert variant_index == 0
+            image_generator.feed(content)
+
+        completion = await mock_completion(process_chunk, input_mode="video")
+        stream_end_time = time.perf_counter()
+        code = await image_generator.generate_images(completion["code"])
+        return (code, stream_end_time, time.perf_counter() - stream_end_time)
+
+    code, stream_end_time, image_wait = asyncio.run(run())
+
+    placeholders = {
+        tag.get("alt")
+        for tag in find_img_tags(mock_llm.TALLY_FORM_VIDEO_PROMPT_MOCK)
+        if tag.is_placeholder
+    }
+    assert set(requested_prompts) == placeholders
+    # Every image was requested once, before the code finished streaming
+    assert len(requested_prompts) == len(placeholders)
+    assert all(request_time < stream_end_time for request_time in request_times)
+    assert image_wait < IMAGE_GENERATION_SECONDS
+    assert "https://placehold.co" not in code
+
+
+def test_variants_share_identical_image_prompts(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(
+        image_generation.core, "generated_image_cache", GeneratedImageCache(None)
+    )
+    requested_prompts: List[str] = []
+
+    async def fake_process_tasks(prompts: List[str], *args: Any):
+        requested_prompts.extend(prompts)
+        await asyncio.sleep(0.01)
+        return [f"https://img/{prompt}" for prompt in prompts]
+
+    monkeypatch.setattr(image_generation.core, "process_tasks", fake_process_tasks)
+
+    variant_codes = [
+        '<img src="https://placehold.co/1x1" alt="cat">'
+        '<img src="https://placehold.co/1x1" alt="dog">',
+        '<img src="https://placehold.co/1x1" alt="dog">'
+        '<img src="https://placehold.co/1x1" alt="cat">'
+        '<img src="https://placehold.co/1x1" alt="bird">',
+    ]
+
+    async def run():
+        single_flight: SingleFlight[str | None] = SingleFlight()
+        image_generators = [
+            StreamingImageGenerator(
+                api_key="key",
+                base_url=None,
+                image_cache={},
+                model="dalle3",
+                single_flight=single_flight,
+            )
+            for _ in variant_codes
+        ]
+        # The first variant streams its images, the second one only has final code
+        image_generators[0].feed(variant_codes[0])
+        results = await asyncio.gather(
+            *[
+                image_generator.generate_images(code)
+                for image_generator, code in zip(image_generators, variant_codes)
+            ]
+        )
+        return (results, single_flight.saved_calls)
+
+    saved_calls_before = image_generation_saved_calls.get()
+    results, saved_calls = asyncio.run(run())
+
+    assert sorted(requested_prompts) == ["bird", "cat", "dog"]
+    assert saved_calls == 2
+    assert image_generation_saved_calls.get() == saved_calls_before + 2
+    assert all("https://img/cat" in result for result in results)
+    assert "https://img/bird" in results[1]
+
+
+def test_failed_variant_only_cancels_its_own_images(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(
+        image_generation.core, "generated_image_cache", GeneratedImageCache(None)
+    )
+
+    async def fake_process_tasks(prompts: List[str], *args: Any):
+        await asyncio.sleep(0.05)
+        return [f"https://img/{prompt}" for prompt in prompts]
+
+    monkeypatch.setattr(image_generation.core, "process_tasks", fake_process_tasks)
+
+    async def run():
+        single_flight: SingleFlight[str | None] = SingleFlight()
+        image_generators = [
+            StreamingImageGenerator(
+                api_key="key",
+                base_url=None,
+                image_cache={},
+                model="dalle3",
+                single_flight=single_flight,
+            )
+            for _ in range(2)
+        ]
+        image_generators[0].feed(
+            '<img src="https://placehold.co/1x1" alt="cat">'
+            '<img src="https://placehold.co/1x1" alt="dog">'
+        )
+        code = '<img src="https://placehold.co/1x1" alt="cat">'
+        image_generators[1].feed(code)
+        tasks = dict(single_flight.tasks)
+
+        # The first variant's code generation failed
+        image_generators[0].release()
+        result = await image_generators[1].generate_images(code)
+        return (tasks, result)
+
+    tasks, result = asyncio.run(run())
+
+    assert tasks["dog"].cancelled()
+    assert not tasks["cat"].cancelled()
+    assert "https://img/cat" in result
+
+
+def test_prompts_found_together_are_generated_together(
+    monkeypatch: pytest.MonkeyPatch,
+):
+    monkeypatch.setattr(
+        image_generation.core, "generated_image_cache", GeneratedImageCache(None)
+    )
+    batches: List[List[str]] = []
+
+    async def fake_process_tasks(prompts: List[str], *args: Any):
+        batches.append(list(prompts))
+        return [f"https://img/{prompt}" for prompt in prompts]
+
+    monkeypatch.setattr(image_generation.core, "process_tasks", fake_process_tasks)
+
+    async def run():
+        image_generator = StreamingImageGenerator(
+            api_key="key", base_url=None, image_cache={}, model="dalle3"
+        )
+        image_generator.feed('<img src="https://placehold.co/1x1" alt="cat">')
+        image_generator.feed('<img src="https://placehold.co/1x1" alt="dog">')
+        await asyncio.sleep(0.2)
+        code = (
+            '<img src="https://placehold.co/1x1" alt="cat">'
+            '<img src="https://placehold.co/1x1" alt="dog">'
+            '<img src="https://placehold.co/1x1" alt="bird">'
+            '<img src="https://placehold.co/1x1" alt="fish">'
+        )
+        return await image_generator.generate_images(code)
+
+    result = asyncio.run(run())
+
+    # The streamed prompts share one call, and so do the ones only found at the end
+    assert sorted(sorted(batch) for batch in batches) == [
+        ["bird", "fish"],
+        ["cat", "dog"],
+    ]
+    assert all(f"https://img/{alt}" in result for alt in ["cat", "dog", "bird", "fish"])
@@ -0,0 +1,26 @@
+import hashlib
+from caching.lru import LruCache
+
+# Upper bound on the total size of cached base64 image data
+PROCESSED_IMAGE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+
+def processed_image_size(key: str, value: tuple[str, str]) -> int:
+    return len(key) + len(value[1])
+
+
+class ProcessedImageCache(LruCache[str, tuple[str, str]]):
+    """
+    LRU cache of processed images (media type, base64 data), keyed by a hash of
+    the original data URL and bounded by the total size of the cached data.
+    """
+
+    def __init__(self, max_bytes: int = PROCESSED_IMAGE_CACHE_MAX_BYTES):
+        super().__init__(max_bytes, processed_image_size)
+
+    @staticmethod
+    def key(image_data_url: str) -> str:
+        return hashlib.sha256(image_data_url.encode("utf-8")).hexdigest()
+
+
+processed_image_cache = ProcessedImageCache()
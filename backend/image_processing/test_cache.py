@@ -0,0 +1,41 @@
+import base64
+import io
+from PIL import Image
+from image_processing.cache import ProcessedImageCache, processed_image_cache
+from image_processing.utils import process_image
+
+
+def png_data_url(width: int, height: int) -> str:
+    output = io.BytesIO()
+    Image.new("RGB", (width, height), "red").save(output, format="PNG")
+    return "data:image/png;base64," + base64.b64encode(output.getvalue()).decode()
+
+
+def test_process_image_is_cached_by_data_url():
+    processed_image_cache.clear()
+    data_url = png_data_url(10, 10)
+
+    first = process_image(data_url)
+    second = process_image(data_url)
+    process_image(png_data_url(20, 20))
+
+    assert first == second
+    assert processed_image_cache.stats()["hits"] == 1
+    assert processed_image_cache.stats()["misses"] == 2
+    assert processed_image_cache.stats()["entries"] == 2
+
+
+def test_cache_evicts_least_recently_used_by_size():
+    # Sizes count the key (a hash) as well as the data
+    cache = ProcessedImageCache(max_bytes=12)
+    cache.put("a", ("image/png", "aaaaa"))
+    cache.put("b", ("image/png", "bbbbb"))
+    cache.get("a")
+    cache.put("c", ("image/png", "ccccc"))
+
+    assert list(cache.entries) == ["a", "c"]
+    assert cache.total_size == 12
+
+    # Entries larger than the whole cache are never stored
+    cache.put("d", ("image/png", "d" * 12))
+    assert "d" not in cache.entries
@@ -0,0 +1,34 @@
+import numpy as np
+from PIL import Image
+from image_processing.utils import (
+    MIN_JPEG_QUALITY,
+    base64_size,
+    compress_jpeg,
+    encode_jpeg,
+)
+
+
+def noise_image(width: int, height: int) -> Image.Image:
+    rng = np.random.default_rng(0)
+    return Image.fromarray(rng.integers(0, 255, (height, width, 3), dtype=np.uint8))
+
+
+def test_compress_jpeg_fits_with_bounded_encodes():
+    img = noise_image(400, 300)
+    max_size = base64_size(len(encode_jpeg(img, 95))) // 3
+
+    output, num_encodes = compress_jpeg(img, max_size)
+
+    assert base64_size(len(output)) <= max_size
+    assert num_encodes <= 9
+
+
+def test_compress_jpeg_resizes_when_lowest_quality_is_too_big():
+    img = noise_image(400, 300)
+    max_size = base64_size(len(encode_jpeg(img, MIN_JPEG_QUALITY))) // 2
+
+    output, _ = compress_jpeg(img, max_size, resize_if_needed=False)
+    assert base64_size(len(output)) > max_size
+
+    output, _ = compress_jpeg(img, max_size)
+    assert base64_size(len(output)) <= max_size
@@ -1,14 +1,57 @@
 import base64
 import io
+import math
 import time
 from PIL import Image
+from image_processing.cache import processed_image_cache
+from metrics.core import metrics_registry
 
 CLAUDE_IMAGE_MAX_SIZE = 5 * 1024 * 1024
 CLAUDE_MAX_IMAGE_DIMENSION = 7990
 
+MAX_JPEG_QUALITY = 95
+MIN_JPEG_QUALITY = 10
+# Stop the quality search once we're within this many quality points of the best fit
+JPEG_QUALITY_SEARCH_TOLERANCE = 2
+# Typical JPEG size (i.e. bytes per pixel) at a given quality relative to the size
+# at MAX_JPEG_QUALITY. Used to pick the first quality to try.
+JPEG_QUALITY_SIZE_RATIOS = [
+    (90, 0.78),
+    (85, 0.68),
+    (80, 0.6),
+    (70, 0.5),
+    (60, 0.45),
+    (50, 0.4),
+    (40, 0.35),
+    (30, 0.29),
+    (20, 0.23),
+]
+
+image_processing_duration = metrics_registry.histogram(
+    "image_processing_seconds",
+    "Time to prepare a screenshot for Claude (resizing and compressing it)",
+    ["cache"],
+)
+
 
 # Process image so it meets Claude requirements
+# (results are cached since the same screenshot is resent on every variant and update)
 def process_image(image_data_url: str) -> tuple[str, str]:
+    start_time = time.perf_counter()
+    cache_key = processed_image_cache.key(image_data_url)
+    cached = processed_image_cache.get(cache_key)
+    if cached:
+        print("[CLAUDE IMAGE PROCESSING] cache hit")
+        image_processing_duration.observe(time.perf_counter() - start_time, cache="hit")
+        return cached
+
+    processed = process_image_uncached(image_data_url)
+    processed_image_cache.put(cache_key, processed)
+    image_processing_duration.observe(time.perf_counter() - start_time, cache="miss")
+    return processed
+
+
+def process_image_uncached(image_data_url: str) -> tuple[str, str]:
 
     # Extract bytes and media type from base64 data URL
     media_type = image_data_url.split(";")[0].split(":")[1]
@@ -52,23 +95,13 @@ def process_image(image_data_url: str) -> tuple[str, str]:
     # Convert and compress as JPEG
     # We always compress as JPEG (95% at the least) even when we resize and the original image
     # is under the size limit.
-    quality = 95
-    output = io.BytesIO()
     img = img.convert("RGB")  # Ensure image is in RGB mode for JPEG conversion
-    img.save(output, format="JPEG", quality=quality)
-
-    # Reduce quality until image is under max size
-    while (
-        len(base64.b64encode(output.getvalue())) > CLAUDE_IMAGE_MAX_SIZE
-        and quality > 10
-    ):
-        output = io.BytesIO()
-        img.save(output, format="JPEG", quality=quality)
-        quality -= 5
+    jpeg_bytes, num_encodes = compress_jpeg(img, CLAUDE_IMAGE_MAX_SIZE)
+    print(f"[CLAUDE IMAGE PROCESSING] JPEG encodes: {num_encodes}")
 
     # Log so we know it was modified
     old_size = len(base64_data)
-    new_size = len(base64.b64encode(output.getvalue()))
+    new_size = base64_size(len(jpeg_bytes))
     print(
         f"[CLAUDE IMAGE PROCESSING] image size updated: old size = {old_size} bytes, new size = {new_size} bytes"
     )
@@ -77,4 +110,71 @@ def process_image(image_data_url: str) -> tuple[str, str]:
     processing_time = end_time - start_time
     print(f"[CLAUDE IMAGE PROCESSING] processing time: {processing_time:.2f} seconds")
 
-    return ("image/jpeg", base64.b64encode(output.getvalue()).decode("utf-8"))
+    return ("image/jpeg", base64.b64encode(jpeg_bytes).decode("utf-8"))
+
+
+def base64_size(num_bytes: int) -> int:
+    return 4 * math.ceil(num_bytes / 3)
+
+
+def encode_jpeg(img: Image.Image, quality: int) -> bytes:
+    output = io.BytesIO()
+    img.save(output, format="JPEG", quality=quality)
+    return output.getvalue()
+
+
+# Estimate the highest quality that fits from the size at max quality
+def estimate_jpeg_quality(size_at_max_quality: int, max_size: int) -> int:
+    target_ratio = max_size / size_at_max_quality
+    for quality, size_ratio in JPEG_QUALITY_SIZE_RATIOS:
+        if size_ratio <= target_ratio:
+            return quality
+    return MIN_JPEG_QUALITY
+
+
+# Compress as JPEG at the highest quality whose base64 encoding fits in max_size.
+# Bisects on quality (seeded with an estimate) so it only needs a handful of encodes.
+# If even the lowest quality doesn't fit, the image is downscaled and searched again
+# (unless resize_if_needed is False, in which case the lowest quality is returned).
+# Returns the JPEG bytes and the number of encodes it took.
+def compress_jpeg(
+    img: Image.Image, max_size: int, resize_if_needed: bool = True
+) -> tuple[bytes, int]:
+    output = encode_jpeg(img, MAX_JPEG_QUALITY)
+    num_encodes = 1
+    if base64_size(len(output)) <= max_size:
+        return (output, num_encodes)
+
+    best_output: bytes | None = None
+    low, high = MIN_JPEG_QUALITY, MAX_JPEG_QUALITY - 1
+    quality = estimate_jpeg_quality(base64_size(len(output)), max_size)
+
+    while low <= high:
+        output = encode_jpeg(img, quality)
+        num_encodes += 1
+
+        if base64_size(len(output)) <= max_size:
+            best_output = output
+            low = quality + 1
+        else:
+            high = quality - 1
+
+        if best_output and high - low < JPEG_QUALITY_SEARCH_TOLERANCE:
+            break
+        quality = (low + high) // 2
+
+    if best_output:
+        return (best_output, num_encodes)
+
+    if not resize_if_needed or min(img.width, img.height) <= 1:
+        return (output, num_encodes)
+
+    # Even the lowest quality is too big, so shrink the image (size scales
+    # roughly with the pixel count) and search again
+    scale = math.sqrt(max_size / base64_size(len(output))) * 0.9
+    new_size = (max(1, int(img.width * scale)), max(1, int(img.height * scale)))
+    print(f"[CLAUDE IMAGE PROCESSING] image too large, resizing to {new_size}")
+    output, resized_num_encodes = compress_jpeg(
+        img.resize(new_size, Image.DEFAULT_STRATEGY), max_size, resize_if_needed
+    )
+    return (output, num_encodes + resized_num_encodes)
@@ -1,14 +1,20 @@
-import copy
+from contextlib import aclosing
+from dataclasses import dataclass
 from enum import Enum
-import base64
-import time
-from typing import Any, Awaitable, Callable, List, cast, TypedDict
-from anthropic import AsyncAnthropic
-from openai import AsyncOpenAI
+from typing import Any, Awaitable, Callable, List
+import openai
 from openai.types.chat import ChatCompletionMessageParam, ChatCompletionChunk
+from clients.core import client_registry
+from codegen.stream_stats import Completion, CompletionRecorder
 from config import IS_DEBUG_ENABLED
 from debug.DebugFileWriter import DebugFileWriter
-from image_processing.utils import process_image
+from anthropic.types.beta.prompt_caching import PromptCachingBetaUsage
+from message_translation.core import (
+    add_anthropic_cache_breakpoints,
+    to_anthropic_messages,
+    to_gemini_contents,
+)
+from metrics.core import Counters, ratio
 from google import genai
 from google.genai import types
 
@@ -31,9 +37,42 @@ class Llm(Enum):
     O1_2024_12_17 = "o1-2024-12-17"
 
 
-class Completion(TypedDict):
-    duration: float
-    code: str
+@dataclass
+class PromptCacheStats(Counters):
+    """Anthropic prompt cache usage across Claude requests."""
+
+    requests: int = 0
+    cache_hits: int = 0
+    cache_read_tokens: int = 0
+    cache_write_tokens: int = 0
+    uncached_input_tokens: int = 0
+
+    def record(self, usage: PromptCachingBetaUsage):
+        cache_read_tokens = usage.cache_read_input_tokens or 0
+        self.requests += 1
+        self.cache_hits += 1 if cache_read_tokens else 0
+        self.cache_read_tokens += cache_read_tokens
+        self.cache_write_tokens += usage.cache_creation_input_tokens or 0
+        self.uncached_input_tokens += usage.input_tokens
+
+    def derived_stats(self) -> dict[str, float]:
+        input_tokens = (
+            self.cache_read_tokens
+            + self.cache_write_tokens
+            + self.uncached_input_tokens
+        )
+        return {
+            "hit_rate": ratio(self.cache_hits, self.requests),
+            "cached_token_ratio": ratio(self.cache_read_tokens, input_tokens),
+        }
+
+
+claude_prompt_cache_stats = PromptCacheStats()
+
+
+# OpenAI-compatible endpoints (set with a custom base URL) that rejected
+# stream_options, so that we stop sending it to them
+base_urls_without_stream_options: set[str] = set()
 
 
 async def stream_openai_response(
@@ -43,8 +82,7 @@ async def stream_openai_response(
     callback: Callable[[str], Awaitable[None]],
     model: Llm,
 ) -> Completion:
-    start_time = time.time()
-    client = AsyncOpenAI(api_key=api_key, base_url=base_url)
+    recorder = CompletionRecorder(model.value)
 
     # Base parameters
     params = {
@@ -57,6 +95,9 @@ async def stream_openai_response(
     if model != Llm.O1_2024_12_17:
         params["temperature"] = 0
         params["stream"] = True
+        # Report token usage in the last chunk
+        if base_url not in base_urls_without_stream_options:
+            params["stream_options"] = {"include_usage": True}
 
     # Add 'max_tokens' corresponding to the model
     if model == Llm.GPT_4O_2024_05_13:
@@ -68,97 +109,109 @@ async def stream_openai_response(
     if model == Llm.O1_2024_12_17:
         params["max_completion_tokens"] = 20000
 
-    # O1 doesn't support streaming
-    if model == Llm.O1_2024_12_17:
-        response = await client.chat.completions.create(**params)  # type: ignore
-        full_response = response.choices[0].message.content  # type: ignore
-    else:
-        stream = await client.chat.completions.create(**params)  # type: ignore
-        full_response = ""
-        async for chunk in stream:  # type: ignore
-            assert isinstance(chunk, ChatCompletionChunk)
-            if (
-                chunk.choices
-                and len(chunk.choices) > 0
-                and chunk.choices[0].delta
-                and chunk.choices[0].delta.content
-            ):
-                content = chunk.choices[0].delta.content or ""
-                full_response += content
-                await callback(content)
-
-    await client.close()
-
-    completion_time = time.time() - start_time
-    return {"duration": completion_time, "code": full_response}
-
-
-# TODO: Have a seperate function that translates OpenAI messages to Claude messages
+    async with client_registry.lease_openai(api_key, base_url) as client:
+        # O1 doesn't support streaming
+        if model == Llm.O1_2024_12_17:
+            response = await client.chat.completions.create(**params)  # type: ignore
+            full_response = response.choices[0].message.content  # type: ignore
+            usage = response.usage  # type: ignore
+        else:
+            try:
+                stream = await client.chat.completions.create(**params)  # type: ignore
+            except openai.BadRequestError:
+                if base_url is None or "stream_options" not in params:
+                    raise
+                # Proxies may reject parameters they don't know: retry without
+                # it (the completion then has no token usage)
+                del params["stream_options"]
+                stream = await client.chat.completions.create(**params)  # type: ignore
+                print(f"{base_url} doesn't support stream_options, not sending it")
+                base_urls_without_stream_options.add(base_url)
+            full_response = ""
+            usage = None
+            # Close the stream (and its connection) right away if we're cancelled
+            async with stream:  # type: ignore
+                async for chunk in stream:  # type: ignore
+                    assert isinstance(chunk, ChatCompletionChunk)
+                    if chunk.usage:
+                        usage = chunk.usage
+                    if (
+                        chunk.choices
+                        and len(chunk.choices) > 0
+                        and chunk.choices[0].delta
+                        and chunk.choices[0].delta.content
+                    ):
+                        content = chunk.choices[0].delta.content or ""
+                        recorder.chunk()
+                        full_response += content
+                        await callback(content)
+
+    return recorder.finish(
+        full_response,
+        input_tokens=usage.prompt_tokens if usage else None,
+        output_tokens=usage.completion_tokens if usage else None,
+    )
+
+
 async def stream_claude_response(
     messages: List[ChatCompletionMessageParam],
     api_key: str,
     callback: Callable[[str], Awaitable[None]],
     model: Llm,
 ) -> Completion:
-    start_time = time.time()
-    client = AsyncAnthropic(api_key=api_key)
+    recorder = CompletionRecorder(model.value)
 
     # Base parameters
     max_tokens = 8192
     temperature = 0.0
 
     # Translate OpenAI messages to Claude messages
+    # (without copying them, so that large image data isn't duplicated)
+    system_prompt, claude_messages = await to_anthropic_messages(messages)
 
-    # Deep copy messages to avoid modifying the original list
-    cloned_messages = copy.deepcopy(messages)
-
-    system_prompt = cast(str, cloned_messages[0].get("content"))
-    claude_messages = [dict(message) for message in cloned_messages[1:]]
-    for message in claude_messages:
-        if not isinstance(message["content"], list):
-            continue
-
-        for content in message["content"]:  # type: ignore
-            if content["type"] == "image_url":
-                content["type"] = "image"
-
-                # Extract base64 data and media type from data URL
-                # Example base64 data URL: data:image/png;base64,iVBOR...
-                image_data_url = cast(str, content["image_url"]["url"])
-
-                # Process image and split media type and data
-                # so it works with Claude (under 5mb in base64 encoding)
-                (media_type, base64_data) = process_image(image_data_url)
-
-                # Remove OpenAI parameter
-                del content["image_url"]
-
-                content["source"] = {
-                    "type": "base64",
-                    "media_type": media_type,
-                    "data": base64_data,
-                }
+    # Cache the system prompt and reference screenshot between update turns
+    system, cached_messages = add_anthropic_cache_breakpoints(
+        system_prompt, claude_messages
+    )
 
     # Stream Claude response
-    async with client.messages.stream(
-        model=model.value,
-        max_tokens=max_tokens,
-        temperature=temperature,
-        system=system_prompt,
-        messages=claude_messages,  # type: ignore
-        extra_headers={"anthropic-beta": "max-tokens-3-5-sonnet-2024-07-15"},
-    ) as stream:
-        async for text in stream.text_stream:
-            await callback(text)
-
-    # Return final message
-    response = await stream.get_final_message()
+    async with client_registry.lease_anthropic(api_key) as client:
+        async with client.beta.prompt_caching.messages.stream(
+            model=model.value,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            system=system,
+            messages=cached_messages,
+            extra_headers={
+                "anthropic-beta": "prompt-caching-2024-07-31,max-tokens-3-5-sonnet-2024-07-15"
+            },
+        ) as stream:
+            async for text in stream.text_stream:
+                recorder.chunk()
+                await callback(text)
 
-    # Close the Anthropic client
-    await client.close()
+        # Return final message
+        response = await stream.get_final_message()
 
-    completion_time = time.time() - start_time
-    return {"duration": completion_time, "code": response.content[0].text}
+    usage = response.usage
+    completion = recorder.finish(
+        response.content[0].text,
+        input_tokens=usage.input_tokens
+        + (usage.cache_read_input_tokens or 0)
+        + (usage.cache_creation_input_tokens or 0),
+        output_tokens=usage.output_tokens,
+    )
+
+    claude_prompt_cache_stats.record(usage)
+    stats = claude_prompt_cache_stats.stats()
+    print(
+        f"[CLAUDE PROMPT CACHE] read {usage.cache_read_input_tokens or 0} tokens, "
+        f"wrote {usage.cache_creation_input_tokens or 0} tokens, "
+        f"uncached {usage.input_tokens} tokens, "
+        f"time to first token {completion['time_to_first_chunk'] or completion['duration']:.2f}s "
+        f"(hit rate {stats['hit_rate']:.0%} over {stats['requests']} requests)"
+    )
+    return completion
 
 
 async def stream_claude_response_native(
@@ -169,8 +222,7 @@ async def stream_claude_response_native(
     include_thinking: bool = False,
     model: Llm = Llm.CLAUDE_3_OPUS,
 ) -> Completion:
-    start_time = time.time()
-    client = AsyncAnthropic(api_key=api_key)
+    recorder = CompletionRecorder(model.value)
 
     # Base model parameters
     max_tokens = 4096
@@ -187,61 +239,67 @@ async def stream_claude_response_native(
     full_stream = ""
     debug_file_writer = DebugFileWriter()
 
-    while current_pass_num <= max_passes:
-        current_pass_num += 1
-
-        # Set up message depending on whether we have a <thinking> prefix
-        messages_to_send = (
-            messages + [{"role": "assistant", "content": prefix}]
-            if include_thinking
-            else messages
-        )
+    # Usage across all passes
+    input_tokens = 0
+    output_tokens = 0
 
-        pprint_prompt(messages_to_send)
+    async with client_registry.lease_anthropic(api_key) as client:
+        while current_pass_num <= max_passes:
+            current_pass_num += 1
 
-        async with client.messages.stream(
-            model=model.value,
-            max_tokens=max_tokens,
-            temperature=temperature,
-            system=system_prompt,
-            messages=messages_to_send,  # type: ignore
-        ) as stream:
-            async for text in stream.text_stream:
-                print(text, end="", flush=True)
-                full_stream += text
-                await callback(text)
-
-        response = await stream.get_final_message()
-        response_text = response.content[0].text
-
-        # Write each pass's code to .html file and thinking to .txt file
-        if IS_DEBUG_ENABLED:
-            debug_file_writer.write_to_file(
-                f"pass_{current_pass_num - 1}.html",
-                debug_file_writer.extract_html_content(response_text),
-            )
-            debug_file_writer.write_to_file(
-                f"thinking_pass_{current_pass_num - 1}.txt",
-                response_text.split("</thinking>")[0],
+            # Set up message depending on whether we have a <thinking> prefix
+            messages_to_send = (
+                messages + [{"role": "assistant", "content": prefix}]
+                if include_thinking
+                else messages
             )
 
-        # Set up messages array for next pass
-        messages += [
-            {"role": "assistant", "content": str(prefix) + response.content[0].text},
-            {
-                "role": "user",
-                "content": "You've done a good job with a first draft. Improve this further based on the original instructions so that the app is fully functional and looks like the original video of the app we're trying to replicate.",
-            },
-        ]
-
-        print(
-            f"Token usage: Input Tokens: {response.usage.input_tokens}, Output Tokens: {response.usage.output_tokens}"
-        )
-
-    # Close the Anthropic client
-    await client.close()
-
-    completion_time = time.time() - start_time
+            pprint_prompt(messages_to_send)
+
+            async with client.messages.stream(
+                model=model.value,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                system=system_prompt,
+                messages=messages_to_send,  # type: ignore
+            ) as stream:
+                async for text in stream.text_stream:
+                    recorder.chunk()
+                    print(text, end="", flush=True)
+                    full_stream += text
+                    await callback(text)
+
+            response = await stream.get_final_message()
+            response_text = response.content[0].text
+            input_tokens += response.usage.input_tokens
+            output_tokens += response.usage.output_tokens
+
+            # Write each pass's code to .html file and thinking to .txt file
+            if IS_DEBUG_ENABLED:
+                debug_file_writer.write_to_file(
+                    f"pass_{current_pass_num - 1}.html",
+                    debug_file_writer.extract_html_content(response_text),
+                )
+                debug_file_writer.write_to_file(
+                    f"thinking_pass_{current_pass_num - 1}.txt",
+                    response_text.split("</thinking>")[0],
+                )
+
+            # Set up messages array for next pass
+            messages += [
+                {
+                    "role": "assistant",
+                    "content": str(prefix) + response.content[0].text,
+                },
+                {
+                    "role": "user",
+                    "content": "You've done a good job with a first draft. Improve this further based on the original instructions so that the app is fully functional and looks like the original video of the app we're trying to replicate.",
+                },
+            ]
+
+            print(
+                f"Token usage: Input Tokens: {response.usage.input_tokens}, Output Tokens: {response.usage.output_tokens}"
+            )
 
     if IS_DEBUG_ENABLED:
         debug_file_writer.write_to_file("full_stream.txt", full_stream)
@@ -249,10 +307,11 @@ async def stream_claude_response_native(
     if not response:
         raise Exception("No HTML response found in AI response")
     else:
-        return {
-            "duration": completion_time,
-            "code": response.content[0].text,  # type: ignore
-        }
+        return recorder.finish(
+            response.content[0].text,  # type: ignore
+            input_tokens=input_tokens,
+            output_tokens=output_tokens,
+        )
 
 
 async def stream_gemini_response(
@@ -261,42 +320,30 @@ async def stream_gemini_response(
     callback: Callable[[str], Awaitable[None]],
     model: Llm,
 ) -> Completion:
-    start_time = time.time()
-
-    # Extract image URLs from messages
-    image_urls = []
-    for content_part in messages[-1]["content"]:  # type: ignore
-        if content_part["type"] == "image_url":  # type: ignore
-            image_url = content_part["image_url"]["url"]  # type: ignore
-            if image_url.startswith("data:"):  # type: ignore
-                # Extract base64 data and mime type for data URLs
-                mime_type = image_url.split(";")[0].split(":")[1]  # type: ignore
-                base64_data = image_url.split(",")[1]  # type: ignore
-                image_urls = [{"mime_type": mime_type, "data": base64_data}]  # type: ignore
-            else:
-                # Store regular URLs
-                image_urls = [{"uri": image_url}]  # type: ignore
-            break  # Exit after first image URL
+    recorder = CompletionRecorder(model.value)
 
     client = genai.Client(api_key=api_key)  # type: ignore
     full_response = ""
-    async for response in client.aio.models.generate_content_stream(  # type: ignore
-        model=model.value,
-        contents={
-            "parts": [
-                {"text": messages[0]["content"]},  # type: ignore
-                types.Part.from_bytes(  # type: ignore
-                    data=base64.b64decode(image_urls[0]["data"]),  # type: ignore
-                    mime_type=image_urls[0]["mime_type"],  # type: ignore
-                ),
-            ]  # type: ignore
-        },  # type: ignore
-        config=types.GenerateContentConfig(  # type: ignore
-            temperature=0, max_output_tokens=8192
-        ),
-    ):  # type: ignore
-        if response.text:  # type: ignore
-            full_response += response.text  # type: ignore
-            await callback(response.text)  # type: ignore
-    completion_time = time.time() - start_time
-    return {"duration": completion_time, "code": full_response}
+    usage = None
+    # Close the stream right away if we're cancelled
+    async with aclosing(
+        client.aio.models.generate_content_stream(  # type: ignore
+            model=model.value,
+            contents=to_gemini_contents(messages),
+            config=types.GenerateContentConfig(  # type: ignore
+                temperature=0, max_output_tokens=8192
+            ),
+        )
+    ) as stream:
+        async for response in stream:  # type: ignore
+            if response.usage_metadata:  # type: ignore
+                usage = response.usage_metadata  # type: ignore
+            if response.text:  # type: ignore
+                recorder.chunk()
+                full_response += response.text  # type: ignore
+                await callback(response.text)  # type: ignore
+    return recorder.finish(
+        full_response,
+        input_tokens=usage.prompt_token_count if usage else None,  # type: ignore
+        output_tokens=usage.candidates_token_count if usage else None,  # type: ignore
+    )
@@ -4,11 +4,28 @@ from dotenv import load_dotenv
 load_dotenv()
 
 
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from routes import screenshot, generate_code, home, evals
+from clients.core import client_registry
+from executors.core import cpu_executor
+from fs_logging.core import run_log_writer
+from image_generation.cache import generated_image_cache
+from routes import screenshot, generate_code, home, evals, metrics, blobs
 
-app = FastAPI(openapi_url=None, docs_url=None, redoc_url=None)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # Close pooled provider connections and worker pools on shutdown
+    await client_registry.close()
+    cpu_executor.shutdown()
+    generated_image_cache.close()
+    # Write the run logs that are still queued
+    run_log_writer.close()
+
+
+app = FastAPI(openapi_url=None, docs_url=None, redoc_url=None, lifespan=lifespan)
 
 # Configure CORS settings
 app.add_middleware(
@@ -24,3 +41,5 @@ app.include_router(generate_code.router)
 app.include_router(screenshot.router)
 app.include_router(home.router)
 app.include_router(evals.router)
+app.include_router(metrics.router)
+app.include_router(blobs.router)
@@ -0,0 +1,150 @@
+import base64
+import mimetypes
+from typing import Any, List, Literal, cast
+from anthropic.types import ImageBlockParam, MessageParam
+from anthropic.types.beta.prompt_caching import (
+    PromptCachingBetaCacheControlEphemeralParam,
+    PromptCachingBetaMessageParam,
+    PromptCachingBetaTextBlockParam,
+)
+from google.genai import types
+from openai.types.chat import ChatCompletionMessageParam
+from caching.lru import LruCache
+from executors.core import cpu_executor
+from image_processing.utils import process_image
+
+# Upper bound on the total size of the data URLs whose conversions are memoized
+IMAGE_CONVERSION_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+ConversionKind = Literal["anthropic", "gemini"]
+
+EPHEMERAL_CACHE: PromptCachingBetaCacheControlEphemeralParam = {"type": "ephemeral"}
+
+
+# Both the data URL (the key) and its conversion are kept in memory
+def image_conversion_size(key: tuple[ConversionKind, str], value: Any) -> int:
+    kind, url = key
+    if kind == "anthropic":
+        return len(url) + len(value["source"]["data"])
+    inline_data = value.inline_data
+    return len(url) + (len(inline_data.data or b"") if inline_data else 0)
+
+
+# Per-provider conversions of images, keyed by the image URL. Python caches the
+# hash of a str, so looking up the same data URL object again (e.g. for every
+# variant and update of a request) doesn't rehash megabytes of base64 data.
+image_conversion_cache: LruCache[tuple[ConversionKind, str], Any] = LruCache(
+    IMAGE_CONVERSION_CACHE_MAX_BYTES, image_conversion_size
+)
+
+
+# Split a data URL (e.g. data:image/png;base64,iVBOR...) into its media type and
+# base64 data without splitting the data part on anything
+def parse_data_url(data_url: str) -> tuple[str, str]:
+    header, _, data = data_url.partition(",")
+    media_type = header.removeprefix("data:").split(";", 1)[0]
+    return (media_type, data)
+
+
+# The returned blocks are shared between calls, so they must not be modified
+async def to_anthropic_image(image_url: str) -> ImageBlockParam:
+    cached = image_conversion_cache.get(("anthropic", image_url))
+    if cached is not None:
+        return cached
+
+    # Process image and split media type and data
+    # so it works with Claude (under 5mb in base64 encoding)
+    media_type, base64_data = await cpu_executor.run(process_image, image_url)
+
+    block: ImageBlockParam = {
+        "type": "image",
+        "source": {
+            "type": "base64",
+            "media_type": media_type,  # type: ignore
+            "data": base64_data,
+        },
+    }
+    image_conversion_cache.put(("anthropic", image_url), block)
+    return block
+
+
+# Translate OpenAI messages to the system prompt and messages for Claude.
+# Messages and content parts that don't need converting are shared with the
+# original list (not copied), so neither list should be modified afterwards.
+async def to_anthropic_messages(
+    messages: List[ChatCompletionMessageParam],
+) -> tuple[str, List[MessageParam]]:
+    system_prompt = cast(str, messages[0].get("content"))
+
+    anthropic_messages: List[MessageParam] = []
+    for message in messages[1:]:
+        content = message.get("content")
+        if not isinstance(content, list):
+            anthropic_messages.append(cast(MessageParam, message))
+            continue
+
+        parts: List[Any] = []
+        for part in content:
+            if part["type"] == "image_url":
+                parts.append(await to_anthropic_image(part["image_url"]["url"]))
+            else:
+                parts.append(part)
+        anthropic_messages.append(cast(MessageParam, {**message, "content": parts}))
+
+    return (system_prompt, anthropic_messages)
+
+
+def to_gemini_image(image_url: str) -> types.Part:
+    cached = image_conversion_cache.get(("gemini", image_url))
+    if cached is not None:
+        return cached
+
+    if image_url.startswith("data:"):
+        media_type, base64_data = parse_data_url(image_url)
+        part = types.Part.from_bytes(
+            data=base64.b64decode(base64_data), mime_type=media_type
+        )
+    else:
+        media_type = mimetypes.guess_type(image_url)[0] or "image/png"
+        part = types.Part.from_uri(file_uri=image_url, mime_type=media_type)
+
+    image_conversion_cache.put(("gemini", image_url), part)
+    return part
+
+
+# Translate OpenAI messages to Gemini contents: the system prompt and the
+# first image of the last message (Gemini is only used for creating code)
+def to_gemini_contents(messages: List[ChatCompletionMessageParam]) -> types.Content:
+    parts: List[types.Part] = [types.Part.from_text(cast(str, messages[0]["content"]))]
+    for content_part in messages[-1]["content"]:  # type: ignore
+        if content_part["type"] == "image_url":  # type: ignore
+            parts.append(to_gemini_image(content_part["image_url"]["url"]))  # type: ignore
+            break  # Exit after first image URL
+
+    return types.Content(role="user", parts=parts)
+
+
+# Mark the system prompt and the first image (the reference screenshot) as
+# prompt cache breakpoints, so that follow-up updates with the same prefix only
+# pay for processing the new turns. Cached image blocks are shared, so the
+# marked block is a copy.
+def add_anthropic_cache_breakpoints(
+    system_prompt: str, messages: List[MessageParam]
+) -> tuple[List[PromptCachingBetaTextBlockParam], List[PromptCachingBetaMessageParam]]:
+    system: List[PromptCachingBetaTextBlockParam] = [
+        {"type": "text", "text": system_prompt, "cache_control": EPHEMERAL_CACHE}
+    ]
+
+    cached_messages = cast(List[PromptCachingBetaMessageParam], list(messages))
+    for index, message in enumerate(messages):
+        content = message["content"]
+        if not isinstance(content, list):
+            continue
+        for part_index, part in enumerate(content):
+            if part["type"] == "image":  # type: ignore
+                parts: List[Any] = list(content)
+                parts[part_index] = {**part, "cache_control": EPHEMERAL_CACHE}  # type: ignore
+                cached_messages[index] = {**message, "content": parts}  # type: ignore
+                return (system, cached_messages)
+
+    return (system, cached_messages)
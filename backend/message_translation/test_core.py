@@ -0,0 +1,137 @@
+import asyncio
+import base64
+import copy
+import io
+from typing import Any, List
+from PIL import Image
+from message_translation.core import (
+    add_anthropic_cache_breakpoints,
+    image_conversion_cache,
+    image_conversion_size,
+    parse_data_url,
+    to_anthropic_messages,
+    to_gemini_contents,
+)
+
+
+def png_data_url(width: int, height: int) -> str:
+    output = io.BytesIO()
+    Image.new("RGB", (width, height), "red").save(output, format="PNG")
+    return "data:image/png;base64," + base64.b64encode(output.getvalue()).decode()
+
+
+def update_messages(image_url: str) -> List[Any]:
+    return [
+        {"role": "system", "content": "You are an expert developer"},
+        {
+            "role": "user",
+            "content": [
+                {"type": "image_url", "image_url": {"url": image_url}},
+                {"type": "text", "text": "Generate code for this screenshot"},
+            ],
+        },
+        {"role": "assistant", "content": "<html><body>Hello</body></html>"},
+        {"role": "user", "content": "Make the background blue"},
+    ]
+
+
+def test_parse_data_url():
+    assert parse_data_url("data:image/jpeg;base64,abc,def") == ("image/jpeg", "abc,def")
+
+
+def test_anthropic_messages_share_unconverted_parts():
+    image_conversion_cache.clear()
+    messages = update_messages(png_data_url(10, 10))
+    original = copy.deepcopy(messages)
+
+    system_prompt, claude_messages = asyncio.run(to_anthropic_messages(messages))
+
+    # The original messages aren't modified
+    assert messages == original
+    assert system_prompt == "You are an expert developer"
+    assert claude_messages[0]["content"][0]["type"] == "image"  # type: ignore
+    assert claude_messages[0]["content"][0]["source"]["media_type"] == "image/png"  # type: ignore
+    # Everything that doesn't need converting is shared, not copied
+    assert claude_messages[0]["content"][1] is messages[1]["content"][1]  # type: ignore
+    assert claude_messages[1] is messages[2]
+    assert claude_messages[2] is messages[3]
+
+
+def test_image_conversions_are_memoized():
+    image_conversion_cache.clear()
+    image_url = png_data_url(10, 10)
+
+    async def run():
+        first = await to_anthropic_messages(update_messages(image_url))
+        second = await to_anthropic_messages(update_messages(image_url))
+        return (first, second)
+
+    (_, first), (_, second) = asyncio.run(run())
+    assert first[0]["content"][0] is second[0]["content"][0]  # type: ignore
+
+    to_gemini_contents(update_messages(image_url)[:2])
+    gemini_contents = to_gemini_contents(update_messages(image_url)[:2])
+    assert gemini_contents.parts
+    assert gemini_contents.parts[0].text == "You are an expert developer"
+    assert gemini_contents.parts[1].inline_data
+    assert gemini_contents.parts[1].inline_data.mime_type == "image/png"
+
+    assert image_conversion_cache.counters.hits == 2
+    assert image_conversion_cache.counters.misses == 2
+
+
+def test_conversion_cache_counts_urls_and_converted_data():
+    image_conversion_cache.clear()
+    data_url = png_data_url(10, 10)
+    messages = update_messages(data_url)
+
+    async def run():
+        _, claude_messages = await to_anthropic_messages(messages)
+        return claude_messages[0]["content"][0]  # type: ignore
+
+    block = asyncio.run(run())
+    gemini_part = to_gemini_contents(messages[:2]).parts[1]  # type: ignore
+
+    anthropic_size = len(data_url) + len(block["source"]["data"])
+    gemini_size = len(data_url) + len(gemini_part.inline_data.data)  # type: ignore
+    assert image_conversion_size(("anthropic", data_url), block) == anthropic_size
+    assert image_conversion_size(("gemini", data_url), gemini_part) == gemini_size
+    assert image_conversion_cache.total_size == anthropic_size + gemini_size
+
+
+def test_cache_breakpoints_on_system_prompt_and_first_image():
+    image_conversion_cache.clear()
+    messages = update_messages(png_data_url(10, 10))
+    messages.append(
+        {
+            "role": "user",
+            "content": [
+                {"type": "image_url", "image_url": {"url": png_data_url(20, 20)}},
+                {"type": "text", "text": "Now like this"},
+            ],
+        }
+    )
+
+    async def run():
+        system_prompt, claude_messages = await to_anthropic_messages(messages)
+        return (
+            claude_messages,
+            add_anthropic_cache_breakpoints(system_prompt, claude_messages),
+        )
+
+    claude_messages, (system, cached_messages) = asyncio.run(run())
+
+    assert system == [
+        {
+            "type": "text",
+            "text": "You are an expert developer",
+            "cache_control": {"type": "ephemeral"},
+        }
+    ]
+    first_image = cached_messages[0]["content"][0]  # type: ignore
+    assert first_image["cache_control"] == {"type": "ephemeral"}  # type: ignore
+    # Only the first image is a breakpoint
+    assert "cache_control" not in cached_messages[-1]["content"][0]  # type: ignore
+    # The memoized image block isn't modified
+    assert "cache_control" not in claude_messages[0]["content"][0]  # type: ignore
+    assert cached_messages[1] is claude_messages[1]
@@ -0,0 +1,321 @@
+import bisect
+import math
+import threading
+import time
+from dataclasses import dataclass, fields
+from typing import Callable, Dict, List, Sequence, Tuple
+
+# Latency buckets (in seconds) from a millisecond to ten minutes, which covers
+# WebSocket sends as well as whole code generations
+DEFAULT_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    25.0,
+    60.0,
+    120.0,
+    300.0,
+    600.0,
+)
+
+LabelValues = Tuple[str, ...]
+
+
+def format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(
+        f'{name}="{escape_label_value(value)}"' for name, value in zip(names, values)
+    )
+    return "{" + pairs + "}"
+
+
+def escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.lock = threading.Lock()
+
+    def label_values(self, labels: Dict[str, str]) -> LabelValues:
+        # A list comprehension is noticeably faster than a generator here
+        return tuple([labels[name] for name in self.label_names])
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for name, labels, value in self.samples():
+            lines.append(f"{name}{labels} {format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        self.values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = self.label_values(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels: str) -> float:
+        return self.values.get(self.label_values(labels), 0)
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        with self.lock:
+            values = list(self.values.items())
+        return [
+            (f"{self.name}_total", format_labels(self.label_names, key), value)
+            for key, value in values
+        ]
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        self.values: Dict[LabelValues, float] = {}
+
+    def set(self, value: float, **labels: str):
+        key = self.label_values(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = self.label_values(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: str):
+        self.inc(-amount, **labels)
+
+    def get(self, **labels: str) -> float:
+        return self.values.get(self.label_values(labels), 0)
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        with self.lock:
+            values = list(self.values.items())
+        return [
+            (self.name, format_labels(self.label_names, key), value)
+            for key, value in values
+        ]
+
+
+class HistogramValues:
+    def __init__(self, num_buckets: int):
+        # Not cumulative (that's done when rendering), the last one is +Inf
+        self.bucket_counts = [0] * (num_buckets + 1)
+        self.count = 0
+        self.sum = 0.0
+
+
+class Histogram(Metric):
+    """
+    Prometheus histogram: p50/p99 etc. are computed from the buckets when
+    querying (histogram_quantile), or approximately with quantile().
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        self.values: Dict[LabelValues, HistogramValues] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = self.label_values(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            values = self.values.get(key)
+            if values is None:
+                values = self.values[key] = HistogramValues(len(self.buckets))
+            values.bucket_counts[index] += 1
+            values.count += 1
+            values.sum += value
+
+    # Observes the time spent in the block
+    def time(self, **labels: str) -> "HistogramTimer":
+        return HistogramTimer(self, labels)
+
+    def count(self, **labels: str) -> int:
+        values = self.values.get(self.label_values(labels))
+        return values.count if values else 0
+
+    # Estimates a quantile by linear interpolation within its bucket (like
+    # Prometheus' histogram_quantile)
+    def quantile(self, q: float, **labels: str) -> float | None:
+        values = self.values.get(self.label_values(labels))
+        if values is None or values.count == 0:
+            return None
+
+        rank = q * values.count
+        cumulative = 0
+        for index, bucket_count in enumerate(values.bucket_counts):
+            if cumulative + bucket_count >= rank and bucket_count:
+                if index == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                upper = self.buckets[index]
+                return lower + (upper - lower) * (rank - cumulative) / bucket_count
+            cumulative += bucket_count
+        return self.buckets[-1]
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        with self.lock:
+            values = [
+                (key, list(v.bucket_counts), v.count, v.sum)
+                for key, v in self.values.items()
+            ]
+
+        samples: List[Tuple[str, str, float]] = []
+        for key, bucket_counts, count, total in values:
+            cumulative = 0
+            for upper, bucket_count in zip((*self.buckets, math.inf), bucket_counts):
+                cumulative += bucket_count
+                samples.append(
+                    (
+                        f"{self.name}_bucket",
+                        format_labels(
+                            (*self.label_names, "le"), (*key, format_value(upper))
+                        ),
+                        cumulative,
+                    )
+                )
+            labels = format_labels(self.label_names, key)
+            samples.append((f"{self.name}_sum", labels, total))
+            samples.append((f"{self.name}_count", labels, count))
+        return samples
+
+
+# A class rather than @contextmanager, which is several times slower
+class HistogramTimer:
+    def __init__(self, histogram: Histogram, labels: Dict[str, str]):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start_time = time.perf_counter()
+
+    def __exit__(self, *exc_info: object):
+        self.histogram.observe(time.perf_counter() - self.start_time, **self.labels)
+
+
+# 0 rather than a division by zero before anything has been counted
+def ratio(numerator: float, denominator: float) -> float:
+    return numerator / denominator if denominator else 0.0
+
+
+@dataclass
+class Counters:
+    """
+    Counters that a component keeps itself (e.g. the hits of a cache), exported
+    with MetricsRegistry.register_stats. Subclasses are dataclasses whose fields
+    are the counters: stats() reports them along with derived_stats() (e.g.
+    rates).
+    """
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            **{field.name: getattr(self, field.name) for field in fields(self)},
+            **self.derived_stats(),
+        }
+
+    def derived_stats(self) -> Dict[str, float]:
+        return {}
+
+
+class MetricsRegistry:
+    """
+    In-process metrics, rendered in the Prometheus text format by /metrics.
+
+    Recording is a dict lookup and a few additions under a lock, so it's cheap
+    enough for per-chunk hot paths. Components that already keep their own
+    counters (caches, executors, schedulers) register their stats() instead,
+    which is only called when rendering.
+    """
+
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+        self.stats_sources: Dict[str, Callable[[], Dict[str, float]]] = {}
+
+    def register(self, metric: Metric):
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self.metrics[metric.name] = metric
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+        counter = Counter(name, help, labels)
+        self.register(counter)
+        return counter
+
+    def gauge(self, name: str, help: str, labels: Sequence[str] = ()) -> Gauge:
+        gauge = Gauge(name, help, labels)
+        self.register(gauge)
+        return gauge
+
+    def histogram(
+        self,
+        name: str,
+        help: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        histogram = Histogram(name, help, labels, buckets)
+        self.register(histogram)
+        return histogram
+
+    # Export the values of stats() as gauges named <prefix>_<key>
+    def register_stats(self, prefix: str, stats: Callable[[], Dict[str, float]]):
+        self.stats_sources[prefix] = stats
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+
+        for prefix, stats in self.stats_sources.items():
+            for key, value in stats().items():
+                name = f"{prefix}_{key}"
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {format_value(value)}")
+
+        return "\n".join(lines) + "\n"
+
+
+metrics_registry = MetricsRegistry()
@@ -0,0 +1,101 @@
+import threading
+from dataclasses import dataclass
+import pytest
+from metrics.core import Counters, MetricsRegistry, ratio
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = MetricsRegistry()
+    histogram = registry.histogram(
+        "send_seconds", "Send time", ["type"], buckets=[0.1, 1.0]
+    )
+    for value in [0.05, 0.1, 0.5, 2.0]:
+        histogram.observe(value, type="chunk")
+
+    assert registry.render().splitlines() == [
+        "# HELP send_seconds Send time",
+        "# TYPE send_seconds histogram",
+        'send_seconds_bucket{type="chunk",le="0.1"} 2',
+        'send_seconds_bucket{type="chunk",le="1"} 3',
+        'send_seconds_bucket{type="chunk",le="+Inf"} 4',
+        'send_seconds_sum{type="chunk"} 2.65',
+        'send_seconds_count{type="chunk"} 4',
+    ]
+
+
+def test_histogram_quantiles_interpolate_within_buckets():
+    registry = MetricsRegistry()
+    histogram = registry.histogram("latency_seconds", "Latency", buckets=[1, 2, 4])
+    assert histogram.quantile(0.5) is None
+
+    for value in [0.5] * 50 + [1.5] * 49 + [3.0]:
+        histogram.observe(value)
+
+    assert histogram.quantile(0.5) == pytest.approx(1.0)
+    assert histogram.quantile(0.99) == pytest.approx(2.0)
+    assert histogram.quantile(1.0) == pytest.approx(4.0)
+
+
+def test_counters_gauges_and_stats():
+    registry = MetricsRegistry()
+    requests = registry.counter("requests", "Requests", ["mode"])
+    in_progress = registry.gauge("in_progress", "In progress")
+    registry.register_stats("cache", lambda: {"hits": 3, "hit_rate": 0.75})
+
+    requests.inc(mode="image")
+    requests.inc(2, mode='say "hi"')
+    in_progress.inc()
+    in_progress.inc()
+    in_progress.dec()
+
+    lines = registry.render().splitlines()
+    assert 'requests_total{mode="image"} 1' in lines
+    assert 'requests_total{mode="say \\"hi\\""} 2' in lines
+    assert "in_progress 1" in lines
+    assert "cache_hits 3" in lines
+    assert "cache_hit_rate 0.75" in lines
+
+    with pytest.raises(ValueError, match="already registered"):
+        registry.counter("requests", "Requests")
+
+
+
+@dataclass
+class FakeCacheCounters(Counters):
+    hits: int = 0
+    misses: int = 0
+
+    def derived_stats(self) -> dict[str, float]:
+        return {"hit_rate": ratio(self.hits, self.hits + self.misses)}
+
+
+def test_counters_report_their_fields_and_derived_stats():
+    counters = FakeCacheCounters()
+    assert counters.stats() == {"hits": 0, "misses": 0, "hit_rate": 0.0}
+
+    counters.hits += 3
+    counters.misses += 1
+    registry = MetricsRegistry()
+    registry.register_stats("cache", counters.stats)
+
+    lines = registry.render().splitlines()
+    assert "cache_hits 3" in lines
+    assert "cache_misses 1" in lines
+    assert "cache_hit_rate 0.75" in lines
+
+
+def test_observations_from_threads_are_not_lost():
+    registry = MetricsRegistry()
+    histogram = registry.histogram("work_seconds", "Work", ["worker"])
+
+    def work():
+        for _ in range(10000):
+            histogram.observe(0.01, worker="cpu")
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert histogram.count(worker="cpu") == 40000
@@ -17,8 +17,10 @@ async def mock_completion(
         else NO_IMAGES_NYTIMES_MOCK_CODE
     )
 
+    chunks = 0
     for i in range(0, len(code_to_return), STREAM_CHUNK_SIZE):
-        await process_chunk(code_to_return[i : i + STREAM_CHUNK_SIZE], i)
+        await process_chunk(code_to_return[i : i + STREAM_CHUNK_SIZE], 0)
+        chunks += 1
         await asyncio.sleep(0.01)
 
     if input_mode == "video":
@@ -31,7 +33,15 @@ async def mock_completion(
         else:
             code_to_return = "Error: HTML block not found."
 
-    return {"duration": 0.1, "code": code_to_return}
+    return Completion(
+        duration=0.1,
+        code=code_to_return,
+        time_to_first_chunk=0.0,
+        chunks=chunks,
+        output_chars=len(code_to_return),
+        input_tokens=None,
+        output_tokens=None,
+    )
 
 
 APPLE_MOCK_CODE = """<html lang="en">
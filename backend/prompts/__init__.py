@@ -2,6 +2,7 @@ from typing import Union
 from openai.types.chat import ChatCompletionMessageParam, ChatCompletionContentPartParam
 
 from custom_types import InputMode
+from executors.core import cpu_executor
 from image_generation.core import create_alt_url_mapping
 from prompts.imported_code_prompts import IMPORTED_CODE_SYSTEM_PROMPTS
 from prompts.screenshot_system_prompts import SYSTEM_PROMPTS
@@ -65,7 +66,9 @@ async def create_prompt(
                     }
                 prompt_messages.append(message)
 
-            image_cache = create_alt_url_mapping(params["history"][-2])
+            image_cache = await cpu_executor.run(
+                create_alt_url_mapping, params["history"][-2]
+            )
 
     if input_mode == "video":
         video_data_url = params["image"]
@@ -0,0 +1,48 @@
+from fastapi import APIRouter, HTTPException, Request, Response
+from pydantic import BaseModel
+from blobs.core import ALLOWED_MEDIA_TYPES, BLOB_REFERENCE_PREFIX, blob_store
+from executors.core import run_blocking
+
+router = APIRouter()
+
+
+class BlobResponse(BaseModel):
+    hash: str
+    # What to send instead of the data URL in generation requests
+    reference: str
+
+
+# Upload a screenshot or video (the raw bytes, with its Content-Type)
+@router.post("/blobs", response_model=BlobResponse)
+async def upload_blob(request: Request) -> BlobResponse:
+    media_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if media_type not in ALLOWED_MEDIA_TYPES:
+        raise HTTPException(status_code=415, detail="Only images and videos")
+
+    content_length = int(request.headers.get("content-length") or 0)
+    if content_length > blob_store.max_blob_bytes:
+        raise HTTPException(status_code=413, detail="Blob is too large")
+
+    # Streamed, since chunked uploads don't have a Content-Length
+    chunks: list[bytes] = []
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > blob_store.max_blob_bytes:
+            raise HTTPException(status_code=413, detail="Blob is too large")
+        chunks.append(chunk)
+    data = b"".join(chunks)
+
+    try:
+        digest = await run_blocking(blob_store.put, data, media_type)
+    except ValueError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+    return BlobResponse(hash=digest, reference=BLOB_REFERENCE_PREFIX + digest)
+
+
+# Lets clients check whether they need to upload a blob
+@router.head("/blobs/{digest}")
+async def head_blob(digest: str) -> Response:
+    exists = await run_blocking(blob_store.exists, digest)
+    return Response(status_code=200 if exists else 404)
@@ -1,3 +1,4 @@
+import asyncio
 import os
 from fastapi import APIRouter, Query, Request, HTTPException
 from pydantic import BaseModel
@@ -5,7 +6,8 @@ from evals.utils import image_to_data_url
 from evals.config import EVALS_DIR
 from typing import Set
 from evals.runner import run_image_evals
-from typing import List, Dict
+from typing import List
+from codegen.routing import variant_routes
 from llm import Llm
 from prompts.types import Stack
 from pathlib import Path
@@ -160,16 +162,36 @@ class RunEvalsRequest(BaseModel):
 @router.post("/run_evals", response_model=List[str])
 async def run_evals(request: RunEvalsRequest) -> List[str]:
     """Run evaluations on all images in the inputs directory for multiple models"""
-    all_output_files: List[str] = []
-
     for model in request.models:
-        output_files = await run_image_evals(model=model, stack=request.stack)
-        all_output_files.extend(output_files)
+        if model not in [llm.value for llm in Llm]:
+            raise HTTPException(status_code=400, detail=f"Invalid model: {model}")
+
+    # Models run concurrently (each with its own bounded pool, since rate
+    # limits are per provider)
+    results = await asyncio.gather(
+        *[
+            run_image_evals(model=model, stack=request.stack)
+            for model in dict.fromkeys(request.models)
+        ]
+    )
+    return [output_file for output_files in results for output_file in output_files]
 
-    return all_output_files
 
+class VariantRouteResponse(BaseModel):
+    stack: str
+    input_mode: str
+    generation_type: str
+    # "provider:model" candidates for each variant, in order of preference
+    variants: List[List[str]]
 
-@router.get("/models", response_model=Dict[str, List[str]])
+
+class ModelsResponse(BaseModel):
+    models: List[str]
+    stacks: List[str]
+    variant_routes: List[VariantRouteResponse]
+
+
+@router.get("/models", response_model=ModelsResponse)
 async def get_models():
     current_models = [
         model.value
@@ -184,7 +206,13 @@ async def get_models():
     # Import Stack type from prompts.types and get all literal values
     available_stacks = list(Stack.__args__)
 
-    return {"models": current_models, "stacks": available_stacks}
+    return ModelsResponse(
+        models=current_models,
+        stacks=available_stacks,
+        variant_routes=[
+            VariantRouteResponse(**route.to_dict()) for route in variant_routes
+        ],
+    )
 
 
 class BestOfNEvalsResponse(BaseModel):
@@ -1,23 +1,31 @@
 import asyncio
 from dataclasses import dataclass
+import sys
+import time
 import traceback
+import uuid
 from fastapi import APIRouter, WebSocket
 import openai
-from codegen.utils import extract_html_content
+from blobs.core import BlobNotFoundError, blob_store
+from codegen.hedging import CompletionAttempt, hedged_completion
+from codegen.routing import VariantModel, get_variant_route, select_variant_models
+from codegen.stream_stats import empty_completion
+from codegen.utils import StreamingHtmlExtractor, extract_html_content
 from config import (
     ANTHROPIC_API_KEY,
+    CODE_GENERATION_HEDGE_AFTER_SECONDS,
+    CODE_GENERATION_VARIANT_TIMEOUT_SECONDS,
     GEMINI_API_KEY,
     IS_PROD,
-    NUM_VARIANTS,
     OPENAI_API_KEY,
     OPENAI_BASE_URL,
     REPLICATE_API_KEY,
     SHOULD_MOCK_AI_RESPONSE,
 )
 from custom_types import InputMode
+from metrics.core import metrics_registry
 from llm import (
     Completion,
-    Llm,
     stream_claude_response,
     stream_claude_response_native,
     stream_gemini_response,
@@ -25,18 +33,70 @@ from llm import (
 )
 from fs_logging.core import write_logs
 from mock_llm import mock_completion
-from typing import Any, Callable, Coroutine, Dict, List, Literal, cast, get_args
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Coroutine,
+    Dict,
+    List,
+    Literal,
+    cast,
+    get_args,
+)
 from image_generation.core import generate_images
+from image_generation.scheduler import scheduling_group
+from image_generation.single_flight import SingleFlight
+from image_generation.streaming import StreamingImageGenerator
 from prompts import create_prompt
 from prompts.claude_prompts import VIDEO_PROMPT
 from prompts.types import Stack
 
 # from utils import pprint_prompt
-from ws.constants import APP_ERROR_WEB_SOCKET_CODE  # type: ignore
+from ws.chunk_batcher import ChunkBatcher
+from ws.constants import (  # type: ignore
+    APP_ERROR_WEB_SOCKET_CODE,
+    BLOB_NOT_FOUND_WEB_SOCKET_CODE,
+)
+from ws.disconnect import DisconnectWatcher
 
 
 router = APIRouter()
 
+code_generation_requests = metrics_registry.counter(
+    "code_generation_requests",
+    "Code generation requests that started generating",
+    ["input_mode", "generation_type"],
+)
+code_generations_in_progress = metrics_registry.gauge(
+    "code_generations_in_progress", "Code generation requests currently running"
+)
+code_generation_stage_duration = metrics_registry.histogram(
+    "code_generation_stage_seconds",
+    "Duration of each stage of a code generation request",
+    ["stage"],
+)
+websocket_send_duration = metrics_registry.histogram(
+    "websocket_send_seconds", "Time to send a message to the client", ["type"]
+)
+
+
+# Pick the image generation model and API key, or None if images shouldn't be generated
+def get_image_generation_config(
+    should_generate_images: bool, openai_api_key: str | None
+) -> tuple[Literal["dalle3", "flux"], str] | None:
+    replicate_api_key = REPLICATE_API_KEY
+    if not should_generate_images:
+        return None
+
+    if replicate_api_key:
+        return ("flux", replicate_api_key)
+
+    if not openai_api_key:
+        print("No OpenAI API key and Replicate key found. Skipping image generation.")
+        return None
+    return ("dalle3", openai_api_key)
+
 
 # Generate images, if needed
 async def perform_image_generation(
@@ -45,22 +105,19 @@ async def perform_image_generation(
     openai_api_key: str | None,
     openai_base_url: str | None,
     image_cache: dict[str, str],
+    image_generator: StreamingImageGenerator | None = None,
 ):
-    replicate_api_key = REPLICATE_API_KEY
-    if not should_generate_images:
-        return completion
+    # Images may already be generating (started while the code was streaming)
+    if image_generator:
+        print("Generating images with model: ", image_generator.model)
+        return await image_generator.generate_images(completion)
 
-    if replicate_api_key:
-        image_generation_model = "flux"
-        api_key = replicate_api_key
-    else:
-        if not openai_api_key:
-            print(
-                "No OpenAI API key and Replicate key found. Skipping image generation."
-            )
-            return completion
-        image_generation_model = "dalle3"
-        api_key = openai_api_key
+    image_generation_config = get_image_generation_config(
+        should_generate_images, openai_api_key
+    )
+    if image_generation_config is None:
+        return completion
+    image_generation_model, api_key = image_generation_config
 
     print("Generating images with model: ", image_generation_model)
 
@@ -82,6 +139,7 @@ class ExtractedParams:
     anthropic_api_key: str | None
     openai_base_url: str | None
     generation_type: Literal["create", "update"]
+    should_batch_chunks: bool
 
 
 async def extract_params(
@@ -130,6 +188,10 @@ async def extract_params(
         raise ValueError(f"Invalid generation type: {generation_type}")
     generation_type = cast(Literal["create", "update"], generation_type)
 
+    # Clients opt into receiving batched "chunks" messages instead of one
+    # message per chunk. Fall back to False for older clients.
+    should_batch_chunks = bool(params.get("isChunkBatchingEnabled", False))
+
     return ExtractedParams(
         stack=validated_stack,
         input_mode=validated_input_mode,
@@ -138,6 +200,7 @@ async def extract_params(
         anthropic_api_key=anthropic_api_key,
         openai_base_url=openai_base_url,
         generation_type=generation_type,
+        should_batch_chunks=should_batch_chunks,
     )
 
 
@@ -161,12 +224,30 @@ async def stream_code(websocket: WebSocket):
     await websocket.accept()
     print("Incoming websocket connection...")
 
+    # Image generation requests are scheduled fairly between connections
+    scheduling_group.set(uuid.uuid4().hex)
+
     ## Communication protocol setup
+
+    # Only set if the client opted into chunk batching
+    chunk_batcher: ChunkBatcher | None = None
+    # Only set once the params have been received
+    disconnect_watcher: DisconnectWatcher | None = None
+
+    async def send_json(message: dict[str, Any]):
+        with websocket_send_duration.time(type=message["type"]):
+            await websocket.send_json(message)
+
     async def throw_error(
         message: str,
     ):
         print(message)
-        await websocket.send_json({"type": "error", "value": message})
+        if chunk_batcher:
+            await chunk_batcher.flush()
+        # We're closing the connection ourselves
+        if disconnect_watcher:
+            disconnect_watcher.stop()
+        await send_json({"type": "error", "value": message})
         await websocket.close(APP_ERROR_WEB_SOCKET_CODE)
 
     async def send_message(
@@ -180,9 +261,11 @@ async def stream_code(websocket: WebSocket):
         elif type == "status":
             print(f"Status (variant {variantIndex}): {value}")
 
-        await websocket.send_json(
-            {"type": type, "value": value, "variantIndex": variantIndex}
-        )
+        # Send any buffered chunks first so that messages stay in order
+        if chunk_batcher:
+            await chunk_batcher.flush()
+
+        await send_json({"type": type, "value": value, "variantIndex": variantIndex})
 
     ## Parameter extract and validation
 
@@ -190,6 +273,14 @@ async def stream_code(websocket: WebSocket):
     params: dict[str, str] = await websocket.receive_json()
     print("Received params")
 
+    # Images can be references to blobs the client uploaded before (/blobs)
+    try:
+        params = await blob_store.resolve_params(params)
+    except BlobNotFoundError as e:
+        print("Blob not found:", e)
+        await websocket.close(BLOB_NOT_FOUND_WEB_SOCKET_CODE)
+        return
+
     extracted_params = await extract_params(params, throw_error)
     stack = extracted_params.stack
     input_mode = extracted_params.input_mode
@@ -199,235 +290,339 @@ async def stream_code(websocket: WebSocket):
     should_generate_images = extracted_params.should_generate_images
     generation_type = extracted_params.generation_type
 
+    if extracted_params.should_batch_chunks:
+        chunk_batcher = ChunkBatcher(send_json)
+
     print(f"Generating {stack} code in {input_mode} mode")
 
-    for i in range(NUM_VARIANTS):
-        await send_message("status", "Generating code...", i)
+    # Pick the models for the variants from the routing table, depending on
+    # which API keys we have
+    variant_route = get_variant_route(stack, input_mode, generation_type)
+    variant_models = select_variant_models(
+        variant_route,
+        {
+            "openai": openai_api_key,
+            "anthropic": anthropic_api_key,
+            "gemini": GEMINI_API_KEY,
+        },
+    )
+    if SHOULD_MOCK_AI_RESPONSE:
+        num_variants = len(variant_route.variants)
+    elif variant_models:
+        num_variants = len(variant_models)
+    elif input_mode == "video":
+        await throw_error(
+            "Video only works with Anthropic models. No Anthropic API key found. Please add the environment variable ANTHROPIC_API_KEY to backend/.env or in the settings dialog"
+        )
+        raise Exception("No Anthropic key")
+    else:
+        await throw_error(
+            "No OpenAI or Anthropic API key found. Please add the environment variable OPENAI_API_KEY or ANTHROPIC_API_KEY to backend/.env or in the settings dialog. If you add it to .env, make sure to restart the backend server."
+        )
+        raise Exception("No OpenAI or Anthropic key")
 
-    ### Prompt creation
+    print("Variant models:", ", ".join(str(model) for model, _ in variant_models))
+    await send_json({"type": "variantCount", "value": num_variants})
 
-    # Image cache for updates so that we don't have to regenerate images
-    image_cache: Dict[str, str] = {}
+    # Stop generating code and images as soon as the client disconnects
+    disconnect_watcher = DisconnectWatcher(websocket)
+    disconnect_watcher.start()
 
-    try:
-        prompt_messages, image_cache = await create_prompt(params, stack, input_mode)
-    except:
-        await throw_error(
-            "Error assembling prompt. Contact support at support@picoapps.xyz"
-        )
-        raise
+    # Shared by the variants' image generators (created below), and cancelled
+    # along with them if the client disconnects
+    image_single_flight: SingleFlight[str | None] = SingleFlight()
 
-    # pprint_prompt(prompt_messages)  # type: ignore
+    code_generation_requests.inc(input_mode=input_mode, generation_type=generation_type)
+    code_generations_in_progress.inc()
+    start_time = time.perf_counter()
+    try:
+        for i in range(num_variants):
+            await send_message("status", "Generating code...", i)
 
-    ### Code generation
+        ### Prompt creation
 
-    async def process_chunk(content: str, variantIndex: int):
-        await send_message("chunk", content, variantIndex)
+        # Image cache for updates so that we don't have to regenerate images
+        image_cache: Dict[str, str] = {}
 
-    if SHOULD_MOCK_AI_RESPONSE:
-        completion_results = [
-            await mock_completion(process_chunk, input_mode=input_mode)
-        ]
-        completions = [result["code"] for result in completion_results]
-    else:
         try:
-            if input_mode == "video":
-                if not anthropic_api_key:
-                    await throw_error(
-                        "Video only works with Anthropic models. No Anthropic API key found. Please add the environment variable ANTHROPIC_API_KEY to backend/.env or in the settings dialog"
-                    )
-                    raise Exception("No Anthropic key")
-
-                completion_results = [
-                    await stream_claude_response_native(
-                        system_prompt=VIDEO_PROMPT,
-                        messages=prompt_messages,  # type: ignore
-                        api_key=anthropic_api_key,
-                        callback=lambda x: process_chunk(x, 0),
-                        model=Llm.CLAUDE_3_OPUS,
-                        include_thinking=True,
-                    )
-                ]
-                completions = [result["code"] for result in completion_results]
-            else:
+            with code_generation_stage_duration.time(stage="prompt_assembly"):
+                prompt_messages, image_cache = await create_prompt(
+                    params, stack, input_mode
+                )
+        except:
+            await throw_error(
+                "Error assembling prompt. Contact support at support@picoapps.xyz"
+            )
+            raise
 
-                # Depending on the presence and absence of various keys,
-                # we decide which models to run
-                variant_models = []
+        # pprint_prompt(prompt_messages)  # type: ignore
 
-                # For creation, use Claude Sonnet 3.6 but it can be lazy
-                # so for updates, we use Claude Sonnet 3.5
-                if generation_type == "create":
-                    claude_model = Llm.CLAUDE_3_5_SONNET_2024_10_22
-                else:
-                    claude_model = Llm.CLAUDE_3_5_SONNET_2024_06_20
+        ### Code generation
 
-                if openai_api_key and anthropic_api_key:
-                    variant_models = [
-                        claude_model,
-                        Llm.GPT_4O_2024_11_20,
-                    ]
-                elif openai_api_key:
-                    variant_models = [
-                        Llm.GPT_4O_2024_11_20,
-                        Llm.GPT_4O_2024_11_20,
-                    ]
-                elif anthropic_api_key:
-                    variant_models = [
-                        claude_model,
-                        Llm.CLAUDE_3_5_SONNET_2024_06_20,
+        code_generation_start_time = time.perf_counter()
+
+        # Start generating images while the code is still streaming
+        # (one generator per variant, sharing images the variants have in common)
+        image_generators: List[StreamingImageGenerator] = []
+        image_generation_config = get_image_generation_config(
+            should_generate_images, openai_api_key
+        )
+        if image_generation_config:
+            image_generation_model, image_api_key = image_generation_config
+            image_generators = [
+                StreamingImageGenerator(
+                    api_key=image_api_key,
+                    base_url=openai_base_url,
+                    image_cache=image_cache,
+                    model=image_generation_model,
+                    single_flight=image_single_flight,
+                )
+                for _ in range(num_variants)
+            ]
+
+        # Only stream the <html> block of each variant (not the preamble, markdown
+        # fences or explanations). Completions without one (e.g. SVGs) and video
+        # completions, which have several passes, are streamed as is.
+        html_extractors: List[StreamingHtmlExtractor] = []
+        if input_mode != "video":
+            html_extractors = [StreamingHtmlExtractor() for _ in range(num_variants)]
+
+        async def process_chunk(content: str, variantIndex: int):
+            if html_extractors:
+                content = html_extractors[variantIndex].feed(content)
+                if not content:
+                    return
+
+            if image_generators:
+                image_generators[variantIndex].feed(content)
+
+            if chunk_batcher:
+                await chunk_batcher.add(content, variantIndex)
+            else:
+                await send_message("chunk", content, variantIndex)
+
+        if SHOULD_MOCK_AI_RESPONSE:
+            completion_results = [
+                await mock_completion(process_chunk, input_mode=input_mode)
+            ]
+            completions = [result["code"] for result in completion_results]
+        else:
+            try:
+                if input_mode == "video":
+                    video_model, _ = variant_models[0]
+                    assert anthropic_api_key
+                    completion_results = [
+                        await stream_claude_response_native(
+                            system_prompt=VIDEO_PROMPT,
+                            messages=prompt_messages,  # type: ignore
+                            api_key=anthropic_api_key,
+                            callback=lambda x: process_chunk(x, 0),
+                            model=video_model.model,
+                            include_thinking=True,
+                        )
                     ]
+                    completions = [result["code"] for result in completion_results]
                 else:
-                    await throw_error(
-                        "No OpenAI or Anthropic API key found. Please add the environment variable OPENAI_API_KEY or ANTHROPIC_API_KEY to backend/.env or in the settings dialog. If you add it to .env, make sure to restart the backend server."
-                    )
-                    raise Exception("No OpenAI or Anthropic key")
-
-                tasks: List[Coroutine[Any, Any, Completion]] = []
-                for index, model in enumerate(variant_models):
-                    if model == Llm.GPT_4O_2024_11_20 or model == Llm.O1_2024_12_17:
-                        if openai_api_key is None:
-                            await throw_error("OpenAI API key is missing.")
-                            raise Exception("OpenAI API key is missing.")
 
-                        tasks.append(
-                            stream_openai_response(
+                    def start_completion(
+                        variant_model: VariantModel,
+                        callback: Callable[[str], Awaitable[None]],
+                    ) -> Coroutine[Any, Any, Completion]:
+                        if variant_model.provider == "openai":
+                            assert openai_api_key
+                            return stream_openai_response(
                                 prompt_messages,
                                 api_key=openai_api_key,
                                 base_url=openai_base_url,
-                                callback=lambda x, i=index: process_chunk(x, i),
-                                model=model,
+                                callback=callback,
+                                model=variant_model.model,
                             )
-                        )
-                    elif model == Llm.GEMINI_2_0_FLASH_EXP and GEMINI_API_KEY:
-                        tasks.append(
-                            stream_gemini_response(
+                        elif variant_model.provider == "gemini":
+                            assert GEMINI_API_KEY
+                            return stream_gemini_response(
                                 prompt_messages,
                                 api_key=GEMINI_API_KEY,
-                                callback=lambda x, i=index: process_chunk(x, i),
-                                model=Llm.GEMINI_2_0_FLASH_EXP,
+                                callback=callback,
+                                model=variant_model.model,
                             )
-                        )
-                    elif (
-                        model == Llm.CLAUDE_3_5_SONNET_2024_06_20
-                        or model == Llm.CLAUDE_3_5_SONNET_2024_10_22
-                    ):
-                        if anthropic_api_key is None:
-                            await throw_error("Anthropic API key is missing.")
-                            raise Exception("Anthropic API key is missing.")
-
-                        # For creation, use Claude Sonnet 3.6 but it can be lazy
-                        # so for updates, we use Claude Sonnet 3.5
-                        if params["generationType"] == "create":
-                            claude_model = Llm.CLAUDE_3_5_SONNET_2024_10_22
                         else:
-                            claude_model = Llm.CLAUDE_3_5_SONNET_2024_06_20
-
-                        tasks.append(
-                            stream_claude_response(
+                            assert anthropic_api_key
+                            return stream_claude_response(
                                 prompt_messages,
                                 api_key=anthropic_api_key,
-                                callback=lambda x, i=index: process_chunk(x, i),
-                                model=claude_model,
+                                callback=callback,
+                                model=variant_model.model,
                             )
+
+                    # If a variant's model stalls before its first token, race it
+                    # against its fallback (if it has one)
+                    tasks = [
+                        hedged_completion(
+                            [
+                                CompletionAttempt(
+                                    name=str(attempt_model),
+                                    start=lambda callback, m=attempt_model: start_completion(
+                                        m, callback
+                                    ),
+                                )
+                                for attempt_model in [model, fallback_model]
+                                if attempt_model is not None
+                            ],
+                            callback=lambda x, i=index: process_chunk(x, i),
+                            hedge_after_seconds=CODE_GENERATION_HEDGE_AFTER_SECONDS
+                            or None,
+                            timeout_seconds=CODE_GENERATION_VARIANT_TIMEOUT_SECONDS,
                         )
+                        for index, (model, fallback_model) in enumerate(variant_models)
+                    ]
 
-                # Run the models in parallel and capture exceptions if any
-                completions = await asyncio.gather(*tasks, return_exceptions=True)
+                    # Run the models in parallel and capture exceptions if any
+                    completions = await asyncio.gather(*tasks, return_exceptions=True)
 
-                # If all generations failed, throw an error
-                all_generations_failed = all(
-                    isinstance(completion, BaseException) for completion in completions
-                )
-                if all_generations_failed:
-                    await throw_error("Error generating code. Please contact support.")
+                    # If all generations failed, throw an error
+                    all_generations_failed = all(
+                        isinstance(completion, BaseException)
+                        for completion in completions
+                    )
+                    if all_generations_failed:
+                        image_single_flight.cancel()
+                        await throw_error(
+                            "Error generating code. Please contact support."
+                        )
 
-                    # Print the all the underlying exceptions for debugging
-                    for completion in completions:
+                        # Print the all the underlying exceptions for debugging
+                        for completion in completions:
+                            if isinstance(completion, BaseException):
+                                traceback.print_exception(completion)
+                        raise Exception("All generations failed")
+
+                    # If some completions failed, replace them with empty strings
+                    # (and stop generating the images only they were waiting for)
+                    for index, completion in enumerate(completions):
                         if isinstance(completion, BaseException):
-                            traceback.print_exception(completion)
-                    raise Exception("All generations failed")
-
-                # If some completions failed, replace them with empty strings
-                for index, completion in enumerate(completions):
-                    if isinstance(completion, BaseException):
-                        completions[index] = Completion(duration=0, code="")
-                        print("Generation failed for variant", index)
-                        print(completion)
-                    else:
-                        print(
-                            f"{variant_models[index].value} completion took {completion['duration']:.2f} seconds"
-                        )
+                            if image_generators:
+                                image_generators[index].release()
+                            completions[index] = empty_completion()
+                            print("Generation failed for variant", index)
+                            print(completion)
+                        else:
+                            print(
+                                f"{variant_models[index][0]} completion took {completion['duration']:.2f} seconds "
+                                f"(first chunk after {completion['time_to_first_chunk'] or 0:.2f}s, "
+                                f"{completion['chunks']} chunks, {completion['output_tokens']} output tokens)"
+                            )
+
+                    completions = [
+                        result["code"]
+                        for result in completions
+                        if not isinstance(result, BaseException)
+                    ]
 
-                completions = [
-                    result["code"]
-                    for result in completions
-                    if not isinstance(result, BaseException)
-                ]
-
-        except openai.AuthenticationError as e:
-            print("[GENERATE_CODE] Authentication failed", e)
-            error_message = (
-                "Incorrect OpenAI key. Please make sure your OpenAI API key is correct, or create a new OpenAI API key on your OpenAI dashboard."
-                + (
-                    " Alternatively, you can purchase code generation credits directly on this website."
-                    if IS_PROD
-                    else ""
+            except openai.AuthenticationError as e:
+                print("[GENERATE_CODE] Authentication failed", e)
+                error_message = (
+                    "Incorrect OpenAI key. Please make sure your OpenAI API key is correct, or create a new OpenAI API key on your OpenAI dashboard."
+                    + (
+                        " Alternatively, you can purchase code generation credits directly on this website."
+                        if IS_PROD
+                        else ""
+                    )
                 )
-            )
-            return await throw_error(error_message)
-        except openai.NotFoundError as e:
-            print("[GENERATE_CODE] Model not found", e)
-            error_message = (
-                e.message
-                + ". Please make sure you have followed the instructions correctly to obtain an OpenAI key with GPT vision access: https://github.com/abi/screenshot-to-code/blob/main/Troubleshooting.md"
-                + (
-                    " Alternatively, you can purchase code generation credits directly on this website."
-                    if IS_PROD
-                    else ""
+                return await throw_error(error_message)
+            except openai.NotFoundError as e:
+                print("[GENERATE_CODE] Model not found", e)
+                error_message = (
+                    e.message
+                    + ". Please make sure you have followed the instructions correctly to obtain an OpenAI key with GPT vision access: https://github.com/abi/screenshot-to-code/blob/main/Troubleshooting.md"
+                    + (
+                        " Alternatively, you can purchase code generation credits directly on this website."
+                        if IS_PROD
+                        else ""
+                    )
                 )
-            )
-            return await throw_error(error_message)
-        except openai.RateLimitError as e:
-            print("[GENERATE_CODE] Rate limit exceeded", e)
-            error_message = (
-                "OpenAI error - 'You exceeded your current quota, please check your plan and billing details.'"
-                + (
-                    " Alternatively, you can purchase code generation credits directly on this website."
-                    if IS_PROD
-                    else ""
+                return await throw_error(error_message)
+            except openai.RateLimitError as e:
+                print("[GENERATE_CODE] Rate limit exceeded", e)
+                error_message = (
+                    "OpenAI error - 'You exceeded your current quota, please check your plan and billing details.'"
+                    + (
+                        " Alternatively, you can purchase code generation credits directly on this website."
+                        if IS_PROD
+                        else ""
+                    )
                 )
-            )
-            return await throw_error(error_message)
+                return await throw_error(error_message)
 
-    ## Post-processing
+        ## Post-processing
 
-    # Strip the completion of everything except the HTML content
-    completions = [extract_html_content(completion) for completion in completions]
+        if chunk_batcher:
+            await chunk_batcher.flush()
 
-    # Write the messages dict into a log so that we can debug later
-    write_logs(prompt_messages, completions[0])
+        code_generation_stage_duration.observe(
+            time.perf_counter() - code_generation_start_time, stage="code_generation"
+        )
 
-    ## Image Generation
+        # Strip the completion of everything except the HTML content
+        # (already tracked while streaming, unless it's a video completion)
+        completions = [
+            (
+                html_extractors[index].extract(completion)
+                if html_extractors
+                else extract_html_content(completion)
+            )
+            for index, completion in enumerate(completions)
+        ]
 
-    for index, _ in enumerate(completions):
-        await send_message("status", "Generating images...", index)
+        # Write the messages dict into a log so that we can debug later
+        # (in the background)
+        run_log_id = write_logs(prompt_messages, completions[0])
+        print("Queued run log", run_log_id)
 
-    image_generation_tasks = [
-        perform_image_generation(
-            completion,
-            should_generate_images,
-            openai_api_key,
-            openai_base_url,
-            image_cache,
-        )
-        for completion in completions
-    ]
+        ## Image Generation
 
-    updated_completions = await asyncio.gather(*image_generation_tasks)
+        for index, _ in enumerate(completions):
+            await send_message("status", "Generating images...", index)
 
-    for index, updated_html in enumerate(updated_completions):
-        await send_message("setCode", updated_html, index)
-        await send_message("status", "Code generation complete.", index)
+        image_generation_tasks = [
+            perform_image_generation(
+                completion,
+                should_generate_images,
+                openai_api_key,
+                openai_base_url,
+                image_cache,
+                image_generators[index] if image_generators else None,
+            )
+            for index, completion in enumerate(completions)
+        ]
 
-    await websocket.close()
+        with code_generation_stage_duration.time(stage="image_generation"):
+            updated_completions = await asyncio.gather(*image_generation_tasks)
+        if image_single_flight.saved_calls:
+            print(
+                f"Saved {image_single_flight.saved_calls} image generation calls "
+                "shared between variants"
+            )
+
+        for index, updated_html in enumerate(updated_completions):
+            await send_message("setCode", updated_html, index)
+            await send_message("status", "Code generation complete.", index)
+
+        code_generation_stage_duration.observe(
+            time.perf_counter() - start_time, stage="total"
+        )
+        disconnect_watcher.stop()
+        await websocket.close()
+    except asyncio.CancelledError:
+        if not disconnect_watcher.disconnected:
+            raise
+        # The client is gone: stop the work that's still running for it
+        # (cancelling the variants closes their provider streams). On 3.11+
+        # the task also has to stop counting as being cancelled.
+        if sys.version_info >= (3, 11):
+            cast(asyncio.Task[None], asyncio.current_task()).uncancel()
+        image_single_flight.cancel()
+        if chunk_batcher:
+            chunk_batcher.cancel()
+    finally:
+        code_generations_in_progress.dec()
+        disconnect_watcher.stop()
@@ -0,0 +1,37 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from blobs.core import blob_store
+from codegen.hedging import hedging_stats
+from executors.core import cpu_executor
+from fs_logging.core import run_log_writer
+from image_generation.cache import generated_image_cache
+from image_generation.scheduler import scheduler_stats
+from image_processing.cache import processed_image_cache
+from llm import claude_prompt_cache_stats
+from message_translation.core import image_conversion_cache
+from metrics.core import metrics_registry
+from ws.disconnect import cancellation_stats
+
+router = APIRouter()
+
+# Components that keep their own counters are exported as gauges when scraped
+metrics_registry.register_stats("cpu_executor", cpu_executor.stats)
+metrics_registry.register_stats("processed_image_cache", processed_image_cache.stats)
+metrics_registry.register_stats("image_conversion_cache", image_conversion_cache.stats)
+metrics_registry.register_stats("generated_image_cache", generated_image_cache.stats)
+metrics_registry.register_stats("image_generation_scheduler", scheduler_stats)
+metrics_registry.register_stats("claude_prompt_cache", claude_prompt_cache_stats.stats)
+metrics_registry.register_stats("code_generation_hedging", hedging_stats.stats)
+metrics_registry.register_stats(
+    "code_generation_cancellation", cancellation_stats.stats
+)
+metrics_registry.register_stats("run_logs", run_log_writer.stats)
+metrics_registry.register_stats("blob_store", blob_store.stats)
+
+
+# Prometheus text exposition format
+@router.get("/metrics")
+async def get_metrics():
+    return PlainTextResponse(
+        metrics_registry.render(), media_type="text/plain; version=0.0.4"
+    )
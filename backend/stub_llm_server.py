@@ -0,0 +1,143 @@
+import asyncio
+import json
+import time
+
+# Minimal HTTP/1.1 server that streams OpenAI-style chat completion chunks, for
+# tests and benchmarks. It's intentionally dependency-free so that they can
+# control connection behaviour (e.g. simulate TCP/TLS handshake latency for new
+# connections or a slow first token).
+
+
+class StubLlmServer:
+    def __init__(
+        self,
+        tokens: list[str],
+        handshake_latency: float = 0.05,
+        first_token_latency: float = 0.02,
+        token_interval: float = 0.0,
+        prompt_tokens: int = 100,
+        # Like OpenAI-compatible proxies that reject parameters they don't know
+        reject_stream_options: bool = False,
+    ):
+        self.tokens = tokens
+        self.handshake_latency = handshake_latency
+        self.first_token_latency = first_token_latency
+        self.token_interval = token_interval
+        self.prompt_tokens = prompt_tokens
+        self.reject_stream_options = reject_stream_options
+        self.rejected_requests = 0
+        self.connections_opened = 0
+        self.connections_closed = 0
+        self.requests_served = 0
+        self.server: asyncio.Server | None = None
+
+    @property
+    def base_url(self) -> str:
+        assert self.server
+        port = self.server.sockets[0].getsockname()[1]
+        return f"http://127.0.0.1:{port}/v1"
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle_connection, "127.0.0.1", 0)
+
+    async def stop(self):
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+
+    async def handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        self.connections_opened += 1
+        # Simulated cost of establishing a new connection
+        await asyncio.sleep(self.handshake_latency)
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                headers = {}
+                for line in head.decode().split("\r\n")[1:]:
+                    if ":" in line:
+                        name, value = line.split(":", 1)
+                        headers[name.strip().lower()] = value.strip()
+                content_length = int(headers.get("content-length", 0))
+                body = {}
+                if content_length:
+                    body = json.loads(await reader.readexactly(content_length))
+                if self.reject_stream_options and "stream_options" in body:
+                    self.reject(writer)
+                    self.rejected_requests += 1
+                    continue
+                include_usage = bool(
+                    (body.get("stream_options") or {}).get("include_usage")
+                )
+                await self.stream_response(writer, include_usage)
+                self.requests_served += 1
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.connections_closed += 1
+            writer.close()
+
+    def reject(self, writer: asyncio.StreamWriter):
+        body = json.dumps(
+            {
+                "error": {
+                    "message": "Unrecognized request argument: stream_options",
+                    "type": "invalid_request_error",
+                }
+            }
+        ).encode()
+        writer.write(
+            b"HTTP/1.1 400 Bad Request\r\n"
+            b"Content-Type: application/json\r\n"
+            + f"Content-Length: {len(body)}\r\n\r\n".encode()
+            + body
+        )
+
+    async def stream_response(self, writer: asyncio.StreamWriter, include_usage: bool):
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: text/event-stream\r\n"
+            b"Transfer-Encoding: chunked\r\n"
+            b"Connection: keep-alive\r\n\r\n"
+        )
+        await writer.drain()
+        await asyncio.sleep(self.first_token_latency)
+
+        for token in self.tokens:
+            chunk = {
+                "id": "chatcmpl-stub",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": "stub",
+                "choices": [
+                    {"index": 0, "delta": {"content": token}, "finish_reason": None}
+                ],
+            }
+            self.write_chunk(writer, f"data: {json.dumps(chunk)}\n\n".encode())
+            await writer.drain()
+            if self.token_interval:
+                await asyncio.sleep(self.token_interval)
+
+        if include_usage:
+            # Like OpenAI, a last chunk without choices (one token per chunk)
+            usage_chunk = {
+                "id": "chatcmpl-stub",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": "stub",
+                "choices": [],
+                "usage": {
+                    "prompt_tokens": self.prompt_tokens,
+                    "completion_tokens": len(self.tokens),
+                    "total_tokens": self.prompt_tokens + len(self.tokens),
+                },
+            }
+            self.write_chunk(writer, f"data: {json.dumps(usage_chunk)}\n\n".encode())
+
+        self.write_chunk(writer, b"data: [DONE]\n\n")
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    def write_chunk(self, writer: asyncio.StreamWriter, data: bytes):
+        writer.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
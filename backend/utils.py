@@ -1,5 +1,7 @@
 import copy
 import json
+import os
+import uuid
 from typing import List
 from openai.types.chat import ChatCompletionMessageParam
 
@@ -28,3 +30,12 @@ def truncate_data_strings(data: List[ChatCompletionMessageParam]):  # type: igno
         cloned_data = [truncate_data_strings(item) for item in cloned_data]  # type: ignore
 
     return cloned_data  # type: ignore
+
+
+# Write to a temporary file first and then rename it into place, so that
+# readers (and runs that are interrupted halfway) never see a partial file
+def atomic_write(path: str, data: bytes | str):
+    temporary_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(temporary_path, "wb") as f:
+        f.write(data.encode("utf-8") if isinstance(data, str) else data)
+    os.replace(temporary_path, path)
@@ -0,0 +1,136 @@
+import base64
+import io
+import os
+import shutil
+import subprocess
+from pathlib import Path
+from typing import Any, get_args
+import numpy as np
+import pytest
+from moviepy.config import get_setting  # type: ignore
+import video.utils
+from video.utils import (
+    TARGET_NUM_SCREENSHOTS,
+    FrameExtractionMode,
+    VideoFrame,
+    encode_frame,
+    select_distinct_frames,
+    split_video_into_screenshots,
+    write_data_url_to_file,
+)
+
+FFMPEG_BINARY = get_setting("FFMPEG_BINARY")
+requires_ffmpeg = pytest.mark.skipif(
+    not (shutil.which(FFMPEG_BINARY) or os.path.exists(FFMPEG_BINARY)),
+    reason="ffmpeg is not installed",
+)
+
+
+def solid_frame(shade: int) -> VideoFrame:
+    return encode_frame(np.full((180, 320, 3), shade, dtype=np.uint8))
+
+
+def indices_of(selected: list[VideoFrame], frames: list[VideoFrame]) -> list[int]:
+    return [next(i for i, f in enumerate(frames) if f is frame) for frame in selected]
+
+
+def test_near_duplicate_frames_are_dropped():
+    frames = [solid_frame(shade) for shade in [0, 0, 1, 100, 100, 200, 201]]
+
+    selected = select_distinct_frames(frames, max_frames=20)
+
+    # The last of each run of near-identical frames at the end is kept
+    assert indices_of(selected, frames) == [0, 3, 6]
+
+
+def test_most_distinct_frames_are_kept_within_budget_in_order():
+    shades = [0, 10, 60, 70, 200, 210, 220]
+    frames = [solid_frame(shade) for shade in shades]
+
+    selected = select_distinct_frames(frames, max_frames=4)
+
+    # First and last are always kept, then the two biggest changes (0->60, 70->200)
+    assert indices_of(selected, frames) == [0, 2, 4, 6]
+
+
+def test_frames_are_jpeg_encoded():
+    frame = solid_frame(100)
+
+    assert frame.jpeg[:2] == b"\xff\xd8"
+    assert frame.thumbnail.shape == (64 * 64,)
+
+
+# A short test pattern clip (whose frames all differ) as a data URL
+def video_data_url(tmp_path: Path, keyframe_interval: int) -> str:
+    path = tmp_path / "video.mp4"
+    subprocess.run(
+        [
+            FFMPEG_BINARY,
+            "-loglevel",
+            "error",
+            "-y",
+            "-f",
+            "lavfi",
+            "-i",
+            "testsrc=duration=8:size=160x120:rate=10",
+            "-c:v",
+            "libx264",
+            "-preset",
+            "ultrafast",
+            "-g",
+            str(keyframe_interval),
+            "-pix_fmt",
+            "yuv420p",
+            str(path),
+        ],
+        check=True,
+    )
+    return "data:video/mp4;base64," + base64.b64encode(path.read_bytes()).decode()
+
+
+@requires_ffmpeg
+@pytest.mark.parametrize("mode", get_args(FrameExtractionMode))
+def test_every_mode_extracts_the_target_number_of_frames(
+    tmp_path: Path, mode: FrameExtractionMode
+):
+    # A keyframe every 2 frames: enough for the keyframes mode
+    data_url = video_data_url(tmp_path, keyframe_interval=2)
+
+    frames = split_video_into_screenshots(data_url, mode=mode)
+
+    assert len(frames) == TARGET_NUM_SCREENSHOTS
+    assert all(frame.jpeg[:2] == b"\xff\xd8" for frame in frames)
+
+
+@requires_ffmpeg
+def test_keyframes_mode_seeks_when_there_are_too_few_keyframes(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+):
+    # A single keyframe for the whole clip
+    data_url = video_data_url(tmp_path, keyframe_interval=1000)
+    keyframe_counts: list[int] = []
+
+    def extract_keyframes(clip: Any, target_num: int) -> list[VideoFrame]:
+        keyframes = original_extract_keyframes(clip, target_num)
+        keyframe_counts.append(len(keyframes))
+        return keyframes
+
+    original_extract_keyframes = video.utils.extract_keyframes
+    monkeypatch.setattr(video.utils, "extract_keyframes", extract_keyframes)
+
+    frames = split_video_into_screenshots(data_url, mode="keyframes")
+
+    assert keyframe_counts == [1]
+    assert len(frames) == TARGET_NUM_SCREENSHOTS
+
+
+def test_data_urls_are_decoded_in_chunks(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(video.utils, "BASE64_DECODE_CHUNK_SIZE", 8)
+    data = bytes(range(256)) * 3 + b"end"
+    file = io.BytesIO()
+
+    write_data_url_to_file(
+        "data:video/mp4;base64," + base64.b64encode(data).decode(), file
+    )
+
+    assert file.getvalue() == data
@@ -3,43 +3,76 @@ import base64
 import io
 import mimetypes
 import os
+import subprocess
 import tempfile
 import uuid
-from typing import Any, Union, cast
+from dataclasses import dataclass
+from typing import IO, Any, Literal, Union, cast
+from moviepy.config import get_setting  # type: ignore
 from moviepy.editor import VideoFileClip  # type: ignore
+import numpy as np
 from PIL import Image
 import math
 
+from executors.core import cpu_executor
+
 
 DEBUG = True
 TARGET_NUM_SCREENSHOTS = (
     20  # Should be max that Claude supports (20) - reduce to save tokens on testing
 )
 
+# How frames are extracted from the video:
+# - "keyframes": only decode keyframes (falls back to "seek" if there are too few)
+# - "seek": seek to each target timestamp instead of decoding the frames in between
+# - "sequential": decode every frame and keep every Nth one
+FrameExtractionMode = Literal["keyframes", "seek", "sequential"]
+FRAME_EXTRACTION_MODE: FrameExtractionMode = "keyframes"
+
+# We extract more candidate frames than we need and keep the most distinct ones
+# so static stretches of a recording don't use up all the screenshots
+CANDIDATE_FRAMES_MULTIPLIER = 2
+# Frames are compared as grayscale thumbnails of this size
+FRAME_THUMBNAIL_SIZE = (64, 64)
+# Frames that differ from the previously kept frame by less than this
+# (mean absolute difference of thumbnail pixels, 0-255) are dropped as duplicates
+DUPLICATE_FRAME_THRESHOLD = 2.0
+
+# Size (in base64 characters, so a multiple of 4) of the pieces uploaded videos are decoded in
+BASE64_DECODE_CHUNK_SIZE = 1024 * 1024
+
+
+@dataclass
+class VideoFrame:
+    # Frames are JPEG-encoded as soon as they're decoded so that the raw frames
+    # (several MB each) don't have to be kept around
+    jpeg: bytes
+    # Downscaled grayscale version of the frame used to compare frames
+    thumbnail: np.ndarray[Any, Any]
+
 
 async def assemble_claude_prompt_video(video_data_url: str) -> list[Any]:
-    images = split_video_into_screenshots(video_data_url)
+    frames = await cpu_executor.run(split_video_into_screenshots, video_data_url)
 
     # Save images to tmp if we're debugging
     if DEBUG:
-        save_images_to_tmp(images)
+        save_frames_to_tmp(frames)
 
     # Validate number of images
-    print(f"Number of frames extracted from video: {len(images)}")
-    if len(images) > 20:
-        print(f"Too many screenshots: {len(images)}")
+    print(f"Number of frames extracted from video: {len(frames)}")
+    if len(frames) > 20:
+        print(f"Too many screenshots: {len(frames)}")
         raise ValueError("Too many screenshots extracted from video")
 
     # Convert images to the message format for Claude
+    # (releasing each frame once it's been encoded as base64)
     content_messages: list[dict[str, Union[dict[str, str], str]]] = []
-    for image in images:
-
-        # Convert Image to buffer
-        buffered = io.BytesIO()
-        image.save(buffered, format="JPEG")
+    frames.reverse()
+    while frames:
+        frame = frames.pop()
 
         # Encode bytes as base64
-        base64_data = base64.b64encode(buffered.getvalue()).decode("utf-8")
+        base64_data = base64.b64encode(frame.jpeg).decode("utf-8")
         media_type = "image/jpeg"
 
         content_messages.append(
@@ -61,58 +94,190 @@ async def assemble_claude_prompt_video(video_data_url: str) -> list[Any]:
     ]
 
 
-# Returns a list of images/frame (RGB format)
-def split_video_into_screenshots(video_data_url: str) -> list[Image.Image]:
+# Returns a list of JPEG-encoded frames
+def split_video_into_screenshots(
+    video_data_url: str, mode: FrameExtractionMode = FRAME_EXTRACTION_MODE
+) -> list[VideoFrame]:
     target_num_screenshots = TARGET_NUM_SCREENSHOTS
+    num_candidates = target_num_screenshots * CANDIDATE_FRAMES_MULTIPLIER
 
-    # Decode the base64 URL to get the video bytes
-    video_encoded_data = video_data_url.split(",")[1]
-    video_bytes = base64.b64decode(video_encoded_data)
-
-    mime_type = video_data_url.split(";")[0].split(":")[1]
+    mime_type = video_data_url.split(";", 1)[0].split(":")[1]
     suffix = mimetypes.guess_extension(mime_type)
 
+    # ffmpeg needs a file path, so the video is decoded straight into a temp file
+    # (in chunks, without holding a decoded copy of the whole video in memory)
     with tempfile.NamedTemporaryFile(suffix=suffix, delete=True) as temp_video_file:
         print(temp_video_file.name)
-        temp_video_file.write(video_bytes)
+        write_data_url_to_file(video_data_url, temp_video_file)
         temp_video_file.flush()
-        clip = VideoFileClip(temp_video_file.name)
-        images: list[Image.Image] = []
+        # We only need the frames, so skip loading the audio track
+        clip = VideoFileClip(temp_video_file.name, audio=False)
+        frames: list[VideoFrame] = []
         total_frames = cast(int, clip.reader.nframes)  # type: ignore
 
-        # Calculate frame skip interval by dividing total frames by the target number of screenshots
+        # Calculate frame skip interval by dividing total frames by the number of candidate frames
         # Ensuring a minimum skip of 1 frame
-        frame_skip = max(1, math.ceil(total_frames / target_num_screenshots))
-
-        # Iterate over each frame in the clip
-        for i, frame in enumerate(clip.iter_frames()):
-            # Save every nth frame
-            if i % frame_skip == 0:
-                frame_image = Image.fromarray(frame)  # type: ignore
-                images.append(frame_image)
-                # Ensure that we don't capture more than the desired number of frames
-                if len(images) >= target_num_screenshots:
-                    break
+        frame_skip = max(1, math.ceil(total_frames / num_candidates))
+
+        if mode == "keyframes":
+            frames = extract_keyframes(clip, num_candidates)
+            if len(frames) < target_num_screenshots:
+                print(f"Only {len(frames)} keyframes found, seeking instead")
+                mode = "seek"
+
+        if mode == "seek":
+            frame_indices = range(0, total_frames, frame_skip)[:num_candidates]
+            # moviepy seeks (restarting ffmpeg at the timestamp) when the next frame
+            # is far ahead, and only reads forward for nearby frames
+            frames = [
+                encode_frame(clip.get_frame(index / clip.fps))  # type: ignore
+                for index in frame_indices
+            ]
+        elif mode == "sequential":
+            # Iterate over each frame in the clip
+            for i, frame in enumerate(clip.iter_frames()):
+                # Save every nth frame
+                if i % frame_skip == 0:
+                    frames.append(encode_frame(frame))  # type: ignore
+                    # Ensure that we don't capture more than the desired number of frames
+                    if len(frames) >= num_candidates:
+                        break
 
         # Close the video file to release resources
         clip.close()
 
-        return images
+        return select_distinct_frames(frames, target_num_screenshots)
+
+
+# Decode the base64 payload of a data URL into a file, a chunk at a time
+def write_data_url_to_file(data_url: str, file: IO[bytes]):
+    start = data_url.index(",") + 1
+    for offset in range(start, len(data_url), BASE64_DECODE_CHUNK_SIZE):
+        chunk = data_url[offset : offset + BASE64_DECODE_CHUNK_SIZE]
+        file.write(base64.b64decode(chunk))
+
+
+def encode_frame(frame: np.ndarray[Any, Any]) -> VideoFrame:
+    image = Image.fromarray(frame)
+
+    buffered = io.BytesIO()
+    image.save(buffered, format="JPEG")
+
+    # Compare downscaled grayscale frames; cheap and robust to encoding noise
+    thumbnail = np.asarray(
+        image.convert("L").resize(FRAME_THUMBNAIL_SIZE, Image.Resampling.BOX),
+        dtype=np.float32,
+    ).ravel()
+
+    return VideoFrame(jpeg=buffered.getvalue(), thumbnail=thumbnail)
+
+
+# Drop near-duplicate frames and, if there are still more than max_frames,
+# keep the ones that changed the most from the previous frame (in their original order).
+# The first and last frames are always kept.
+def select_distinct_frames(
+    frames: list[VideoFrame], max_frames: int
+) -> list[VideoFrame]:
+    if len(frames) <= 1:
+        return frames
+
+    kept_indices = [0]
+    scores = [math.inf]
+    for index in range(1, len(frames)):
+        score = float(
+            np.abs(frames[index].thumbnail - frames[kept_indices[-1]].thumbnail).mean()
+        )
+        if score >= DUPLICATE_FRAME_THRESHOLD:
+            kept_indices.append(index)
+            scores.append(score)
+
+    # Always keep the final state of the recording. If the last frame was dropped
+    # as a duplicate, it replaces the (near-identical) frame that was kept instead.
+    last_index = len(frames) - 1
+    if kept_indices[-1] != last_index and len(kept_indices) > 1:
+        kept_indices[-1] = last_index
+    scores[-1] = math.inf
+
+    if len(kept_indices) > max_frames:
+        top = np.argsort(-np.array(scores), kind="stable")[:max_frames]
+        kept_indices = [kept_indices[i] for i in sorted(top)]
+
+    print(f"Selected {len(kept_indices)} distinct frames out of {len(frames)}")
+    return [frames[index] for index in kept_indices]
+
+
+# Decode only the keyframes of the clip (cheap since no other frames are decoded)
+# and return up to target_num evenly spaced ones
+def extract_keyframes(clip: Any, target_num: int) -> list[VideoFrame]:
+    width, height = clip.size
+    frame_size = width * height * 3
+    command = [
+        get_setting("FFMPEG_BINARY"),
+        "-loglevel",
+        "error",
+        "-skip_frame",
+        "nokey",
+        "-i",
+        clip.filename,
+        "-vsync",
+        "0",
+        "-vf",
+        f"scale={width}:{height}",
+        "-f",
+        "image2pipe",
+        "-pix_fmt",
+        "rgb24",
+        "-vcodec",
+        "rawvideo",
+        "-",
+    ]
+
+    # Keep at most 2 * target_num frames: whenever we go over, drop every
+    # other frame and only keep every (2 * stride)th frame from then on
+    frames: list[VideoFrame] = []
+    stride = 1
+    index = 0
+    with subprocess.Popen(
+        command,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        stdin=subprocess.DEVNULL,
+        bufsize=frame_size,
+    ) as proc:
+        assert proc.stdout
+        while True:
+            data = proc.stdout.read(frame_size)
+            if len(data) < frame_size:
+                break
+            if index % stride == 0:
+                frame = np.frombuffer(data, dtype=np.uint8).reshape(height, width, 3)
+                frames.append(encode_frame(frame))
+                if len(frames) > 2 * target_num:
+                    frames = frames[::2]
+                    stride *= 2
+            index += 1
+
+    if len(frames) > target_num:
+        step = len(frames) / target_num
+        frames = [frames[int(i * step)] for i in range(target_num)]
+
+    return frames
 
 
-# Save a list of PIL images to a random temporary directory
-def save_images_to_tmp(images: list[Image.Image]):
+# Save a list of frames to a random temporary directory
+def save_frames_to_tmp(frames: list[VideoFrame]):
 
     # Create a unique temporary directory
     unique_dir_name = f"screenshots_{uuid.uuid4()}"
     tmp_screenshots_dir = os.path.join(tempfile.gettempdir(), unique_dir_name)
     os.makedirs(tmp_screenshots_dir, exist_ok=True)
 
-    for idx, image in enumerate(images):
+    for idx, frame in enumerate(frames):
         # Generate a unique image filename using index
         image_filename = f"screenshot_{idx}.jpg"
         tmp_filepath = os.path.join(tmp_screenshots_dir, image_filename)
-        image.save(tmp_filepath, format="JPEG")
+        with open(tmp_filepath, "wb") as f:
+            f.write(frame.jpeg)
 
     print("Saved to " + tmp_screenshots_dir)
 
@@ -0,0 +1,75 @@
+import asyncio
+from typing import Any, Awaitable, Callable
+from ws.constants import CHUNK_BATCH_MAX_BYTES, CHUNK_BATCH_WINDOW_SECONDS
+
+
+class ChunkBatcher:
+    """
+    Buffers streamed chunks per variant and sends them together as a single
+    "chunks" message once the time window elapses or enough bytes are buffered.
+
+    Nobody awaits the window flush, so if its send fails the error is kept and
+    raised from the next add() or flush() instead.
+    """
+
+    def __init__(
+        self,
+        send: Callable[[dict[str, Any]], Awaitable[None]],
+        window: float = CHUNK_BATCH_WINDOW_SECONDS,
+        max_bytes: int = CHUNK_BATCH_MAX_BYTES,
+    ):
+        self.send = send
+        self.window = window
+        self.max_bytes = max_bytes
+        self.buffers: dict[int, list[str]] = {}
+        self.buffered_bytes = 0
+        self.flush_task: asyncio.Task[None] | None = None
+        self.send_error: Exception | None = None
+
+    def raise_send_error(self):
+        if self.send_error is not None:
+            raise self.send_error
+
+    async def add(self, content: str, variant_index: int):
+        self.raise_send_error()
+        self.buffers.setdefault(variant_index, []).append(content)
+        self.buffered_bytes += len(content.encode("utf-8"))
+
+        if self.buffered_bytes >= self.max_bytes:
+            await self.flush()
+        elif self.flush_task is None:
+            self.flush_task = asyncio.create_task(self.flush_after_window())
+
+    async def flush_after_window(self):
+        await asyncio.sleep(self.window)
+        self.flush_task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            self.send_error = e
+
+    async def flush(self):
+        self.raise_send_error()
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+            self.flush_task = None
+
+        if not self.buffers:
+            return
+
+        chunks = [
+            {"variantIndex": variant_index, "value": "".join(parts)}
+            for variant_index, parts in self.buffers.items()
+        ]
+        self.buffers = {}
+        self.buffered_bytes = 0
+
+        await self.send({"type": "chunks", "value": chunks})
+
+    # Drop buffered chunks without sending them (e.g. the client disconnected)
+    def cancel(self):
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+            self.flush_task = None
+        self.buffers = {}
+        self.buffered_bytes = 0
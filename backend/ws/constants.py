@@ -1,2 +1,10 @@
 # WebSocket protocol (RFC 6455) allows for the use of custom close codes in the range 4000-4999
 APP_ERROR_WEB_SOCKET_CODE = 4332
+# A blob reference in the params isn't stored (it was evicted, or the backend
+# restarted): the client should send the image inline (or upload it again)
+BLOB_NOT_FOUND_WEB_SOCKET_CODE = 4334
+
+# Chunk batching (opt-in via the "isChunkBatchingEnabled" param)
+# Buffered chunks are flushed after this window or once this many bytes are buffered
+CHUNK_BATCH_WINDOW_SECONDS = 0.03
+CHUNK_BATCH_MAX_BYTES = 16 * 1024
@@ -0,0 +1,52 @@
+import asyncio
+from dataclasses import dataclass
+from fastapi import WebSocket
+from metrics.core import Counters
+
+
+@dataclass
+class CancellationStats(Counters):
+    """Counts of requests whose work was cancelled because the client left."""
+
+    cancelled_requests: int = 0
+
+
+cancellation_stats = CancellationStats()
+
+
+class DisconnectWatcher:
+    """
+    Waits for the client to disconnect and cancels the task handling the
+    WebSocket (by default the current one) when it does, so that code and
+    image generation for a client that's gone stop right away.
+
+    Only start it once the client is done sending messages (it reads the rest
+    of them), and stop it before the server closes the connection.
+    """
+
+    def __init__(self, websocket: WebSocket, task: asyncio.Task[object] | None = None):
+        self.websocket = websocket
+        self.task = task or asyncio.current_task()
+        self.disconnected = False
+        self.watch_task: asyncio.Task[None] | None = None
+
+    def start(self):
+        self.watch_task = asyncio.create_task(self.watch())
+
+    def stop(self):
+        if self.watch_task is not None:
+            self.watch_task.cancel()
+            self.watch_task = None
+
+    async def watch(self):
+        while True:
+            message = await self.websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+
+        self.disconnected = True
+        self.watch_task = None
+        if self.task is not None and not self.task.done():
+            cancellation_stats.cancelled_requests += 1
+            print("Client disconnected, cancelling code and image generation")
+            self.task.cancel()
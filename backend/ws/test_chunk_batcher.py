@@ -0,0 +1,84 @@
+import asyncio
+from typing import Any
+import pytest
+from ws.chunk_batcher import ChunkBatcher
+
+
+def test_chunks_are_batched_per_variant_within_window():
+    async def run():
+        sent: list[dict[str, Any]] = []
+
+        async def send(message: dict[str, Any]):
+            sent.append(message)
+
+        batcher = ChunkBatcher(send, window=0.01)
+        await batcher.add("<html>", 0)
+        await batcher.add("<html>", 1)
+        await batcher.add("<body>", 0)
+        assert sent == []
+
+        await asyncio.sleep(0.05)
+        assert sent == [
+            {
+                "type": "chunks",
+                "value": [
+                    {"variantIndex": 0, "value": "<html><body>"},
+                    {"variantIndex": 1, "value": "<html>"},
+                ],
+            }
+        ]
+
+    asyncio.run(run())
+
+
+def test_chunks_are_flushed_at_byte_threshold():
+    async def run():
+        sent: list[dict[str, Any]] = []
+
+        async def send(message: dict[str, Any]):
+            sent.append(message)
+
+        batcher = ChunkBatcher(send, window=10, max_bytes=8)
+        await batcher.add("1234", 0)
+        await batcher.add("5678", 0)
+        assert sent == [
+            {"type": "chunks", "value": [{"variantIndex": 0, "value": "12345678"}]}
+        ]
+
+        # Explicit flush with nothing buffered sends nothing
+        await batcher.flush()
+        assert len(sent) == 1
+        assert batcher.flush_task is None
+
+    asyncio.run(run())
+
+
+def test_window_flush_send_errors_are_raised_from_the_next_call():
+    async def run():
+        sent: list[dict[str, Any]] = []
+        unhandled: list[dict[str, Any]] = []
+        asyncio.get_running_loop().set_exception_handler(
+            lambda loop, context: unhandled.append(context)
+        )
+
+        async def send(message: dict[str, Any]):
+            sent.append(message)
+            raise ConnectionError("WebSocket is closed")
+
+        batcher = ChunkBatcher(send, window=0.01)
+        await batcher.add("<html>", 0)
+        await asyncio.sleep(0.05)
+        assert len(sent) == 1
+
+        # The socket is gone: nothing more is sent to it
+        with pytest.raises(ConnectionError):
+            await batcher.add("<body>", 0)
+        with pytest.raises(ConnectionError):
+            await batcher.flush()
+        assert len(sent) == 1
+        assert batcher.flush_task is None
+
+        batcher.cancel()
+        assert unhandled == []
+
+    asyncio.run(run())
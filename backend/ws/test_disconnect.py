@@ -0,0 +1,92 @@
+import asyncio
+import time
+from typing import Any, List
+import pytest
+from clients.core import client_registry
+import routes.generate_code
+from routes.generate_code import stream_code
+from stub_llm_server import StubLlmServer
+from ws.disconnect import cancellation_stats
+
+
+class FakeWebSocket:
+    """The parts of a WebSocket that stream_code uses, driven by a queue."""
+
+    def __init__(self, params: dict[str, Any]):
+        self.incoming: asyncio.Queue[dict[str, Any]] = asyncio.Queue()
+        self.incoming.put_nowait({"type": "websocket.receive", "params": params})
+        self.sent: List[dict[str, Any]] = []
+        self.first_chunk = asyncio.Event()
+        self.closed = False
+
+    async def accept(self):
+        pass
+
+    async def receive(self) -> dict[str, Any]:
+        return await self.incoming.get()
+
+    async def receive_json(self) -> dict[str, Any]:
+        return (await self.receive())["params"]
+
+    async def send_json(self, message: dict[str, Any]):
+        self.sent.append(message)
+        if message["type"] in ("chunk", "chunks"):
+            self.first_chunk.set()
+
+    async def close(self, code: int = 1000):
+        self.closed = True
+
+    def disconnect(self):
+        self.incoming.put_nowait({"type": "websocket.disconnect", "code": 1001})
+
+
+def test_provider_streams_are_closed_when_the_client_disconnects(
+    monkeypatch: pytest.MonkeyPatch,
+):
+    # Only use the stub (OpenAI-compatible) provider for both variants
+    monkeypatch.setattr(routes.generate_code, "ANTHROPIC_API_KEY", None)
+    cancelled_requests = cancellation_stats.cancelled_requests
+
+    async def run():
+        # A slow provider that would take 20 seconds to finish streaming
+        server = StubLlmServer(
+            ["<html>"] + ["<p>x</p>"] * 2000, handshake_latency=0, token_interval=0.01
+        )
+        await server.start()
+        websocket = FakeWebSocket(
+            {
+                "generatedCodeConfig": "html_tailwind",
+                "inputMode": "image",
+                "generationType": "create",
+                "image": "data:image/png;base64,iVBORw0KGgo=",
+                "history": [],
+                "openAiApiKey": "key",
+                "openAiBaseURL": server.base_url,
+                "isImageGenerationEnabled": False,
+            }
+        )
+        try:
+            handler = asyncio.create_task(stream_code(websocket))  # type: ignore
+            await asyncio.wait_for(websocket.first_chunk.wait(), 5)
+
+            websocket.disconnect()
+            disconnect_time = time.perf_counter()
+            # The handler returns (rather than being cancelled or failing)
+            await asyncio.wait_for(handler, 1)
+
+            # And both variants' provider streams are closed soon after
+            while server.connections_closed < server.connections_opened:
+                assert time.perf_counter() - disconnect_time < 1.0
+                await asyncio.sleep(0.01)
+            return (server, websocket)
+        finally:
+            await client_registry.close()
+            await server.stop()
+
+    server, websocket = asyncio.run(run())
+
+    assert server.connections_opened == 2
+    assert cancellation_stats.cancelled_requests == cancelled_requests + 1
+    # Nothing is sent once the client is gone
+    assert websocket.sent[-1]["type"] == "chunk"
+    assert not websocket.closed
@@ -41,6 +41,7 @@ function App() {
     setHead,
     appendCommitCode,
     setCommitCode,
+    setCommitVariantCount,
     resetCommits,
     resetHead,
 
@@ -217,6 +218,8 @@ function App() {
       },
       // On status update
       (line, variantIndex) => appendExecutionConsole(variantIndex, line),
+      // On variant count
+      (count) => setCommitVariantCount(commit.hash, count),
       // On cancel
       () => {
         cancelCodeGenerationAndReset(commit);
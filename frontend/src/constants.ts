@@ -1,3 +1,5 @@
 //  WebSocket protocol (RFC 6455) allows for the use of custom close codes in the range 4000-4999
 export const APP_ERROR_WEB_SOCKET_CODE = 4332;
 export const USER_CLOSE_WEB_SOCKET_CODE = 4333;
+// The backend doesn't have an uploaded blob that the params referred to
+export const BLOB_NOT_FOUND_WEB_SOCKET_CODE = 4334;
@@ -2,8 +2,10 @@ import toast from "react-hot-toast";
 import { WS_BACKEND_URL } from "./config";
 import {
   APP_ERROR_WEB_SOCKET_CODE,
+  BLOB_NOT_FOUND_WEB_SOCKET_CODE,
   USER_CLOSE_WEB_SOCKET_CODE,
 } from "./constants";
+import { forgetBlobReference, toBlobReference } from "./lib/blobs";
 import { FullGenerationSettings } from "./types";
 
 const ERROR_MESSAGE =
@@ -11,11 +13,22 @@ const ERROR_MESSAGE =
 
 const CANCEL_MESSAGE = "Code generation cancelled";
 
-type WebSocketResponse = {
-  type: "chunk" | "status" | "setCode" | "error";
-  value: string;
-  variantIndex: number;
-};
+type WebSocketResponse =
+  | {
+      type: "chunk" | "status" | "setCode" | "error";
+      value: string;
+      variantIndex: number;
+    }
+  | {
+      // Batched chunks (sent when isChunkBatchingEnabled is set)
+      type: "chunks";
+      value: { value: string; variantIndex: number }[];
+    }
+  | {
+      // Number of variants being generated (sent before anything else)
+      type: "variantCount";
+      value: number;
+    };
 
 export function generateCode(
   wsRef: React.MutableRefObject<WebSocket | null>,
@@ -23,8 +36,11 @@ export function generateCode(
   onChange: (chunk: string, variantIndex: number) => void,
   onSetCode: (code: string, variantIndex: number) => void,
   onStatusUpdate: (status: string, variantIndex: number) => void,
+  onVariantCount: (count: number) => void,
   onCancel: () => void,
-  onComplete: () => void
+  onComplete: () => void,
+  // Send images as data URLs rather than references to uploaded blobs
+  inlineImages = false
 ) {
   const wsUrl = `${WS_BACKEND_URL}/generate-code`;
   console.log("Connecting to backend @ ", wsUrl);
@@ -32,16 +48,42 @@ export function generateCode(
   const ws = new WebSocket(wsUrl);
   wsRef.current = ws;
 
-  ws.addEventListener("open", () => {
-    ws.send(JSON.stringify(params));
+  ws.addEventListener("open", async () => {
+    // Send the screenshots (or video) as references to uploaded blobs, so
+    // that they're only uploaded once per session
+    const [image, resultImage] = inlineImages
+      ? [params.image, params.resultImage]
+      : await Promise.all([
+          toBlobReference(params.image),
+          params.resultImage && toBlobReference(params.resultImage),
+        ]);
+    if (ws.readyState !== WebSocket.OPEN) {
+      return;
+    }
+
+    // Opt into receiving streamed chunks in batches to reduce message overhead
+    ws.send(
+      JSON.stringify({
+        ...params,
+        image,
+        resultImage,
+        isChunkBatchingEnabled: true,
+      })
+    );
   });
 
   ws.addEventListener("message", async (event: MessageEvent) => {
     const response = JSON.parse(event.data) as WebSocketResponse;
     if (response.type === "chunk") {
       onChange(response.value, response.variantIndex);
+    } else if (response.type === "chunks") {
+      response.value.forEach((chunk) =>
+        onChange(chunk.value, chunk.variantIndex)
+      );
     } else if (response.type === "status") {
       onStatusUpdate(response.value, response.variantIndex);
+    } else if (response.type === "variantCount") {
+      onVariantCount(response.value);
     } else if (response.type === "setCode") {
       onSetCode(response.value, response.variantIndex);
     } else if (response.type === "error") {
@@ -52,7 +94,25 @@ export function generateCode(
 
   ws.addEventListener("close", (event) => {
     console.log("Connection closed", event.code, event.reason);
-    if (event.code === USER_CLOSE_WEB_SOCKET_CODE) {
+    if (event.code === BLOB_NOT_FOUND_WEB_SOCKET_CODE && !inlineImages) {
+      // Our references are stale: retry with the images inline (and upload
+      // them again next time)
+      forgetBlobReference(params.image);
+      if (params.resultImage) {
+        forgetBlobReference(params.resultImage);
+      }
+      generateCode(
+        wsRef,
+        params,
+        onChange,
+        onSetCode,
+        onStatusUpdate,
+        onVariantCount,
+        onCancel,
+        onComplete,
+        true
+      );
+    } else if (event.code === USER_CLOSE_WEB_SOCKET_CODE) {
       toast.success(CANCEL_MESSAGE);
       onCancel();
     } else if (event.code === APP_ERROR_WEB_SOCKET_CODE) {
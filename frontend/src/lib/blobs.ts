@@ -0,0 +1,69 @@
+import { HTTP_BACKEND_URL } from "../config";
+
+// References to images and videos already uploaded to the backend's blob
+// store, keyed by their data URL
+const blobReferences = new Map<string, Promise<string | null>>();
+
+async function sha256Hex(data: ArrayBuffer): Promise<string> {
+  const digest = await crypto.subtle.digest("SHA-256", data);
+  return Array.from(new Uint8Array(digest))
+    .map((byte) => byte.toString(16).padStart(2, "0"))
+    .join("");
+}
+
+async function uploadBlob(dataUrl: string): Promise<string | null> {
+  try {
+    const blob = await (await fetch(dataUrl)).blob();
+    const hash = await sha256Hex(await blob.arrayBuffer());
+
+    // Only upload if the backend doesn't already have it
+    const existing = await fetch(`${HTTP_BACKEND_URL}/blobs/${hash}`, {
+      method: "HEAD",
+    });
+    if (existing.ok) {
+      return `sha256:${hash}`;
+    }
+
+    const response = await fetch(`${HTTP_BACKEND_URL}/blobs`, {
+      method: "POST",
+      headers: { "Content-Type": blob.type },
+      body: blob,
+    });
+    if (!response.ok) {
+      throw new Error(`Upload failed with status ${response.status}`);
+    }
+    const { reference } = (await response.json()) as { reference: string };
+    return reference;
+  } catch (error) {
+    console.warn("Couldn't upload blob, sending it inline instead", error);
+    return null;
+  }
+}
+
+// Returns what to send instead of a screenshot or video data URL: a reference
+// to it in the backend's blob store (uploaded the first time), or the data URL
+// itself if it couldn't be uploaded
+export async function toBlobReference(dataUrl: string): Promise<string> {
+  if (!dataUrl.startsWith("data:")) {
+    return dataUrl;
+  }
+
+  let reference = blobReferences.get(dataUrl);
+  if (!reference) {
+    reference = uploadBlob(dataUrl);
+    blobReferences.set(dataUrl, reference);
+    // Retry next time if the upload failed
+    reference.then((value) => {
+      if (value === null) {
+        blobReferences.delete(dataUrl);
+      }
+    });
+  }
+  return (await reference) ?? dataUrl;
+}
+
+// Forget the reference to a blob the backend no longer has (e.g. it was
+// evicted, or the backend restarted), so that it's uploaded again next time
+export function forgetBlobReference(dataUrl: string) {
+  blobReferences.delete(dataUrl);
+}
@@ -25,6 +25,7 @@ interface ProjectStore {
     code: string
   ) => void;
   setCommitCode: (hash: CommitHash, numVariant: number, code: string) => void;
+  setCommitVariantCount: (hash: CommitHash, count: number) => void;
   updateSelectedVariantIndex: (hash: CommitHash, index: number) => void;
 
   setHead: (hash: CommitHash) => void;
@@ -111,6 +112,32 @@ export const useProjectStore = create<ProjectStore>((set) => ({
         },
       };
     }),
+  setCommitVariantCount: (hash: CommitHash, count: number) =>
+    set((state) => {
+      const commit = state.commits[hash];
+      // Don't update if the commit is already committed
+      if (commit.isCommitted) {
+        throw new Error(
+          "Attempted to resize the variants of a committed commit"
+        );
+      }
+      return {
+        commits: {
+          ...state.commits,
+          [hash]: {
+            ...commit,
+            variants: Array.from(
+              { length: count },
+              (_, index) => commit.variants[index] ?? { code: "" }
+            ),
+            selectedVariantIndex: Math.min(
+              commit.selectedVariantIndex,
+              count - 1
+            ),
+          },
+        },
+      };
+    }),
   updateSelectedVariantIndex: (hash: CommitHash, index: number) =>
     set((state) => {
       const commit = state.commits[hash];
@@ -35,6 +35,8 @@ export interface CodeGenerationParams {
   generationType: "create" | "update";
   inputMode: "image" | "video";
   image: string;
+  // Screenshot of the current code (for updates)
+  resultImage?: string;
   history?: string[];
   isImportedFromCode?: boolean;
 }